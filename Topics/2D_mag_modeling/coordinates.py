@@ -1,4 +1,6 @@
 import numpy as np
+from numba import jit, prange
+
 
 def rotation_NEU(latitude, longitude):
     '''
@@ -55,7 +57,7 @@ the same numer of elements'
     R23 = coslat*sinlon
     R33 = sinlat
 
-    R = np.vstack([R11, R12, R13, R21, R22, R23, R31, R33]).T
+    R = _rotation_elements(R11, R12, R13, R21, R22, R23, R31, R33)
 
     return R
 
@@ -114,11 +116,151 @@ the same numer of elements'
     R23 = -coslat*sinlon
     R33 = -sinlat
 
-    R = np.vstack([R11, R12, R13, R21, R22, R23, R31, R33]).T
+    R = _rotation_elements(R11, R12, R13, R21, R22, R23, R31, R33)
 
     return R
 
 
+def _rotation_elements(*elements):
+    '''
+    Store the elements of the rotation matrices in the columns of a
+    single array, without the temporary copies created by np.vstack(...).T.
+    '''
+    R = np.empty((elements[0].size, len(elements)))
+    for j, element in enumerate(elements):
+        R[:, j] = element
+    return R
+
+
+def rotate_vectors(latitude, longitude, vectors, system='NEU', inverse=False,
+                   out=None, parallel=False):
+    '''
+    Rotate vectors between a local system (NEU or NED) and the Geocentric
+    Cartesian System, at each computation point, in a single pass without
+    computing the rotation matrices (see the functions rotation_NEU and
+    rotation_NED). By default, the components of the vectors in the local
+    system are transformed into components along the axes X, Y and Z of the
+    Geocentric Cartesian System:
+
+    | X |       | v |
+    | Y | = R * | w | ,
+    | Z |       | u |
+
+    where R is the rotation matrix computed by rotation_NEU (or
+    rotation_NED, with u replaced by -u). If inverse is True, the transpose
+    of R is used to transform geocentric components into local ones.
+
+    input
+
+    latitude: numpy array 1D - vector containing the latitude (in degrees)
+               of the computation points.
+    longitude: numpy array 1D - vector containing the lonitude (in degrees)
+               of the computation points.
+    vectors: numpy array 2D - matrix with 3 lines containing the components
+             of the vectors (one column for each computation point).
+    system: string - local system 'NEU' or 'NED'.
+    inverse: boolean - if True, transform geocentric components into local
+             ones.
+    out: None or numpy array 2D - float64 matrix with the same shape as
+         vectors receiving the rotated vectors. It can be vectors itself,
+         which is then rotated in place.
+    parallel: boolean - if True, the points are rotated in parallel.
+
+    output
+
+    out: numpy array 2D - matrix with 3 lines containing the components of
+         the rotated vectors.
+
+    '''
+    latitude = np.ascontiguousarray(latitude, dtype=np.float64).ravel()
+    longitude = np.ascontiguousarray(longitude, dtype=np.float64).ravel()
+    vectors = np.asarray(vectors, dtype=np.float64)
+
+    assert latitude.size == longitude.size, 'latitude and longitude must have \
+the same numer of elements'
+    assert vectors.shape == (3, latitude.size), 'vectors must be a matrix \
+with 3 lines and one column for each computation point'
+    assert system in ['NEU', 'NED'], 'system must be NEU or NED'
+    if out is None:
+        out = np.empty_like(vectors)
+    assert isinstance(out, np.ndarray) and out.dtype == np.float64, 'out \
+must be a float64 numpy array'
+    assert out.shape == vectors.shape, 'out must have the same shape as \
+vectors'
+
+    if parallel is True:
+        jit_rotate_vectors_parallel(latitude, longitude, vectors,
+                                    system == 'NED', inverse, out)
+    else:
+        jit_rotate_vectors(latitude, longitude, vectors,
+                           system == 'NED', inverse, out)
+
+    return out
+
+
+@jit(nopython=True, cache=True, inline='always')
+def _rotate_point(latitude, longitude, a, b, c, down, inverse):
+    '''
+    Rotate the vector with components a, b and c at a single point.
+    '''
+    # convert degrees to radian as np.deg2rad does
+    lat = latitude*(np.pi/180.)
+    lon = longitude*(np.pi/180.)
+
+    coslat = np.cos(lat)
+    sinlat = np.sin(lat)
+    coslon = np.cos(lon)
+    sinlon = np.sin(lon)
+
+    # the third column of R changes sign in the NED system
+    sign = -1. if down else 1.
+
+    R11 = -sinlat*coslon
+    R21 = -sinlat*sinlon
+    R31 = coslat
+
+    R12 = -sinlon
+    R22 = coslon
+
+    R13 = sign*coslat*coslon
+    R23 = sign*coslat*sinlon
+    R33 = sign*sinlat
+
+    if inverse:
+        return (R11*a + R21*b + R31*c,
+                R12*a + R22*b,
+                R13*a + R23*b + R33*c)
+    return (R11*a + R12*b + R13*c,
+            R21*a + R22*b + R23*c,
+            R31*a + R33*c)
+
+
+@jit(nopython=True, cache=True)
+def jit_rotate_vectors(latitude, longitude, vectors, down, inverse, out):
+    '''
+    Rotate the vectors at all points (see the function rotate_vectors).
+    The components of each point are read before being written, so that
+    out can be vectors itself.
+    '''
+    for i in range(latitude.size):
+        out[0, i], out[1, i], out[2, i] = _rotate_point(
+            latitude[i], longitude[i], vectors[0, i], vectors[1, i],
+            vectors[2, i], down, inverse)
+
+
+@jit(nopython=True, cache=True, parallel=True)
+def jit_rotate_vectors_parallel(latitude, longitude, vectors, down, inverse,
+                                out):
+    '''
+    Rotate the vectors at all points in parallel (see the function
+    rotate_vectors).
+    '''
+    for i in prange(latitude.size):
+        out[0, i], out[1, i], out[2, i] = _rotate_point(
+            latitude[i], longitude[i], vectors[0, i], vectors[1, i],
+            vectors[2, i], down, inverse)
+
+
 def unit_vector_normal(latitude, longitude):
     '''
     Compute the elements of a unit vector u pointing to the direction of
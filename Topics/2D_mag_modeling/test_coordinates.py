@@ -187,3 +187,60 @@ def test_R1_R2_R3_transposition():
     A1 = coord.R3(40)
     A2 = coord.R3(-40).T
     aae(A1, A2, decimal=15)
+
+
+def test_rotate_vectors_versus_rotation_matrices():
+    'Rotated vectors must be equal to the products by the rotation matrices'
+    np.random.seed(0)
+    latitude = np.random.uniform(-90, 90, 50)
+    longitude = np.random.uniform(-180, 180, 50)
+    vectors = np.random.normal(size=(3, 50))
+    for system, rotation in [('NEU', coord.rotation_NEU),
+                             ('NED', coord.rotation_NED)]:
+        R = rotation(latitude, longitude)
+        local_to_geocentric = coord.rotate_vectors(latitude, longitude,
+                                                   vectors, system)
+        geocentric_to_local = coord.rotate_vectors(latitude, longitude,
+                                                   vectors, system,
+                                                   inverse=True)
+        for i, Ri in enumerate(R):
+            M = np.array([[Ri[0], Ri[1], Ri[2]],
+                          [Ri[3], Ri[4], Ri[5]],
+                          [Ri[6],     0, Ri[7]]])
+            aae(local_to_geocentric[:, i], np.dot(M, vectors[:, i]),
+                decimal=14)
+            aae(geocentric_to_local[:, i], np.dot(M.T, vectors[:, i]),
+                decimal=14)
+
+
+def test_rotate_vectors_in_place():
+    'Rotation must be undone by the inverse and can be done in place'
+    np.random.seed(1)
+    latitude = np.random.uniform(-90, 90, 100)
+    longitude = np.random.uniform(-180, 180, 100)
+    vectors = np.random.normal(size=(3, 100))
+    expected = coord.rotate_vectors(latitude, longitude, vectors, 'NED')
+    aae(coord.rotate_vectors(latitude, longitude, expected, 'NED',
+                             inverse=True), vectors, decimal=14)
+    result = vectors.copy()
+    assert coord.rotate_vectors(latitude, longitude, result, 'NED',
+                                out=result) is result
+    aae(result, expected, decimal=15)
+    aae(coord.rotate_vectors(latitude, longitude, vectors, 'NED',
+                             parallel=True), expected, decimal=15)
+
+
+def test_rotate_vectors_bad_arguments():
+    'vectors and out with wrong shapes and unknown system'
+    latitude = np.zeros(10)
+    longitude = np.zeros(10)
+    raises(AssertionError, coord.rotate_vectors, latitude, longitude,
+           np.zeros((3, 9)))
+    raises(AssertionError, coord.rotate_vectors, latitude, np.zeros(9),
+           np.zeros((3, 10)))
+    raises(AssertionError, coord.rotate_vectors, latitude, longitude,
+           np.zeros((3, 10)), 'ENU')
+    raises(AssertionError, coord.rotate_vectors, latitude, longitude,
+           np.zeros((3, 10)), out=np.zeros((3, 9)))
+    raises(AssertionError, coord.rotate_vectors, latitude, longitude,
+           np.zeros((3, 10)), out=np.zeros((3, 10), dtype=np.float32))
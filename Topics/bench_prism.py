@@ -0,0 +1,256 @@
+"""
+Benchmark of the loops used by prism.gravitational
+
+Compares the number of kernel evaluations per second of the generic loop
+``jit_gravitational``, which receives the kernel function as an argument,
+with the loop compiled for each field (``jit_gravitational_single``) and
+with the fused loop computing all fields at once.
+
+Run it with ``python bench_prism.py``.
+
+The function ``suite`` times ``prism.gravitational`` for every field over
+a grid of numbers of computation points, numbers of prisms, numbers of
+threads and precisions, reporting the kernel evaluations per second and
+the peak of memory allocated by each call. The results can be stored as a
+baseline (a JSON file) and later runs compared with it, flagging the
+cases which became slower than a tolerance. Since the timings depend on
+the machine, the baseline must be created on the machine used for the
+comparisons. Run it with::
+
+    python bench_prism.py --suite --save baseline.json
+    python bench_prism.py --suite --baseline baseline.json
+
+See ``python bench_prism.py --help`` for the other options.
+"""
+import argparse
+import itertools
+import json
+import time
+import tracemalloc
+
+import numba
+import numpy as np
+import prism
+
+
+def model(n_points=1000, n_prisms=100, seed=0):
+    """
+    Random computation points and prisms used by the benchmark
+    """
+    rng = np.random.default_rng(seed)
+    coordinates = np.vstack(
+        [
+            rng.uniform(-5000, 5000, n_points),
+            rng.uniform(-5000, 5000, n_points),
+            np.full(n_points, -100.0),
+        ]
+    )
+    west = rng.uniform(-5000, 4500, n_prisms)
+    south = rng.uniform(-5000, 4500, n_prisms)
+    top = rng.uniform(0, 500, n_prisms)
+    prisms = np.column_stack(
+        [west, west + 500, south, south + 500, top, top + 1000]
+    )
+    density = rng.uniform(-500, 500, n_prisms)
+    return coordinates, prisms, density
+
+
+def best_time(function, repeat=5):
+    """
+    Smallest wall time of ``repeat`` calls of function after a first call
+    used to compile it
+    """
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(n_points=1000, n_prisms=100, repeat=5):
+    coordinates, prisms, density = model(n_points, n_prisms)
+    kernels = prism._kernels()
+    # kernel evaluations (8 boundaries of each prism at each point)
+    evaluations = 8 * n_points * n_prisms
+    print(
+        "{} points, {} prisms (million evaluations per second)".format(
+            n_points, n_prisms
+        )
+    )
+    print("{:>10} {:>10} {:>10} {:>8}".format(
+        "field", "generic", "single", "speedup"
+    ))
+    for code, field in enumerate(prism.FIELDS):
+        out = np.zeros(n_points)
+        generic = best_time(
+            lambda: prism.jit_gravitational(
+                coordinates, prisms, density, kernels[field], out
+            ),
+            repeat,
+        )
+        single = best_time(
+            lambda: prism.jit_gravitational_single(
+                coordinates, prisms, density, code, 1.0, out
+            ),
+            repeat,
+        )
+        print("{:>10} {:>10.2f} {:>10.2f} {:>8.2f}".format(
+            field, evaluations / generic / 1e6, evaluations / single / 1e6,
+            generic / single
+        ))
+    separate = best_time(
+        lambda: [
+            prism.gravitational(coordinates, prisms, density, field)
+            for field in prism.FIELDS
+        ],
+        repeat,
+    )
+    fused = best_time(
+        lambda: prism.gravitational(coordinates, prisms, density, "all"),
+        repeat,
+    )
+    print(
+        "all fields: {:.3f} s separately, {:.3f} s fused ({:.2f}x)".format(
+            separate, fused, separate / fused
+        )
+    )
+
+
+def peak_memory(function):
+    """
+    Peak of the memory (in bytes) allocated by Python and numpy during a
+    call of function
+
+    Arrays created inside the compiled functions are not included.
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def suite(points=(1000, 10000), prisms=(100, 1000), workers=(1,),
+          dtypes=("float64", "float32"), fields=prism.FIELDS, repeat=3):
+    """
+    Time prism.gravitational for all combinations of the given numbers of
+    computation points and prisms, numbers of threads, precisions and fields
+
+    One thread runs the serial loop and more threads run the parallel one.
+    Returns a list of dictionaries with the parameters of each case, the
+    smallest wall time (``time``), the kernel evaluations per second
+    (``rate``) and the peak of allocated memory in bytes (``memory``).
+    """
+    records = []
+    for n_points, n_prisms in itertools.product(points, prisms):
+        coordinates, model_prisms, density = model(n_points, n_prisms)
+        evaluations = 8 * n_points * n_prisms
+        for n_workers, dtype, field in itertools.product(
+            workers, dtypes, fields
+        ):
+            def function():
+                prism.gravitational(
+                    coordinates, model_prisms, density, field,
+                    parallel=n_workers > 1, workers=n_workers, dtype=dtype
+                )
+            wall_time = best_time(function, repeat)
+            records.append(dict(
+                field=field, n_points=n_points, n_prisms=n_prisms,
+                workers=n_workers, dtype=dtype, time=wall_time,
+                rate=evaluations / wall_time, memory=peak_memory(function),
+            ))
+    return records
+
+
+def key(record):
+    """
+    Parameters identifying a case of the suite
+    """
+    return (record["field"], record["n_points"], record["n_prisms"],
+            record["workers"], record["dtype"])
+
+
+def regressions(records, baseline, tolerance=0.2):
+    """
+    Cases whose evaluations per second decreased by more than the fraction
+    ``tolerance`` with respect to the baseline
+
+    Returns a list of (record, baseline record) pairs. Cases absent from
+    the baseline are ignored.
+    """
+    reference = {key(record): record for record in baseline}
+    slower = []
+    for record in records:
+        previous = reference.get(key(record))
+        if previous is not None and (
+            record["rate"] < (1 - tolerance) * previous["rate"]
+        ):
+            slower.append((record, previous))
+    return slower
+
+
+def report(records, baseline=None):
+    """
+    Print the results of the suite and their ratio to the baseline
+    """
+    reference = {key(record): record for record in baseline or []}
+    print("{:>10} {:>8} {:>8} {:>7} {:>7} {:>10} {:>10} {:>8}".format(
+        "field", "points", "prisms", "threads", "dtype", "M eval/s",
+        "memory kB", "ratio"
+    ))
+    for record in records:
+        previous = reference.get(key(record))
+        ratio = "" if previous is None else "{:.2f}".format(
+            record["rate"] / previous["rate"]
+        )
+        print("{:>10} {:>8} {:>8} {:>7} {:>7} {:>10.2f} {:>10.1f} {:>8}"
+              .format(record["field"], record["n_points"],
+                      record["n_prisms"], record["workers"], record["dtype"],
+                      record["rate"] / 1e6, record["memory"] / 1e3, ratio))
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--suite", action="store_true",
+                        help="run the benchmark suite")
+    parser.add_argument("--points", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--prisms", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, numba.config.NUMBA_NUM_THREADS}))
+    parser.add_argument("--dtypes", nargs="+", default=["float64", "float32"])
+    parser.add_argument("--fields", nargs="+", default=list(prism.FIELDS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", help="store the results as a baseline")
+    parser.add_argument("--baseline", help="compare with a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="fraction of the baseline evaluations per "
+                        + "second below which a case is a regression")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not args.suite:
+        main()
+    else:
+        records = suite(args.points, args.prisms, args.workers, args.dtypes,
+                        args.fields, args.repeat)
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        report(records, baseline)
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(records, f, indent=1)
+        if baseline is not None:
+            slower = regressions(records, baseline, args.tolerance)
+            for record, previous in slower:
+                print("Regression: {} ({:.2f} M eval/s, baseline {:.2f})"
+                      .format(key(record), record["rate"] / 1e6,
+                              previous["rate"] / 1e6))
+            if slower:
+                raise SystemExit(1)
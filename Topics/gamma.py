@@ -1,4 +1,5 @@
 import numpy as np
+from numba import jit, prange
 
 def WGS84():
     '''
@@ -20,6 +21,388 @@ def WGS84():
     
     return a, f, GM, omega
 
+def GRS80():
+    '''
+    This function returns the following parameters defining the
+    reference elipsoid GRS80:
+    a = semimajor axis [m]
+    f = flattening
+    GM = geocentric gravitational constant of the Earth
+         (including the atmosphere) [m**3/s**2]
+    omega = angular velocity [rad/s]
+
+    output:
+    a, f, GM, omega
+    '''
+    a = 6378137.0
+    f = 1.0/298.257222101
+    GM = 3986005.0*(10**8)
+    omega = 7292115*(10**-11)
+
+    return a, f, GM, omega
+
+class Ellipsoid(object):
+    '''
+    Reference elipsoid storing the quantities used by the normal gravity
+    formulas which depend only on its parameters.
+
+    The quantities b, E, q0, q0linha, m, gammaa and gammab are computed
+    once, when the object is created, so that each call of the methods
+    somigliana and closedform computes only the terms depending on the
+    latitude and height. The results are equal to the ones of the
+    functions somigliana and closedform, which use this class.
+
+    input:
+    a: float containing the semimajor axis [m]
+    f: float containing the flattening
+    GM: float containing the geocentric gravitational constant
+        of the Earth (including the atmosphere) [m**3/s**2]
+    omega: float containing the angular velocity [rad/s]
+
+    The elipsoids WGS84 and GRS80 are created by Ellipsoid.wgs84() and
+    Ellipsoid.grs80().
+    '''
+    def __init__(self, a, f, GM, omega):
+        self.a = a
+        self.f = f
+        self.GM = GM
+        self.omega = omega
+        self.b = a*(1.0-f)
+        self.a2 = a**2
+        self.b2 = self.b**2
+        self.E = np.sqrt(self.a2 - self.b2)
+        self.E2 = self.E**2
+        self.bE = self.b/self.E
+        self.Eb = self.E/self.b
+        self.elinha = self.E/self.b
+        self.atanEb = np.arctan(self.Eb)
+        self.q0 = 0.5*((1+3*(self.bE**2))*self.atanEb - (3*self.bE))
+        self.q0linha = 3.0*(1+(self.bE**2))*(1-(self.bE*self.atanEb)) - 1
+        self.m = (omega**2)*(self.a2)*self.b/GM
+        aux = self.elinha*self.q0linha/self.q0
+        self.gammaa = (GM/(a*self.b))*(1-self.m-(self.m/6.0)*aux)
+        self.gammab = (GM/self.a2)*(1+(self.m/3.0)*aux)
+        # constant factors of the terms of the normal gravity formulas
+        self.agammaa = a*self.gammaa
+        self.bgammab = self.b*self.gammab
+        self.omega2 = omega**2
+        self.omega2a2E = self.omega2*self.a2*self.E
+
+    @classmethod
+    def wgs84(cls):
+        '''
+        Elipsoid WGS84 (see the function WGS84)
+        '''
+        return cls(*WGS84())
+
+    @classmethod
+    def grs80(cls):
+        '''
+        Elipsoid GRS80 (see the function GRS80)
+        '''
+        return cls(*GRS80())
+
+    def somigliana(self, phi, out=None):
+        '''
+        This method calculates the normal gravity by using
+        the Somigliana's formula.
+
+        input:
+        phi: array containing the geodetic latitudes [degree]
+        out: None or array of floats with the shape of phi
+             receiving the values of normal gravity
+
+        output:
+        gamma: array containing the values of normal gravity
+               on the surface of the elipsoid for each geodetic
+               latitude [mGal] (out, if given)
+        '''
+        aux = np.deg2rad(phi)
+        s2 = np.sin(aux)**2
+        c2 = np.cos(aux)**2
+        num = (self.agammaa*c2) + (self.bgammab*s2)
+        # the 10**5 converts from m/s**2 to mGal
+        num *= 10**5
+        return np.divide(num, np.sqrt((self.a2*c2) + (self.b2*s2)), out=out)
+
+    def closedform(self, phi, h, out=None, fused=False, parallel=False):
+        '''
+        This method calculates the normal gravity by using
+        a closed-form formula.
+
+        input:
+        phi: array containing the geodetic latitudes [degree]
+        h: array containing the normal heights [m]
+        out: None or array of floats with the shape of phi and h
+             broadcast together receiving the values of normal gravity
+        fused: if True, the formula is evaluated point by point by a
+               function compiled with numba, which needs no temporary
+               arrays. phi and h must have the same shape, or one of
+               them must have a single element, and out must be a
+               contiguous array of type float64. The results differ from
+               the ones computed with numpy only by rounding errors
+               (below 1e-12 relative, i.e., about 1e-7 mGal)
+        parallel: if True (and fused is True), the points are distributed
+                  among multiple threads
+
+        output:
+        gamma: array containing the values of normal gravity
+               on the surface of the elipsoid for each geodetic
+               latitude [mGal] (out, if given)
+        '''
+        if fused:
+            return self._closedform_fused(phi, h, out, parallel)
+        a, b, E, E2 = self.a, self.b, self.E, self.E2
+        phirad = np.deg2rad(phi)
+        tanphi = np.tan(phirad)
+        cosphi = np.cos(phirad)
+        sinphi = np.sin(phirad)
+        beta = np.arctan(b*tanphi/a)
+        sinbeta = np.sin(beta)
+        cosbeta = np.cos(beta)
+        zl = b*sinbeta+h*sinphi
+        rl = a*cosbeta+h*cosphi
+        zl2 = zl**2
+        rl2 = rl**2
+        dll2 = rl2-zl2
+        rll2 = rl2+zl2
+        D = dll2/E2
+        R = rll2/E2
+        cosbetal = np.sqrt(0.5*(1+R) - np.sqrt(0.25*(1+R**2) - 0.5*D))
+        cosbetal2 = cosbetal**2
+        sinbetal2 = 1-cosbetal2
+        bl = np.sqrt(rll2 - E2*cosbetal2)
+        bl2 = bl**2
+        blE = bl/E
+        Ebl = E/bl
+        atanEbl = np.arctan(Ebl)
+        q0l = 3.0*(1+(blE**2))*(1-(blE*atanEbl)) - 1
+        W = np.sqrt((bl2+E2*sinbetal2)/(bl2+E2))
+
+        gamma = self.GM/(bl2+E2) - cosbetal2*bl*self.omega2
+        gamma += (
+            ((self.omega2a2E*q0l)/((bl2+E2)*self.q0))*(0.5*sinbetal2 - 1./6.)
+        )
+        # the 10**5 converts from m/s**2 to mGal
+        gamma *= 10**5
+        return np.divide(gamma, W, out=out)
+
+    def closedform_chunks(self, phi, h, chunk_size=1000000, out=None,
+                          parallel=False):
+        '''
+        This generator calculates the normal gravity by using the fused
+        closed-form formula (see the method closedform) for chunk_size
+        points at a time, so that only a chunk of the inputs (e.g.,
+        numpy.memmap arrays larger than the memory) is read at once.
+
+        input:
+        phi: 1d array containing the geodetic latitudes [degree]
+        h: 1d array with the size of phi or float containing the normal
+           heights [m]
+        chunk_size: int with the maximum number of points of each chunk
+        out: None or 1d array of floats with the size of phi receiving
+             the values of normal gravity (e.g., created by
+             numpy.lib.format.open_memmap)
+        parallel: if True, the points of each chunk are distributed
+                  among multiple threads
+
+        output (yielded for each chunk, in order):
+        gamma: array containing the values of normal gravity of the
+               points of the chunk [mGal] (a view of out, if given)
+        '''
+        if chunk_size < 1:
+            raise ValueError(
+                'Invalid chunk_size ({}). It must be positive'.format(
+                    chunk_size
+                )
+            )
+        phi = np.asarray(phi)
+        h = np.asarray(h)
+        if phi.ndim != 1 or h.shape not in [(), (1,), phi.shape]:
+            raise ValueError(
+                'phi must be a 1d array and h a float or an array with the '
+                + 'shape of phi'
+            )
+        if out is not None and out.shape != phi.shape:
+            raise ValueError(
+                'Shape of out {} mismatch the shape of phi {}'.format(
+                    out.shape, phi.shape
+                )
+            )
+        for start in range(0, phi.size, chunk_size):
+            stop = min(start + chunk_size, phi.size)
+            chunk_h = h if h.size == 1 else h[start:stop]
+            chunk_out = None if out is None else out[start:stop]
+            yield self._closedform_fused(
+                phi[start:stop], chunk_h, chunk_out, parallel
+            )
+
+    def _closedform_fused(self, phi, h, out, parallel):
+        '''
+        Closed-form normal gravity computed by jit_closedform
+        '''
+        # a float for scalar phi and h, as computed with numpy
+        scalar = out is None and np.ndim(phi) == 0 and np.ndim(h) == 0
+        phi, h, out, result = _fused_input(phi, h, out)
+        args = (phi, h) + self._constants() + (result,)
+        if parallel:
+            jit_closedform_parallel(*args)
+        else:
+            jit_closedform(*args)
+        return out[()] if scalar else out
+
+    def _constants(self):
+        '''
+        Constants of the elipsoid used by _closedform_point
+        '''
+        return (
+            self.a, self.b, self.E, self.E2, self.GM, self.omega2,
+            self.omega2a2E, self.q0
+        )
+
+class NormalGravityTable(object):
+    '''
+    Table of the closed-form normal gravity of an elipsoid on a regular
+    grid of geodetic latitudes and heights, evaluated by bilinear
+    interpolation.
+
+    The spacings of the grid are computed from the largest second
+    derivatives of the normal gravity with respect to the latitude and
+    height in the table (estimated by finite differences), so that the
+    interpolation error is below max_error. The error is then verified at
+    the centers of all cells, where it is largest, and the spacings are
+    reduced until it is below max_error. Points outside the table are
+    computed with the closed-form formula.
+
+    input:
+    ellipsoid: Ellipsoid
+    latitude: (min, max) geodetic latitudes of the table [degree]
+    height: (min, max) heights of the table [m]
+    max_error: float containing the maximum interpolation error [mGal]
+
+    The attributes latitudes and heights contain the nodes of the grid,
+    table the normal gravity at the nodes (with a line per latitude) and
+    error the largest error found at the centers of the cells [mGal].
+    '''
+    def __init__(self, ellipsoid, latitude, height, max_error=1e-3):
+        if max_error < 1e-6:
+            raise ValueError(
+                'Invalid max_error ({}). '.format(max_error)
+                + 'It must be at least 1e-6 mGal, above the rounding errors '
+                + 'of the closed-form formula'
+            )
+        if latitude[0] >= latitude[1] or height[0] >= height[1]:
+            raise ValueError('Invalid latitude or height range')
+        if latitude[0] < -90 or latitude[1] > 90:
+            raise ValueError('The latitudes must be between -90 and 90')
+        self.ellipsoid = ellipsoid
+        self.max_error = max_error
+        # largest second derivatives (per degree**2 and m**2) estimated on
+        # a probe grid, with half of the error allowed to each direction
+        probe_latitudes = np.linspace(latitude[0], latitude[1], 65)
+        probe_heights = np.linspace(height[0], height[1], 65)
+        probe = ellipsoid.closedform(*np.meshgrid(
+            probe_latitudes, probe_heights, indexing='ij'
+        ))
+        d2_latitude = np.abs(np.diff(probe, 2, axis=0)).max() / (
+            probe_latitudes[1] - probe_latitudes[0]
+        )**2
+        d2_height = np.abs(np.diff(probe, 2, axis=1)).max() / (
+            probe_heights[1] - probe_heights[0]
+        )**2
+        # the error of the bilinear interpolation is bounded by
+        # (d2_latitude*dlatitude**2 + d2_height*dheight**2)/8
+        shape = []
+        for (start, stop), d2 in zip([latitude, height],
+                                     [d2_latitude, d2_height]):
+            spacing = np.sqrt(8*0.5*max_error/max(d2, 1e-300))
+            shape.append(max(int(np.ceil((stop - start)/spacing)) + 1, 2))
+        while True:
+            if shape[0]*shape[1] > 10**8:
+                raise ValueError(
+                    'The table would be too large. Increase max_error or '
+                    + 'reduce the latitude and height ranges'
+                )
+            self.latitudes = np.linspace(latitude[0], latitude[1], shape[0])
+            self.heights = np.linspace(height[0], height[1], shape[1])
+            self.table = ellipsoid.closedform(*np.meshgrid(
+                self.latitudes, self.heights, indexing='ij'
+            ), fused=True)
+            centers = np.meshgrid(
+                0.5*(self.latitudes[1:] + self.latitudes[:-1]),
+                0.5*(self.heights[1:] + self.heights[:-1]), indexing='ij'
+            )
+            self.error = np.abs(
+                self.closedform(*centers)
+                - ellipsoid.closedform(*centers, fused=True)
+            ).max()
+            if self.error <= max_error:
+                break
+            # the error decreases with the square of the spacings
+            factor = 1.1*np.sqrt(self.error/max_error)
+            shape = [int(np.ceil((n - 1)*factor)) + 1 for n in shape]
+
+    def closedform(self, phi, h, out=None, parallel=False):
+        '''
+        This method calculates the normal gravity by interpolating the
+        table, or by using the closed-form formula outside it.
+
+        input:
+        phi: array containing the geodetic latitudes [degree]
+        h: array containing the normal heights [m]
+        out: None or contiguous array of float64 receiving the values of
+             normal gravity (see the method closedform of Ellipsoid)
+        parallel: if True, the points are distributed among multiple
+                  threads
+
+        output:
+        gamma: array containing the values of normal gravity
+               [mGal] (out, if given)
+        '''
+        # a float for scalar phi and h, as computed with numpy
+        scalar = out is None and np.ndim(phi) == 0 and np.ndim(h) == 0
+        phi, h, out, result = _fused_input(phi, h, out)
+        args = (
+            phi, h, self.latitudes[0], self.latitudes[1] - self.latitudes[0],
+            self.heights[0], self.heights[1] - self.heights[0], self.table
+        ) + self.ellipsoid._constants() + (result,)
+        if parallel:
+            jit_closedform_table_parallel(*args)
+        else:
+            jit_closedform_table(*args)
+        return out[()] if scalar else out
+
+def _fused_input(phi, h, out):
+    '''
+    Verify the input of the fused normal gravity functions
+
+    Returns phi, h and the base array of out as 1d-arrays, and out (a new
+    array with the shape of phi and h broadcast together if it is None).
+    '''
+    phi = np.asarray(phi, dtype='float64')
+    h = np.asarray(h, dtype='float64')
+    if phi.size != 1 and h.size != 1 and phi.shape != h.shape:
+        raise ValueError(
+            'Shapes of phi {} and h {} mismatch'.format(phi.shape, h.shape)
+        )
+    # the shape of the result computed with numpy
+    shape = np.broadcast(phi, h).shape
+    phi = np.ascontiguousarray(phi)
+    h = np.ascontiguousarray(h)
+    if out is None:
+        out = np.empty(shape)
+    elif out.shape != shape:
+        raise ValueError(
+            'Shape of out {} mismatch the expected shape {}'.format(
+                out.shape, shape
+            )
+        )
+    elif out.dtype != np.float64 or not out.flags.c_contiguous:
+        raise ValueError('out must be a contiguous array of float64')
+    # a view of the base array, so that subclasses such as numpy.memmap
+    # are handled as plain arrays
+    return phi.reshape(-1), h.reshape(-1), out, np.asarray(out).reshape(-1)
+
 def somigliana(a, f, GM, omega, phi):
     '''
     This function calculates the normal gravity by using
@@ -38,27 +421,8 @@ def somigliana(a, f, GM, omega, phi):
            on the surface of the elipsoid for each geodetic
            latitude [mGal]
     '''
-    b = a*(1.0-f)
-    a2 = a**2
-    b2 = b**2
-    E = np.sqrt(a2 - b2)
-    elinha = E/b
-    bE = b/E
-    Eb = E/b
-    atg = np.arctan(Eb)
-    q0 = 0.5*((1+3*(bE**2))*atg - (3*bE))
-    q0linha = 3.0*(1+(bE**2))*(1-(bE*atg)) - 1
-    m = (omega**2)*(a2)*b/GM
-    aux = elinha*q0linha/q0
-    gammaa = (GM/(a*b))*(1-m-(m/6.0)*aux)
-    gammab = (GM/a2)*(1+(m/3.0)*aux)
-    aux = np.deg2rad(phi)
-    s2 = np.sin(aux)**2
-    c2 = np.cos(aux)**2
-    # the 10**5 converts from m/s**2 to mGal
-    gamma = (10**5)*((a*gammaa*c2) + (b*gammab*s2))/np.sqrt((a2*c2) + (b2*s2))
-    return gamma
-    
+    return Ellipsoid(a, f, GM, omega).somigliana(phi)
+
 def closedform(a, f, GM, omega, phi, h):
     '''
     This function calculates the normal gravity by using
@@ -78,14 +442,98 @@ def closedform(a, f, GM, omega, phi, h):
            on the surface of the elipsoid for each geodetic
            latitude [mGal]
     '''
-    b = a*(1.0-f)
-    a2 = a**2
-    b2 = b**2
-    E = np.sqrt(a2 - b2)
-    E2 = E**2
-    bE = b/E
-    Eb = E/b
-    atanEb = np.arctan(Eb)
+    return Ellipsoid(a, f, GM, omega).closedform(phi, h)
+
+@jit(nopython=True, cache=True)
+def jit_closedform(phi, h, a, b, E, E2, GM, omega2, omega2a2E, q0, out):
+    '''
+    Closed-form normal gravity computed point by point (see the method
+    closedform of Ellipsoid). phi and h are 1d arrays with the size of out
+    or with a single element.
+    '''
+    # arrays with a single element are used for all points
+    phi_step = 1 if phi.size > 1 else 0
+    h_step = 1 if h.size > 1 else 0
+    for i in range(out.size):
+        out[i] = _closedform_point(
+            phi[i*phi_step], h[i*h_step], a, b, E, E2, GM, omega2,
+            omega2a2E, q0
+        )
+
+@jit(nopython=True, parallel=True, cache=True)
+def jit_closedform_parallel(phi, h, a, b, E, E2, GM, omega2, omega2a2E, q0,
+                            out):
+    '''
+    Parallel version of jit_closedform
+    '''
+    phi_step = 1 if phi.size > 1 else 0
+    h_step = 1 if h.size > 1 else 0
+    for i in prange(out.size):
+        out[i] = _closedform_point(
+            phi[i*phi_step], h[i*h_step], a, b, E, E2, GM, omega2,
+            omega2a2E, q0
+        )
+
+@jit(nopython=True, cache=True)
+def jit_closedform_table(phi, h, latitude0, dlatitude, height0, dheight,
+                         table, a, b, E, E2, GM, omega2, omega2a2E, q0, out):
+    '''
+    Normal gravity interpolated from a table (see NormalGravityTable), or
+    computed by the closed-form formula outside it. phi and h are 1d arrays
+    with the size of out or with a single element.
+    '''
+    # arrays with a single element are used for all points
+    phi_step = 1 if phi.size > 1 else 0
+    h_step = 1 if h.size > 1 else 0
+    for i in range(out.size):
+        out[i] = _table_point(
+            phi[i*phi_step], h[i*h_step], latitude0, dlatitude, height0,
+            dheight, table, a, b, E, E2, GM, omega2, omega2a2E, q0
+        )
+
+@jit(nopython=True, parallel=True, cache=True)
+def jit_closedform_table_parallel(phi, h, latitude0, dlatitude, height0,
+                                  dheight, table, a, b, E, E2, GM, omega2,
+                                  omega2a2E, q0, out):
+    '''
+    Parallel version of jit_closedform_table
+    '''
+    phi_step = 1 if phi.size > 1 else 0
+    h_step = 1 if h.size > 1 else 0
+    for i in prange(out.size):
+        out[i] = _table_point(
+            phi[i*phi_step], h[i*h_step], latitude0, dlatitude, height0,
+            dheight, table, a, b, E, E2, GM, omega2, omega2a2E, q0
+        )
+
+@jit(nopython=True, cache=True, inline='always')
+def _table_point(phi, h, latitude0, dlatitude, height0, dheight, table, a, b,
+                 E, E2, GM, omega2, omega2a2E, q0):
+    '''
+    Normal gravity at a single point, interpolated from the table or
+    computed by _closedform_point outside it
+    '''
+    u = (phi - latitude0)/dlatitude
+    v = (h - height0)/dheight
+    n_latitudes, n_heights = table.shape
+    if not (0 <= u <= n_latitudes - 1 and 0 <= v <= n_heights - 1):
+        return _closedform_point(phi, h, a, b, E, E2, GM, omega2, omega2a2E,
+                                 q0)
+    i = min(int(u), n_latitudes - 2)
+    j = min(int(v), n_heights - 2)
+    u -= i
+    v -= j
+    return (
+        (1 - u)*((1 - v)*table[i, j] + v*table[i, j + 1])
+        + u*((1 - v)*table[i + 1, j] + v*table[i + 1, j + 1])
+    )
+
+@jit(nopython=True, cache=True, inline='always')
+def _closedform_point(phi, h, a, b, E, E2, GM, omega2, omega2a2E, q0):
+    '''
+    Closed-form normal gravity at a single point, with the operations of
+    the method closedform of Ellipsoid
+    '''
     phirad = np.deg2rad(phi)
     tanphi = np.tan(phirad)
     cosphi = np.cos(phirad)
@@ -109,13 +557,10 @@ def closedform(a, f, GM, omega, phi, h):
     blE = bl/E
     Ebl = E/bl
     atanEbl = np.arctan(Ebl)
-    q0 = 0.5*((1+3*(bE**2))*atanEb - (3*bE))
     q0l = 3.0*(1+(blE**2))*(1-(blE*atanEbl)) - 1
     W = np.sqrt((bl2+E2*sinbetal2)/(bl2+E2))
 
-    gamma = GM/(bl2+E2) - cosbetal2*bl*omega**2
-    gamma += (((omega**2)*a2*E*q0l)/((bl2+E2)*q0))*(0.5*sinbetal2 - 1./6.)
+    gamma = GM/(bl2+E2) - cosbetal2*bl*omega2
+    gamma += ((omega2a2E*q0l)/((bl2+E2)*q0))*(0.5*sinbetal2 - 1./6.)
     # the 10**5 converts from m/s**2 to mGal
-    gamma = (10**5)*gamma/W
-    
-    return gamma
+    return (10**5)*gamma/W
@@ -1,13 +1,20 @@
 '''
 This code presents a general approach for implementing the gravitational
-potential and vertical component of the gravitational acceleration produced
-by a rectangular prism by using the analytical formulas of
+potential, the components of the gravitational acceleration and the
+components of the gravity gradient tensor produced by a rectangular prism
+by using the analytical formulas of
 Nagy et al (2000, 2002). This prototype is highly inspired on
 [Harmonica](https://www.fatiando.org/harmonica/latest/index.html)
 (Uieda et al, 2020). It makes use of the modified arctangent function proposed
 by Fukushima (2020, eq. 72) and of a modified logarithm function for dealing
 with singularities at some computation points.
 
+The compiled functions are stored by numba in the ``__pycache__`` directory
+next to this file (or in the directory defined by the environment variable
+``NUMBA_CACHE_DIR``), so that new processes load them from disk instead of
+compiling them again. The function ``warmup`` compiles, or loads, the
+functions used by ``gravitational`` before the first computation.
+
 References
 
 * Nagy, D., Papp, G., and Benedek, J. (2000). The gravitational potential and
@@ -26,18 +33,47 @@ References
 '''
 
 
+import hashlib
+import itertools
+import os
+import re
+import tempfile
+import time
+import weakref
+
 import numpy as np
-from numba import jit
+import numba
+from numba import jit, prange, types
+from numba.core import event
+from numba.extending import overload
 
 
 #: The gravitational constant in m^3 kg^{-1} s^{-1}
 GRAVITATIONAL_CONST = 0.00000000006673
 
+#: One half in single precision. Numba types numpy scalars defined as globals
+#: with their own type, so products with this constant keep the kernels
+#: evaluated with float32 arguments in single precision. Since 0.5 is exact
+#: in both precisions, the kernels evaluated in double precision are not
+#: changed.
+HALF = np.float32(0.5)
+
+#: Fields computed by the fused kernel ``kernel_fields``. The position of
+#: each field in this tuple is its index in the arrays used by the kernel.
+FIELDS = (
+    "potential", "g_z", "g_x", "g_y",
+    "g_xx", "g_xy", "g_xz", "g_yy", "g_yz", "g_zz"
+)
+
 
-def gravitational(coordinates, prisms, density, field):
+def gravitational(coordinates, prisms, density, field, parallel=False,
+                  workers=None, mesh=False, far_field=None, counts=None,
+                  engine="direct", dtype="float64", out=None,
+                  check_prisms=True, radius=None, bound=None, stats=None):
     """
-    Gravitational potential and vertical component of the gravitational acceleration
-    produced by a right-rectangular prism in Cartesian coordinates.
+    Gravitational potential, components of the gravitational acceleration and
+    components of the gravity gradient tensor produced by a right-rectangular
+    prism in Cartesian coordinates.
     All values are referred to a topocentric Cartesian system with axes
     x, y and z pointing to north, east and down, respectively.
 
@@ -53,216 +89,3224 @@ def gravitational(coordinates, prisms, density, field):
         All coordinates should be in meters.
     density : 1d-array
         1d-array containing the density of each prism in kg/m^3.
-    field : str
+    field : str or list of str
         Gravitational field to be computed.
         The available fields are:
 
         - Gravitational potential: ``potential``
         - z-component of acceleration: ``g_z``
+        - x-component of acceleration: ``g_x``
+        - y-component of acceleration: ``g_y``
+        - Components of the gravity gradient tensor: ``g_xx``, ``g_xy``,
+          ``g_xz``, ``g_yy``, ``g_yz`` and ``g_zz``
+
+        The potential is given in m^2/s^2, the components of acceleration
+        in mGal and the components of the gradient tensor in Eotvos.
+        A list of fields (or ``all`` for every available field) computes
+        all of them in a single pass over the computation points and prisms,
+        sharing the terms common to the different kernels.
+    parallel : bool
+        If True, the computation points are distributed among multiple
+        threads. Each computation point is handled by a single thread, so
+        the result is identical to the one obtained with ``parallel=False``.
+        Default is False.
+    workers : int or None
+        Number of threads used if ``parallel`` is True. If None, the number
+        of threads defined by numba (``NUMBA_NUM_THREADS``) is used.
+    mesh : bool
+        If True, the prisms are treated as the cells of a mesh. The vertices
+        shared by adjacent prisms are merged and the kernel is evaluated only
+        once per unique vertex and computation point, weighted by the sum of
+        the signed densities of the prisms sharing it. Vertices whose weights
+        cancel out (e.g., inside regions of constant density) are skipped.
+        For a regular mesh of n_x * n_y * n_z prisms, this reduces the
+        number of kernel evaluations from 8 * n_x * n_y * n_z to at most
+        (n_x + 1) * (n_y + 1) * (n_z + 1). Vertices are merged only if their
+        coordinates are exactly equal. Default is False.
+    far_field : float or None
+        If given, the field of a prism at a computation point whose distance
+        to the prism center is greater than ``far_field`` times the prism
+        diagonal is approximated by the field of a point mass placed at the
+        prism center. The error of this approximation decreases with the
+        square of the ratio between the diagonal and the distance (with its
+        fourth power for cubes). For a single prism, the worst error over
+        all directions, relative to the largest value of each field at the
+        same distance, is below 5e-5 for cubes and ``far_field=5``. For
+        prisms with sides ratios up to 8 (e.g., 800 x 100 x 100), it is
+        below 4e-3 for the potential, 1e-2 for the acceleration and 2e-2
+        for the gradient tensor at ``far_field=5``, and below 1e-3, 3e-3
+        and 5e-3 at ``far_field=10``. Only single fields without ``mesh``
+        are supported. If None, all prisms are computed
+        with the exact formulas. Default is None.
+    counts : dict or None
+        If a dictionary is given, it receives the number of pairs of
+        computation points and prisms computed with the exact formulas
+        (key ``exact``) and the number of evaluations of the point-mass
+        approximation (key ``approximate``).
+    engine : str
+        Algorithm used to compute the field:
+
+        - ``direct``: sum of the fields of all prisms at each computation
+          point, with cost proportional to ``n_points * n_prisms``.
+        - ``tree``: the prisms are grouped in an octree. A cluster of
+          prisms is replaced by a single point mass, with the total mass
+          of the cluster placed at its center of mass, at the computation
+          points whose distance to the box containing the cluster is
+          greater than ``far_field`` times the box diagonal. Otherwise, its
+          children are visited and the prisms in the leaves are computed
+          with the exact formulas. The cost is proportional to
+          ``n_points * log(n_prisms)`` and the error is controlled by
+          ``far_field``, which is mandatory. The error bounds of a single
+          prism given above hold for clusters of prisms having densities
+          with the same sign. Only single fields without ``mesh`` are
+          supported.
+        - ``fft``: the horizontal positions of the computation points must
+          be nodes of a regular grid whose spacing is equal to the
+          horizontal sides of the prisms, and the prisms must be cells of a
+          regular grid in layers with common top and bottom (the offset
+          between the two grids is arbitrary and the grids may have missing
+          nodes or cells). The field of a prism at a computation point then
+          depends only on the difference between their indices in the
+          grids, so the field of a single prism is computed once for each
+          relative offset, layer and height of the computation points, and
+          the sum over the prisms is a 2D convolution evaluated with the
+          FFT. For ``n_y * n_x`` computation points and prisms in each
+          layer, the cost is proportional to
+          ``n_y * n_x * log(n_y * n_x)`` for each layer instead of
+          ``(n_y * n_x) ** 2``. The result is equal to the one of the
+          ``direct`` engine up to the rounding errors of the FFT (below
+          1e-11 of the largest absolute value). The key ``exact`` of
+          ``counts`` receives the number of relative offsets computed.
+          The ``direct`` engine is used instead if the number of relative
+          offsets times the number of distinct heights of the computation
+          points and of layers of prisms exceeds the number of pairs of
+          computation points and prisms.
+          Only single fields in double precision without ``mesh``,
+          ``far_field`` and ``radius`` are supported. A ``ValueError`` is
+          raised if the grids are not regular.
+
+        Default is ``direct``.
+    dtype : str or numpy dtype
+        Precision used to evaluate the kernels: ``float64`` or ``float32``.
+        In single precision, the coordinates of the computation points and
+        prisms are referred to the center of the box containing the prisms
+        before being converted to float32, the kernels are evaluated in
+        float32 and their sum is accumulated in float64. The kernels of the
+        eight corners of a prism nearly cancel each other at distances much
+        greater than the prism sides, so the error grows quickly with the
+        ratio between the distance and the prism size. The logarithms of the
+        kernels are evaluated in a form that does not cancel near the lines
+        containing the edges of the prisms. For a cube, the worst error over
+        all directions, relative to the largest value of each field at the
+        same distance, is below 2e-4 (potential and acceleration), 1e-5
+        (diagonal of the gradient tensor) and 1e-4 (other components of the
+        tensor) up to 3 times the prism size, below 7e-3, 3e-4 and 3e-3 at
+        10 times and about 2e-1, 7e-3 and 6e-2 at 30 times the prism size.
+        The distance is measured from the center of the prism. For elongated
+        prisms the distance is measured in units of the largest side, and
+        the errors are up to 100 times larger for sides with ratios of up to
+        10. Farther prisms must be computed in double precision. Not
+        available for the ``tree`` engine and ``far_field``, since both are
+        intended for distant prisms. Default is ``float64``.
+    out : array or None
+        Array of type ``float64`` receiving the result, with shape
+        (``n_points``,) for a single field or (``n_fields``, ``n_points``)
+        for a list of fields (in the given order). Its previous values are
+        overwritten. Reusing it in repeated calls avoids allocating the
+        result each time. If None, a new array is created. Default is None.
+    check_prisms : bool
+        If False, the boundaries of the prisms are not verified. Skipping
+        this verification saves a pass over the prisms in repeated calls
+        with a model already known to be valid. Default is True.
+    radius : float or None
+        Truncation radius in meters. If given, only the prisms whose centers
+        are within this distance of a computation point are considered. The
+        centers are indexed by a uniform grid with cells of about the size
+        of the radius, so that each computation point visits only the nearby
+        prisms. Only single fields without ``mesh`` and ``far_field`` are
+        supported. If None, all prisms are considered. Default is None.
+    bound : 1d-array or None
+        Array of type ``float64`` and shape (``n_points``,) receiving an
+        upper bound of the absolute value of the field of the prisms ignored
+        by the truncation ``radius`` at each computation point. All points
+        of an ignored prism are farther than ``d`` = ``radius`` minus half
+        of the largest prism diagonal, so its field is bounded by the one of
+        a point mass with the absolute value of its mass at this distance:
+        ``G * M / d`` for the potential, ``G * M / d**2`` for the components
+        of acceleration and ``2 * G * M / d**3`` for the components of the
+        gradient tensor, in which ``M`` is the total absolute mass of the
+        ignored prisms. The bound is infinite where ``d`` is not positive.
+        Requires ``radius``. Default is None.
+    stats : dict or None
+        If a dictionary is given, its previous content is removed and it
+        receives the wall time in seconds of each phase of the computation:
+        verification of the input (key ``check``), construction of the
+        auxiliary structures of the engines such as the octree, the grid or
+        the vertices of the mesh (``setup``), compilation of the numba
+        functions or their loading from the cache (``compile``) and loops
+        over the computation points (``kernel``, which includes the
+        conversion of units), as well as their sum (``total``). It also
+        receives the number of kernel evaluations (``evaluations``, eight
+        per pair of computation point and prism computed with the exact
+        formulas, one per pair of point and vertex with ``mesh``), of
+        point-mass approximations (``approximate``), the kernel evaluations
+        per second of the loops (``rate``). If the dictionary contains the
+        key ``singular`` set to True (which is kept), it also receives the
+        number of evaluations in which ``safe_log`` and ``safe_atan2``
+        handle singular arguments (``singular_log`` and
+        ``singular_atan2``). They are counted by an additional pass over
+        all pairs of computation points and prisms (in parallel if
+        ``parallel`` is True), not included in ``total``, so they are
+        available only for the ``direct`` engine without ``mesh``,
+        ``far_field`` and ``radius``, in which every pair is evaluated with
+        the exact formulas. If None, nothing is measured. Default is None.
 
     Returns
     -------
-    result : array
+    result : array or dict
         Gravitational field generated by the prisms at the computation points.
+        If ``field`` is a list or ``all``, a dictionary whose keys are the
+        fields and whose values are the corresponding arrays (the lines of
+        ``out``, if given).
 
 
     """
 
+    timer = _Timer(stats)
+
     # Available fields
-    kernels = {
-        "potential": kernel_potential,
-        "g_z": kernel_g_z,
-        "g_x": kernel_g_x
-    }
+    kernels = _kernels()
 
     # Verify the field
-    if field not in kernels:
-        raise ValueError("Gravitational field {} not recognized".format(field))
+    if isinstance(field, str) and field != "all":
+        if field not in kernels:
+            raise ValueError(
+                "Gravitational field {} not recognized".format(field)
+            )
+        fields = None
+    else:
+        fields = _check_fields(field)
 
     # Verify the input parameters
-    coordinates = np.array(coordinates)
-    prisms = np.array(prisms)
-    density = np.array(density)
+    coordinates, prisms, density = _check_input(coordinates, prisms, density)
+    if check_prisms:
+        _check_prisms(prisms)
 
-    if coordinates.ndim != 2:
+    if engine not in ("direct", "tree", "fft"):
+        raise ValueError("Engine {} not recognized".format(engine))
+    if engine == "fft" and (
+        fields is not None or mesh or far_field is not None
+        or radius is not None
+    ):
         raise ValueError(
-            "coordinates ndim ({}) ".format(coordinates.ndim)
-            + "not equal to 2"
+            "The fft engine is available only for a single field, "
+            + "mesh=False and without far_field and radius"
         )
-    if coordinates.shape[0] != 3:
+    if engine == "tree" and far_field is None:
+        raise ValueError("The tree engine requires far_field")
+    if timer.singular and (
+        engine != "direct" or mesh or far_field is not None
+        or radius is not None
+    ):
         raise ValueError(
-            "Number of lines in coordinates ({}) ".format(coordinates.shape[0])
-            + "not equal to 3"
+            "The singular evaluations are counted only for the direct "
+            + "engine without mesh, far_field and radius"
         )
-    if prisms.ndim != 2:
+    if far_field is not None and (fields is not None or mesh):
         raise ValueError(
-            "prisms ndim ({}) ".format(prisms.ndim)
-            + "not equal to 2"
+            "The far field approximation is available only for a single "
+            + "field and mesh=False"
         )
-    if prisms.shape[1] != 6:
+    if far_field is not None and far_field <= 0:
         raise ValueError(
-            "Number of columns in prisms ({}) ".format(prisms.shape[1])
-            + "not equal to 6"
+            "Invalid far_field ({}). It must be positive".format(far_field)
         )
-    if density.ndim != 1:
+    if radius is not None:
+        if fields is not None or mesh or far_field is not None:
+            raise ValueError(
+                "The truncation radius is available only for a single field, "
+                + "mesh=False and without far_field"
+            )
+        if radius <= 0:
+            raise ValueError(
+                "Invalid radius ({}). It must be positive".format(radius)
+            )
+    if bound is not None:
+        if radius is None:
+            raise ValueError("The bound requires a truncation radius")
+        if not isinstance(bound, np.ndarray):
+            raise ValueError(
+                "Invalid bound of type {}. It must be a numpy array".format(
+                    type(bound).__name__
+                )
+            )
+        if bound.shape != (coordinates.shape[1],) or bound.dtype != np.float64:
+            raise ValueError(
+                "Invalid bound with shape {} and dtype {}. ".format(
+                    bound.shape, bound.dtype
+                )
+                + "It must have shape ({},) and dtype float64".format(
+                    coordinates.shape[1]
+                )
+            )
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float64, np.float32):
         raise ValueError(
-            "density ndim ({}) ".format(density.ndim)
-            + "not equal to 1"
+            "Invalid dtype {}. It must be float64 or float32".format(dtype)
         )
-    if density.size != prisms.shape[0]:
+    if dtype == np.float32:
+        if far_field is not None:
+            raise ValueError(
+                "Single precision is not available with far_field"
+            )
+        if engine == "fft":
+            raise ValueError(
+                "Single precision is not available with the fft engine"
+            )
+        coordinates, prisms = _single_precision(coordinates, prisms)
+
+    # number of pairs of points and prisms computed with the exact formulas
+    # and number of evaluations of the point-mass approximation
+    n_exact = coordinates.shape[1] * prisms.shape[0]
+    n_approximate = 0
+
+    # create the array to store the result
+    if fields is None:
+        shape = (coordinates.shape[1],)
+    else:
+        shape = (len(fields), coordinates.shape[1])
+    if out is None:
+        out = np.empty(shape, dtype="float64")
+    elif out.shape != shape:
         raise ValueError(
-            "Number of elements in density ({}) ".format(density.size)
-            + "mismatch the number of prisms ({})".format(prisms.shape[0])
+            "Shape of out {} ".format(out.shape)
+            + "mismatch the expected shape {}".format(shape)
+        )
+    elif out.dtype != np.float64:
+        raise ValueError(
+            "Invalid dtype of out {}. It must be float64".format(out.dtype)
         )
 
-    _check_prisms(prisms)
+    timer.lap("check")
 
-    # create the array to store the result
-    result = np.zeros(coordinates[0].size, dtype="float64")
+    if fields is not None:
+        result = _gravitational_fields(
+            coordinates, prisms, density, fields, parallel, workers, mesh, out,
+            timer
+        )
+        _update_counts(counts, n_exact, n_approximate)
+        timer.finish(coordinates, prisms, fields, n_exact, n_approximate,
+                     parallel, workers)
+        return result
+
+    # a view of the base array is passed to the jit functions, so that
+    # subclasses such as numpy.memmap are handled as plain arrays
+    result = np.asarray(out)
+    scale = _scale(field)
+
+    grids = None
+    if engine == "fft" and n_exact > 0:
+        grids = _regular_grids(coordinates, prisms)
+        timer.lap("setup")
+        if grids.evaluations(density) > n_exact:
+            # many heights of the computation points or layers of prisms,
+            # so the convolutions would cost more than the direct sum
+            grids = None
+            engine = "direct"
 
     # Compute gravitational field
-    jit_gravitational(coordinates, prisms, density, kernels[field], result)
-    result *= GRAVITATIONAL_CONST
-    # Convert from m/s^2 to mGal
-    if field in ["g_x", "g_z"]:
-        result *= 1e5
-    return result
+    if engine == "tree" and prisms.shape[0] == 0:
+        # an empty model has no octree and no field
+        result[:] = 0
+    elif engine == "tree":
+        tree = _octree(prisms, density)
+        timer.lap("setup")
+        args = (
+            coordinates, prisms, density, FIELDS.index(field), tree.order,
+            tree.lower, tree.upper, tree.centers, tree.masses,
+            (far_field * tree.diagonals) ** 2, tree.children, tree.first,
+            tree.count, scale, result
+        )
+        if parallel:
+            n_exact, n_approximate = _run_parallel(
+                jit_gravitational_tree_parallel, workers, *args
+            )
+        else:
+            n_exact, n_approximate = jit_gravitational_tree(*args)
+    elif engine == "fft" and grids is None:
+        # without prisms or computation points there are no grids
+        result[:] = 0
+        n_exact = 0
+    elif engine == "fft":
+        n_exact = grids.convolve(
+            density, FIELDS.index(field), scale, result, parallel, workers
+        )
+    elif radius is not None and prisms.shape[0] == 0:
+        # an empty model has no grid, no field and no ignored prisms
+        result[:] = 0
+        if bound is not None:
+            bound[:] = 0
+    elif radius is not None:
+        grid = _grid(prisms, density, radius)
+        visited = np.empty(coordinates.shape[1])
+        timer.lap("setup")
+        args = (
+            coordinates, prisms, density, FIELDS.index(field), grid.centers,
+            grid.masses, grid.lower, grid.size, grid.shape, grid.order,
+            grid.start, radius, scale, result, visited
+        )
+        if parallel:
+            n_exact = _run_parallel(
+                jit_gravitational_radius_parallel, workers, *args
+            )
+        else:
+            n_exact = jit_gravitational_radius(*args)
+        if bound is not None:
+            _truncation_bound(grid, field, radius, visited, bound)
+    elif far_field is not None:
+        centers, masses, diagonals = _point_masses(prisms, density)
+        timer.lap("setup")
+        args = (
+            coordinates, prisms, density, FIELDS.index(field), centers,
+            masses, (far_field * diagonals) ** 2, scale, result
+        )
+        if parallel:
+            n_approximate = _run_parallel(
+                jit_gravitational_far_field_parallel, workers, *args
+            )
+        else:
+            n_approximate = jit_gravitational_far_field(*args)
+        n_exact -= n_approximate
+    elif mesh:
+        vertices, weights = _mesh_vertices(prisms, density)
+        timer.lap("setup")
+        timer.evaluations = coordinates.shape[1] * vertices.shape[0]
+        if parallel:
+            _run_parallel(
+                jit_gravitational_vertices_parallel, workers,
+                coordinates, vertices, weights, FIELDS.index(field), scale,
+                result
+            )
+        else:
+            jit_gravitational_vertices(
+                coordinates, vertices, weights, FIELDS.index(field), scale,
+                result
+            )
+    elif parallel:
+        _run_parallel(
+            jit_gravitational_single_parallel, workers,
+            coordinates, prisms, density, FIELDS.index(field), scale, result
+        )
+    else:
+        jit_gravitational_single(
+            coordinates, prisms, density, FIELDS.index(field), scale, result
+        )
+    timer.lap("kernel")
+    _update_counts(counts, n_exact, n_approximate)
+    timer.finish(coordinates, prisms, [field], n_exact, n_approximate,
+                 parallel, workers)
+    return out
 
 
-def _check_prisms(prisms):
+def warmup(fields="all", parallel=False, mesh=False, dtype="float64"):
     """
-    Check if prisms boundaries are well defined
+    Compile the functions used by ``gravitational`` for the given fields
+
+    The compiled functions are loaded from the on-disk cache if available
+    and stored in it otherwise. Calling this function in a parent process
+    before starting workers (e.g., with ``multiprocessing`` using ``fork``)
+    avoids the compilation in each worker.
 
     Parameters
     ----------
-    prisms : 2d-array
-        Array containing the boundaries of the prisms in the following order:
-        ``w``, ``e``, ``s``, ``n``, ``top``, ``bottom``.
-        The array must have the following shape: (``n_prisms``, 6), where
-        ``n_prisms`` is the total number of prisms.
-        This array of prisms must have valid boundaries.
-        Run ``_check_prisms`` before.
+    fields : str or list of str
+        Field, list of fields or ``all``. Each field is compiled for single
+        field computations and, if more than one is given, the list is
+        compiled for computations of several fields. Default is ``all``.
+    parallel : bool
+        If True, compile the parallel loops. Default is False.
+    mesh : bool
+        If True, compile the loops over the vertices of a mesh.
+        Default is False.
+    dtype : str or numpy dtype
+        Precision of the kernels: ``float64`` or ``float32``.
+        Default is ``float64``.
     """
-    west, east, south, north, top, bottom = tuple(prisms[:, i] for i in range(6))
-    err_msg = "Invalid prism or prisms. "
-    bad_we = west > east
-    bad_sn = south > north
-    bad_bt = top > bottom
-    if bad_we.any():
-        err_msg += "The west boundary can't be greater than the east one.\n"
-        for prism in prisms[bad_we]:
-            err_msg += "\tInvalid prism: {}\n".format(prism)
-        raise ValueError(err_msg)
-    if bad_sn.any():
-        err_msg += "The south boundary can't be greater than the north one.\n"
-        for prism in prisms[bad_sn]:
-            err_msg += "\tInvalid prism: {}\n".format(prism)
-        raise ValueError(err_msg)
-    if bad_bt.any():
-        err_msg += "The top boundary can't be greater than the bottom one.\n"
-        for prism in prisms[bad_bt]:
-            err_msg += "\tInvalid prism: {}\n".format(prism)
-        raise ValueError(err_msg)
+    if isinstance(fields, str) and fields != "all":
+        fields = [fields]
+    fields = _check_fields(fields)
+    coordinates = np.zeros((3, 1))
+    prisms = np.array([[-1.0, 1.0, -1.0, 1.0, 1.0, 2.0]])
+    density = np.ones(1)
+    for field in fields:
+        gravitational(coordinates, prisms, density, field, parallel=parallel,
+                      mesh=mesh, dtype=dtype)
+    if len(fields) > 1:
+        gravitational(coordinates, prisms, density, fields, parallel=parallel,
+                      mesh=mesh, dtype=dtype)
 
 
-@jit(nopython=True)
-def jit_gravitational(coordinates, prisms, density, kernel, out):
+def gravitational_chunks(stations, prisms, density, field,
+                         chunk_size=100000, out=None, delimiter=",",
+                         skiprows=0, **kwargs):
     """
-    Compute gravitational field at the computations points
+    Compute a gravitational field at the stations of a survey in chunks
+
+    The stations are read and computed ``chunk_size`` at a time, so that the
+    memory used does not depend on the number of stations. This generator
+    yields the result of each chunk, in the order of the stations.
+
+    Parameters
+    ----------
+    stations : 2d-array, iterable or str
+        Coordinates of the computation points, given as:
+
+        - a 2d-array with the same layout of the ``coordinates`` of
+          ``gravitational`` (e.g., a ``numpy.memmap``);
+        - an iterable of 2d-arrays with this layout, each one containing
+          some of the stations;
+        - the name of a ``.npy`` file containing such an array, which is
+          memory-mapped;
+        - the name of a ``.csv`` or ``.txt`` file with the coordinates y, x
+          and z of one station per line;
+        - the name of any other file, read as raw float64 binary data with
+          the coordinates y, x and z of each station in sequence.
+
+    prisms : 2d-array
+        Boundaries of the prisms. See ``gravitational``.
+    density : 1d-array
+        Density of each prism in kg/m^3.
+    field : str or list of str
+        Gravitational field or fields to be computed. See ``gravitational``.
+    chunk_size : int
+        Maximum number of stations computed at once. Default is 100000.
+    out : array or None
+        Array of type ``float64`` receiving the results (e.g., created by
+        ``numpy.lib.format.open_memmap``), with shape (``n_stations``,) for
+        a single field or (``n_fields``, ``n_stations``) for a list of
+        fields. If given, the yielded arrays are views of ``out``.
+        Default is None.
+    delimiter : str
+        Delimiter of the columns of text files. Use None for whitespace.
+        Default is ``,``.
+    skiprows : int
+        Number of lines skipped at the beginning of text files (e.g., a
+        header). Default is 0.
+    **kwargs
+        Other parameters of ``gravitational``. The prisms are verified only
+        once. The vertices of the ``mesh`` and the octree of the ``tree``
+        engine are built for each chunk. If ``counts`` is given, it receives
+        the sum of the counts of all chunks.
+
+    Yields
+    ------
+    result : array or dict
+        Field at the stations of a chunk. If ``field`` is a list or ``all``,
+        a dictionary whose keys are the fields and whose values are the
+        corresponding arrays.
     """
-    # Iterate over computation points
-    for l in range(coordinates[0].size):
-        # Iterate over prisms
-        for m in range(prisms.shape[0]):
-            # Iterate over the prism boundaries
-            for i in range(2,0,-1):
-                for j in range(2,0,-1):
-                    for k in range(2,0,-1):
-                        Y = prisms[m, -1 + j] - coordinates[0, l]
-                        X = prisms[m, 1 + i] - coordinates[1, l]
-                        Z = prisms[m, 3 + k] - coordinates[2, l]
-                        out[l] += (
-                            density[m]
-                            * (-1) ** (i + j + k)
-                            * kernel(Y, X, Z)
-                        )
+    if chunk_size < 1:
+        raise ValueError(
+            "Invalid chunk_size ({}). It must be positive".format(chunk_size)
+        )
+    prisms = np.ascontiguousarray(prisms, dtype="float64")
+    density = np.ascontiguousarray(density, dtype="float64")
+    _check_input(np.zeros((3, 0)), prisms, density)
+    if kwargs.pop("check_prisms", True):
+        _check_prisms(prisms)
+    counts = kwargs.pop("counts", None)
+    if counts is not None:
+        counts["exact"] = counts["approximate"] = 0
+    start = 0
+    for coordinates in _station_chunks(stations, chunk_size, delimiter,
+                                       skiprows):
+        stop = start + coordinates.shape[1]
+        chunk_out = None
+        if out is not None:
+            if stop > out.shape[-1]:
+                raise ValueError(
+                    "Number of stations greater than the size of out "
+                    + "({})".format(out.shape[-1])
+                )
+            chunk_out = out[..., start:stop]
+        chunk_counts = None if counts is None else {}
+        result = gravitational(
+            coordinates, prisms, density, field, out=chunk_out,
+            counts=chunk_counts, check_prisms=False, **kwargs
+        )
+        if counts is not None:
+            counts["exact"] += chunk_counts["exact"]
+            counts["approximate"] += chunk_counts["approximate"]
+        start = stop
+        yield result
+    if out is not None and start != out.shape[-1]:
+        raise ValueError(
+            "Number of stations ({}) ".format(start)
+            + "mismatch the size of out ({})".format(out.shape[-1])
+        )
 
-@jit(nopython=True)
-def kernel_potential(Y, X, Z):
+
+class ForwardModel(object):
     """
-    Kernel function for potential gravitational field generated by a prism
+    Gravitational field of a model whose prisms change a few at a time.
+
+    The field of all prisms is computed once by ``gravitational``. Then,
+    each call of ``update`` changes the density or the boundaries of some
+    prisms and adds the difference between their new and old fields to the
+    stored field. The cost of an update is proportional to
+    ``n_points * n_changed`` instead of ``n_points * n_prisms``, which
+    suits interactive modeling and Markov chain Monte Carlo inversions.
+
+    Each update adds rounding errors to the stored field, at the level of
+    the rounding errors of the changed fields. After many updates (e.g.,
+    a long Markov chain), ``refresh`` computes the field from scratch.
+
+    Parameters
+    ----------
+    coordinates : 2d-array
+        2d-array containing y (first line), x (second line), and z (third line) of
+        the computation points. All coordinates should be in meters.
+    prisms : 2d-array
+        2d-array containing the coordinates of the prisms. Each line must contain
+        the coordinates of a single prism in the following order:
+        west, east, south, north, top and bottom.
+        All coordinates should be in meters.
+    density : 1d-array
+        1d-array containing the density of each prism in kg/m^3.
+    field : str or list of str
+        Gravitational field or fields to be computed. See
+        ``gravitational``.
+    parallel : bool
+        If True, the fields are computed in parallel. Default is False.
+    workers : int or None
+        Number of threads used if ``parallel`` is True.
+
+    Attributes
+    ----------
+    prisms : 2d-array
+        Current boundaries of the prisms (a copy of the given ones).
+    density : 1d-array
+        Current density of each prism (a copy of the given one).
+    result : array or dict
+        Current field, as returned by ``gravitational``. It is updated in
+        place, so that references to it see the changes.
     """
-    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
-    kernel = (
-        Y * X * safe_log(Z + radius)
-        + X * Z * safe_log(Y + radius)
-        + Y * Z * safe_log(X + radius)
-        - 0.5 * Y ** 2 * safe_atan2(Z * X, Y * radius)
-        - 0.5 * X ** 2 * safe_atan2(Z * Y, X * radius)
-        - 0.5 * Z ** 2 * safe_atan2(Y * X, Z * radius)
-    )
-    return kernel
 
+    def __init__(self, coordinates, prisms, density, field, parallel=False,
+                 workers=None):
+        coordinates, prisms, density = _check_input(
+            coordinates, prisms, density
+        )
+        _check_prisms(prisms)
+        self.coordinates = coordinates
+        self.prisms = prisms.copy()
+        self.density = density.copy()
+        self.field = field
+        self.parallel = parallel
+        self.workers = workers
+        if isinstance(field, str) and field != "all":
+            shape = (coordinates.shape[1],)
+        else:
+            shape = (len(_check_fields(field)), coordinates.shape[1])
+        # the fields are stored in _out and the changes computed in _delta
+        self._out = np.empty(shape)
+        self._delta = np.empty(shape)
+        self.result = gravitational(
+            self.coordinates, self.prisms, self.density, field,
+            parallel=parallel, workers=workers, out=self._out,
+            check_prisms=False
+        )
+
+    def update(self, indices, density=None, prisms=None):
+        """
+        Change the density and/or the boundaries of some prisms
 
-@jit(nopython=True)
-def kernel_g_z(Y, X, Z):
+        Parameters
+        ----------
+        indices : int, 1d-array of int or 1d-array of bool
+            Indices of the changed prisms, without repetitions, or a boolean
+            mask with one element per prism which is True for the changed
+            prisms.
+        density : float, 1d-array or None
+            New density of each changed prism. If None, the densities are
+            not changed.
+        prisms : 2d-array or None
+            New boundaries of each changed prism, one line per index. If
+            None, the boundaries are not changed.
+
+        Returns
+        -------
+        result : array or dict
+            The updated ``result``.
+        """
+        indices = np.atleast_1d(np.asarray(indices))
+        if indices.ndim != 1:
+            raise ValueError(
+                "The indices of the changed prisms must be a 1d-array"
+            )
+        if indices.dtype == np.bool_:
+            if indices.size != self.density.size:
+                raise ValueError(
+                    "The mask of the changed prisms has {} ".format(
+                        indices.size
+                    )
+                    + "elements instead of {}".format(self.density.size)
+                )
+            indices = np.flatnonzero(indices)
+        elif indices.size and not np.issubdtype(indices.dtype, np.integer):
+            # floats are not truncated to integers
+            raise ValueError(
+                "Invalid indices of type {}. They must be integers".format(
+                    indices.dtype
+                )
+            )
+        indices = indices.astype("int64")
+        if indices.size and (
+            indices.min() < -self.density.size
+            or indices.max() >= self.density.size
+        ):
+            raise ValueError(
+                "Invalid indices for {} prisms".format(self.density.size)
+            )
+        # negative indices are converted to positive ones, so that two
+        # indices of the same prism (e.g., 1 and -1) count as repetitions
+        indices = indices % self.density.size
+        if np.unique(indices).size != indices.size:
+            raise ValueError(
+                "The indices of the changed prisms must not have repetitions"
+            )
+        old_prisms = self.prisms[indices]
+        old_density = self.density[indices]
+        if density is None:
+            new_density = old_density
+        else:
+            new_density = np.broadcast_to(
+                np.asarray(density, dtype="float64"), indices.shape
+            )
+        if prisms is None:
+            # only the difference of the densities is needed
+            changed = old_prisms
+            delta = new_density - old_density
+        else:
+            new_prisms = np.asarray(prisms, dtype="float64").reshape(
+                indices.size, 6
+            )
+            _check_prisms(new_prisms)
+            # the field of the old prisms is subtracted and the one of the
+            # new prisms is added
+            changed = np.vstack([old_prisms, new_prisms])
+            delta = np.concatenate([-old_density, new_density])
+        if indices.size:
+            gravitational(
+                self.coordinates, changed, delta, self.field,
+                parallel=self.parallel, workers=self.workers,
+                out=self._delta, check_prisms=False
+            )
+            self._out += self._delta
+        self.density[indices] = new_density
+        if prisms is not None:
+            self.prisms[indices] = new_prisms
+        return self.result
+
+    def refresh(self):
+        """
+        Compute the field of all prisms from scratch, discarding the
+        rounding errors accumulated by the updates
+
+        Returns
+        -------
+        result : array or dict
+            The updated ``result``.
+        """
+        gravitational(
+            self.coordinates, self.prisms, self.density, self.field,
+            parallel=self.parallel, workers=self.workers, out=self._out,
+            check_prisms=False
+        )
+        return self.result
+
+
+def sensitivity(coordinates, prisms, field, dtype="float64", chunk_rows=None,
+                out=None, parallel=False, workers=None):
     """
-    Kernel for downward component of gravitational acceleration of a prism
+    Sensitivity matrix of a gravitational field with respect to the
+    densities of the prisms.
+
+    Element (l, m) of the sensitivity matrix is the field produced at the
+    l-th computation point by the m-th prism with unit density. Therefore,
+    its product with a vector of densities is equal to the field computed by
+    ``gravitational``.
+
+    Parameters
+    ----------
+    coordinates : 2d-array
+        2d-array containing y (first line), x (second line), and z (third line) of
+        the computation points. All coordinates should be in meters.
+    prisms : 2d-array
+        2d-array containing the coordinates of the prisms. Each line must contain
+        the coordinates of a single prism in the following order:
+        west, east, south, north, top and bottom.
+        All coordinates should be in meters.
+    field : str
+        Gravitational field to be computed. See ``gravitational`` for the
+        available fields and their units.
+    dtype : str or numpy dtype
+        Data type of the sensitivity matrix: ``float64`` or ``float32``.
+        The contribution of each prism is always computed in double precision
+        and only then stored with the given type. Ignored if ``out`` is given.
+        Default is ``float64``.
+    chunk_rows : int or None
+        Number of computation points (lines of the sensitivity matrix)
+        computed at once. Each block of lines is computed and written to
+        ``out`` before the next one, so that ``out`` can be a memory-mapped
+        array larger than the available memory. If None, all lines are
+        computed at once. Default is None.
+    out : 2d-array or None
+        Array with shape (``n_points``, ``n_prisms``) and type ``float64``
+        or ``float32`` to store the sensitivity matrix (e.g., created by
+        ``numpy.lib.format.open_memmap``). If None, a new array is created.
+    parallel : bool
+        If True, the computation points are distributed among multiple
+        threads. Default is False.
+    workers : int or None
+        Number of threads used if ``parallel`` is True. If None, the number
+        of threads defined by numba (``NUMBA_NUM_THREADS``) is used.
+
+    Returns
+    -------
+    out : 2d-array
+        Sensitivity matrix with shape (``n_points``, ``n_prisms``).
     """
-    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
-    kernel = -(
-        Y * safe_log(X + radius)
-        + X * safe_log(Y + radius)
-        - Z * safe_atan2(Y * X, Z * radius)
-    )
-    return kernel
+    kernels = _kernels()
+    if field not in kernels:
+        raise ValueError("Gravitational field {} not recognized".format(field))
+    coordinates, prisms, _ = _check_input(coordinates, prisms)
+    _check_prisms(prisms)
+    shape = (coordinates.shape[1], prisms.shape[0])
+    if out is None:
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float64, np.float32):
+            raise ValueError(
+                "Invalid dtype {}. It must be float64 or float32".format(dtype)
+            )
+        out = np.empty(shape, dtype=dtype)
+    else:
+        if out.shape != shape:
+            raise ValueError(
+                "Shape of out {} ".format(out.shape)
+                + "mismatch the expected shape {}".format(shape)
+            )
+        if out.dtype not in (np.float64, np.float32):
+            raise ValueError(
+                "Invalid dtype of out {}. ".format(out.dtype)
+                + "It must be float64 or float32"
+            )
+    if chunk_rows is None:
+        chunk_rows = max(shape[0], 1)
+    if chunk_rows < 1:
+        raise ValueError(
+            "Invalid chunk_rows ({}). It must be positive".format(chunk_rows)
+        )
+    scale = _scale(field)
+    for start in range(0, shape[0], chunk_rows):
+        stop = min(start + chunk_rows, shape[0])
+        # a view of the base array is passed to the jit function, so that
+        # subclasses such as numpy.memmap are handled as plain arrays
+        block = np.asarray(out[start:stop])
+        if parallel:
+            _run_parallel(
+                jit_sensitivity_parallel, workers,
+                coordinates[:, start:stop], prisms, FIELDS.index(field),
+                scale, block
+            )
+        else:
+            jit_sensitivity(
+                coordinates[:, start:stop], prisms, FIELDS.index(field),
+                scale, block
+            )
+    return out
 
 
-@jit(nopython=True)
-def kernel_g_x(Y, X, Z):
+#: Names of the files storing the matrices of ``SensitivityCache``
+_SENSITIVITY_FILE = re.compile(r"^sensitivity-[0-9a-f]{64}\.npy$")
+
+
+class SensitivityCache(object):
     """
-    Kernel for x component of gravitational acceleration of a prism
+    On-disk cache of sensitivity matrices.
+
+    Each sensitivity matrix is stored as a ``.npy`` file whose name is
+    ``sensitivity-`` followed by a hash of the computation points, the
+    prisms, the field and the data type. Other files in the directory are
+    never counted or removed by the cache.
+    Later requests for the same geometry open the file as a read-only
+    memory-mapped array instead of computing the matrix again, so that the
+    forward problem reduces to a matrix-vector product. When the total size
+    of the stored matrices exceeds ``max_bytes``, the least recently used
+    ones are removed.
+
+    Parameters
+    ----------
+    directory : str
+        Directory where the matrices are stored. It is created if needed.
+    max_bytes : int or None
+        Maximum total size (in bytes) of the stored matrices. The matrix
+        being used is never removed, even if it is larger than
+        ``max_bytes``. If None, the size is not bounded. Default is None.
+    dtype : str or numpy dtype
+        Data type of the stored matrices: ``float64`` or ``float32``.
+        Default is ``float64``.
+    chunk_rows : int or None
+        Number of lines of the matrices computed at once and used in each
+        block of the matrix-vector products. See ``sensitivity``.
+        Default is None.
+    parallel : bool
+        If True, the matrices are computed in parallel. Default is False.
+    workers : int or None
+        Number of threads used if ``parallel`` is True.
     """
-    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
-    kernel = -(
-        Y * safe_log(Z + radius)
-        + Z * safe_log(Y + radius)
-        - X * safe_atan2(Y * Z, X * radius)
-    )
-    return kernel
 
+    def __init__(self, directory, max_bytes=None, dtype="float64",
+                 chunk_rows=None, parallel=False, workers=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float64, np.float32):
+            raise ValueError(
+                "Invalid dtype {}. It must be float64 or float32".format(dtype)
+            )
+        self.chunk_rows = chunk_rows
+        self.parallel = parallel
+        self.workers = workers
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
 
-@jit(nopython=True)
-def safe_atan2(y, x):
+    def key(self, coordinates, prisms, field):
+        """
+        Hash identifying the sensitivity matrix of a given geometry and field
+        """
+        digest = hashlib.sha256()
+        for array in (coordinates, prisms):
+            array = np.ascontiguousarray(array, dtype="float64")
+            digest.update(str(array.shape).encode())
+            digest.update(array.tobytes())
+        digest.update(field.encode())
+        digest.update(self.dtype.str.encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        """
+        File storing the sensitivity matrix identified by key
+        """
+        return os.path.join(self.directory, "sensitivity-" + key + ".npy")
+
+    def matrix(self, coordinates, prisms, field):
+        """
+        Sensitivity matrix as a read-only memory-mapped array
+
+        The matrix is computed by ``sensitivity`` and stored if it is not in
+        the cache.
+        """
+        if field not in _kernels():
+            raise ValueError(
+                "Gravitational field {} not recognized".format(field)
+            )
+        coordinates, prisms, _ = _check_input(coordinates, prisms)
+        key = self.key(coordinates, prisms, field)
+        path = self.path(key)
+        if os.path.isfile(path):
+            # mark the matrix as recently used
+            os.utime(path, None)
+        else:
+            # the matrix is written to a temporary file with a unique name
+            # which is renamed when complete, so that no partial matrix is
+            # ever read and concurrent writers do not collide
+            fd, tmp_path = tempfile.mkstemp(
+                suffix=".tmp", prefix="sensitivity-", dir=self.directory
+            )
+            os.close(fd)
+            out = None
+            try:
+                out = np.lib.format.open_memmap(
+                    tmp_path, mode="w+", dtype=self.dtype,
+                    shape=(coordinates.shape[1], prisms.shape[0])
+                )
+                sensitivity(
+                    coordinates, prisms, field, chunk_rows=self.chunk_rows,
+                    out=out, parallel=self.parallel, workers=self.workers
+                )
+                out.flush()
+            except BaseException:
+                del out
+                os.remove(tmp_path)
+                raise
+            del out
+            os.replace(tmp_path, path)
+            self.evict(keep=key)
+        return np.load(path, mmap_mode="r")
+
+    def gravitational(self, coordinates, prisms, density, field):
+        """
+        Gravitational field computed with the cached sensitivity matrix
+
+        The parameters and the result are the same of the function
+        ``gravitational`` for a single field.
+        """
+        coordinates, prisms, density = _check_input(
+            coordinates, prisms, density
+        )
+        G = self.matrix(coordinates, prisms, field)
+        density = density.astype("float64")
+        result = np.empty(G.shape[0], dtype="float64")
+        chunk_rows = self.chunk_rows
+        if chunk_rows is None:
+            chunk_rows = max(G.shape[0], 1)
+        for start in range(0, G.shape[0], chunk_rows):
+            stop = min(start + chunk_rows, G.shape[0])
+            result[start:stop] = np.dot(G[start:stop], density)
+        return result
+
+    def entries(self):
+        """
+        Stored matrices as a list of (path, size, last use time), from the
+        least to the most recently used
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not _SENSITIVITY_FILE.match(name):
+                continue
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            entries.append((path, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used matrices until the total size is not
+        greater than ``max_bytes``. The matrix identified by ``keep`` is not
+        removed.
+        """
+        if self.max_bytes is None:
+            return
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and path == self.path(keep):
+                continue
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        """
+        Remove all stored matrices
+        """
+        for path, _, _ in self.entries():
+            os.remove(path)
+
+
+class CompressedSensitivity(object):
     """
-    Principal value of the arctangent expressed as a two variable function
+    Hierarchical low-rank approximation of a sensitivity matrix.
 
-    This modification has to be made to the arctangent function so the
-    gravitational field of the prism satisfies the Poisson's equation.
-    Therefore, it guarantees that the fields satisfies the symmetry properties
-    of the prism. This modified function has been defined according to
-    Fukushima (2020, eq. 72).
+    The computation points and the prisms are recursively split into
+    clusters. The blocks of the sensitivity matrix relating clusters which
+    are far from each other (admissible blocks) are smooth and are
+    approximated by low-rank matrices ``U @ V`` computed by the adaptive
+    cross approximation (ACA) with partial pivoting (Bebendorf, 2000). Only
+    some lines and columns of these blocks are evaluated. The remaining
+    blocks are computed and stored as dense matrices.
+
+    References
+
+    * Bebendorf, M. (2000). Approximation of boundary element matrices.
+        Numerische Mathematik, 86(4), 565–589.
+        http://doi.org/10.1007/PL00005410
+
+    Parameters
+    ----------
+    coordinates : 2d-array
+        2d-array containing y (first line), x (second line), and z (third line) of
+        the computation points. All coordinates should be in meters.
+    prisms : 2d-array
+        2d-array containing the coordinates of the prisms. Each line must contain
+        the coordinates of a single prism in the following order:
+        west, east, south, north, top and bottom.
+        All coordinates should be in meters.
+    field : str
+        Gravitational field. See ``gravitational`` for the available fields
+        and their units.
+    tol : float
+        Relative tolerance of the approximation of each admissible block,
+        measured in the Frobenius norm. Default is 1e-6.
+    leaf_size : int
+        Maximum number of computation points or prisms in the clusters
+        which are not split. Default is 32.
+    eta : float
+        Admissibility parameter. Two clusters are far from each other if the
+        smallest of their diameters is not greater than ``eta`` times the
+        distance between them. Default is 1.
+
+    Attributes
+    ----------
+    shape : tuple
+        Shape of the sensitivity matrix (``n_points``, ``n_prisms``).
+    size : int
+        Number of stored elements. The dense matrix stores
+        ``n_points * n_prisms`` elements.
     """
-    if x != 0:
-        result = np.arctan(y / x)
-    else:
-        if y > 0:
-            result = np.pi / 2
-        elif y < 0:
-            result = -np.pi / 2
+
+    def __init__(self, coordinates, prisms, field, tol=1e-6, leaf_size=32,
+                 eta=1.0):
+        kernels = _kernels()
+        if field not in kernels:
+            raise ValueError(
+                "Gravitational field {} not recognized".format(field)
+            )
+        if tol <= 0:
+            raise ValueError(
+                "Invalid tolerance ({}). It must be positive".format(tol)
+            )
+        if leaf_size < 1:
+            raise ValueError(
+                "Invalid leaf_size ({}). It must be positive".format(leaf_size)
+            )
+        coordinates, prisms, _ = _check_input(coordinates, prisms)
+        _check_prisms(prisms)
+        self.coordinates = coordinates
+        self.prisms = prisms
+        self.field = field
+        self.tol = tol
+        self.eta = eta
+        self.scale = _scale(field)
+        self.shape = (self.coordinates.shape[1], self.prisms.shape[0])
+        # List of blocks (rows, cols, U, V). Dense blocks have V = None.
+        self.blocks = []
+        # a matrix without lines or columns has no clusters and no blocks
+        if min(self.shape) > 0:
+            # Lower and upper limits (y, x, z) of points and prisms
+            points = self.coordinates.T
+            rows = _Cluster(
+                points, points, np.arange(self.shape[0]), leaf_size
+            )
+            lower = self.prisms[:, [0, 2, 4]]
+            upper = self.prisms[:, [1, 3, 5]]
+            cols = _Cluster(
+                lower, upper, np.arange(self.shape[1]), leaf_size
+            )
+            self._partition(rows, cols)
+        self.size = sum(
+            U.size if V is None else U.size + V.size
+            for _, _, U, V in self.blocks
+        )
+
+    def matvec(self, density):
+        """
+        Product of the sensitivity matrix by a vector of densities
+        """
+        density = np.asarray(density, dtype="float64")
+        if density.shape != (self.shape[1],):
+            raise ValueError(
+                "Number of elements in density ({}) ".format(density.size)
+                + "mismatch the number of prisms ({})".format(self.shape[1])
+            )
+        result = np.zeros(self.shape[0])
+        for rows, cols, U, V in self.blocks:
+            if V is None:
+                result[rows] += U @ density[cols]
+            else:
+                result[rows] += U @ (V @ density[cols])
+        return result
+
+    def rmatvec(self, residual):
+        """
+        Product of the transposed sensitivity matrix by a vector with one
+        element per computation point
+        """
+        residual = np.asarray(residual, dtype="float64")
+        if residual.shape != (self.shape[0],):
+            raise ValueError(
+                "Number of elements in residual ({}) ".format(residual.size)
+                + "mismatch the number of points ({})".format(self.shape[0])
+            )
+        result = np.zeros(self.shape[1])
+        for rows, cols, U, V in self.blocks:
+            if V is None:
+                result[cols] += residual[rows] @ U
+            else:
+                result[cols] += (residual[rows] @ U) @ V
+        return result
+
+    def _block(self, rows, cols):
+        """
+        Dense block of the sensitivity matrix
+        """
+        out = np.empty((rows.size, cols.size))
+        jit_sensitivity(
+            self.coordinates[:, rows], self.prisms[cols],
+            FIELDS.index(self.field), self.scale, out
+        )
+        return out
+
+    def _partition(self, rows, cols):
+        """
+        Recursively split the block formed by two clusters
+        """
+        distance = rows.distance(cols)
+        if distance > 0 and (
+            min(rows.diameter, cols.diameter) <= self.eta * distance
+        ):
+            U, V = self._aca(rows.indices, cols.indices)
+            self.blocks.append((rows.indices, cols.indices, U, V))
+        elif rows.children is None and cols.children is None:
+            self.blocks.append(
+                (rows.indices, cols.indices,
+                 self._block(rows.indices, cols.indices), None)
+            )
+        elif cols.children is None or (
+            rows.children is not None and rows.diameter >= cols.diameter
+        ):
+            for child in rows.children:
+                self._partition(child, cols)
         else:
-            result = 0
-    return result
+            for child in cols.children:
+                self._partition(rows, child)
 
+    def _aca(self, rows, cols):
+        """
+        Adaptive cross approximation with partial pivoting of a block
 
-@jit(nopython=True)
-def safe_log(x):
+        Returns the matrices U and V of the low-rank approximation U @ V.
+        If the approximation does not save memory, returns the dense block
+        and None.
+        """
+        n_rows, n_cols = rows.size, cols.size
+        max_rank = n_rows * n_cols // (n_rows + n_cols)
+        us, vs = [], []
+        used = np.zeros(n_rows, dtype=bool)
+        pivot = 0
+        norm2 = 0.0
+        while len(us) < max_rank:
+            used[pivot] = True
+            # residual of the pivot line
+            row = self._block(rows[pivot:pivot + 1], cols)[0]
+            for u, v in zip(us, vs):
+                row -= u[pivot] * v
+            j = np.argmax(np.abs(row))
+            if row[j] == 0:
+                if used.all():
+                    break
+                pivot = np.argmin(used)
+                continue
+            v = row / row[j]
+            # residual of the pivot column
+            u = self._block(rows, cols[j:j + 1])[:, 0]
+            for u_l, v_l in zip(us, vs):
+                u -= v_l[j] * u_l
+            # update of the Frobenius norm of the approximation
+            norm2 += (u @ u) * (v @ v) + 2 * sum(
+                (u_l @ u) * (v_l @ v) for u_l, v_l in zip(us, vs)
+            )
+            us.append(u)
+            vs.append(v)
+            if np.sqrt((u @ u) * (v @ v)) <= self.tol * np.sqrt(abs(norm2)):
+                break
+            if used.all():
+                break
+            pivot = np.argmax(np.where(used, -1, np.abs(u)))
+        else:
+            return self._block(rows, cols), None
+        if not us:
+            return np.zeros((n_rows, 1)), np.zeros((1, n_cols))
+        return np.array(us).T, np.array(vs)
+
+
+class _Cluster(object):
     """
-    Modified log to return 0 for log(0).
-    The limits in the formula terms tend to 0.
+    Node of a cluster tree of computation points or prisms
+
+    Parameters
+    ----------
+    lower, upper : 2d-arrays
+        Arrays with shape (n, 3) containing the lower and upper limits
+        (y, x, z) of all points or prisms.
+    indices : 1d-array
+        Indices of the points or prisms in the cluster.
+    leaf_size : int
+        Maximum number of elements of a cluster which is not split.
     """
-    if np.abs(x) < 1e-10:
-        result = 0
+
+    def __init__(self, lower, upper, indices, leaf_size):
+        self.indices = indices
+        self.lower = lower[indices].min(axis=0)
+        self.upper = upper[indices].max(axis=0)
+        self.diameter = np.sqrt(np.sum((self.upper - self.lower) ** 2))
+        self.children = None
+        if indices.size > leaf_size:
+            # split at the median of the centers along the largest dimension
+            axis = np.argmax(self.upper - self.lower)
+            centers = 0.5 * (lower[indices, axis] + upper[indices, axis])
+            order = np.argsort(centers, kind="stable")
+            half = indices.size // 2
+            self.children = (
+                _Cluster(lower, upper, indices[order[:half]], leaf_size),
+                _Cluster(lower, upper, indices[order[half:]], leaf_size),
+            )
+
+    def distance(self, other):
+        """
+        Distance between the bounding boxes of two clusters
+        """
+        gap = np.maximum(
+            0, np.maximum(self.lower - other.upper, other.lower - self.upper)
+        )
+        return np.sqrt(np.sum(gap ** 2))
+
+
+def _gravitational_fields(coordinates, prisms, density, fields, parallel,
+                          workers, mesh, out, timer=None):
+    """
+    Compute several gravitational fields in a single pass
+
+    Parameters
+    ----------
+    coordinates, prisms, density : arrays
+        Validated input of ``gravitational``.
+    fields : list of str
+        Fields to be computed. They must be in ``FIELDS``.
+    parallel : bool
+        If True, use the parallel loop.
+    workers : int or None
+        Number of threads used if ``parallel`` is True.
+    mesh : bool
+        If True, evaluate the kernels at the unique vertices of the prisms.
+    out : 2d-array
+        Array with shape (``len(fields)``, ``n_points``) receiving the
+        fields.
+    timer : _Timer or None
+        Timer of the phases of ``gravitational``.
+
+    Returns
+    -------
+    result : dict
+        Dictionary whose keys are the fields and whose values are the
+        corresponding lines of ``out``.
+    """
+    mask = sum(1 << FIELDS.index(f) for f in fields)
+    indices = np.array([FIELDS.index(f) for f in fields])
+    scales = np.array([_scale(f) for f in fields])
+    result = np.asarray(out)
+    if timer is None:
+        timer = _Timer(None)
+    if mesh:
+        vertices, weights = _mesh_vertices(prisms, density)
+        timer.lap("setup")
+        timer.evaluations = coordinates.shape[1] * vertices.shape[0]
+        if parallel:
+            _run_parallel(
+                jit_gravitational_vertices_fields_parallel, workers,
+                coordinates, vertices, weights, mask, indices, scales, result
+            )
+        else:
+            jit_gravitational_vertices_fields(
+                coordinates, vertices, weights, mask, indices, scales, result
+            )
+    elif parallel:
+        _run_parallel(
+            jit_gravitational_fields_parallel, workers,
+            coordinates, prisms, density, mask, indices, scales, result
+        )
+    else:
+        jit_gravitational_fields(
+            coordinates, prisms, density, mask, indices, scales, result
+        )
+    timer.lap("kernel")
+    return dict(zip(fields, out))
+
+
+def _kernels():
+    """
+    Dictionary relating the available fields and their kernel functions
+    """
+    return {
+        "potential": kernel_potential,
+        "g_z": kernel_g_z,
+        "g_x": kernel_g_x,
+        "g_y": kernel_g_y,
+        "g_xx": kernel_g_xx,
+        "g_xy": kernel_g_xy,
+        "g_xz": kernel_g_xz,
+        "g_yy": kernel_g_yy,
+        "g_yz": kernel_g_yz,
+        "g_zz": kernel_g_zz
+    }
+
+
+def _check_input(coordinates, prisms, density=None):
+    """
+    Check the shapes of the computation points, prisms and densities
+
+    Parameters
+    ----------
+    coordinates : 2d-array
+        Coordinates of the computation points.
+    prisms : 2d-array
+        Boundaries of the prisms.
+    density : 1d-array or None
+        Density of each prism. If None, it is not verified.
+
+    Returns
+    -------
+    coordinates, prisms, density : arrays
+        Input parameters converted to C contiguous float64 arrays. Arrays
+        already with this layout and type are not copied.
+    """
+    coordinates = np.ascontiguousarray(coordinates, dtype="float64")
+    prisms = np.ascontiguousarray(prisms, dtype="float64")
+
+    if coordinates.ndim != 2:
+        raise ValueError(
+            "coordinates ndim ({}) ".format(coordinates.ndim)
+            + "not equal to 2"
+        )
+    if coordinates.shape[0] != 3:
+        raise ValueError(
+            "Number of lines in coordinates ({}) ".format(coordinates.shape[0])
+            + "not equal to 3"
+        )
+    if prisms.ndim != 2:
+        raise ValueError(
+            "prisms ndim ({}) ".format(prisms.ndim)
+            + "not equal to 2"
+        )
+    if prisms.shape[1] != 6:
+        raise ValueError(
+            "Number of columns in prisms ({}) ".format(prisms.shape[1])
+            + "not equal to 6"
+        )
+    if density is None:
+        return coordinates, prisms, density
+    density = np.ascontiguousarray(density, dtype="float64")
+    if density.ndim != 1:
+        raise ValueError(
+            "density ndim ({}) ".format(density.ndim)
+            + "not equal to 1"
+        )
+    if density.size != prisms.shape[0]:
+        raise ValueError(
+            "Number of elements in density ({}) ".format(density.size)
+            + "mismatch the number of prisms ({})".format(prisms.shape[0])
+        )
+    return coordinates, prisms, density
+
+
+def _point_masses(prisms, density):
+    """
+    Point masses equivalent to the prisms
+
+    Returns
+    -------
+    centers : 2d-array
+        Array with shape (``n_prisms``, 3) containing the coordinates y, x
+        and z of the prism centers.
+    masses : 1d-array
+        Density times volume of each prism.
+    diagonals : 1d-array
+        Length of the diagonal of each prism.
+    """
+    prisms = prisms.astype("float64")
+    lower = prisms[:, [0, 2, 4]]
+    upper = prisms[:, [1, 3, 5]]
+    centers = 0.5 * (lower + upper)
+    sizes = upper - lower
+    masses = density * np.prod(sizes, axis=1)
+    diagonals = np.sqrt(np.sum(sizes ** 2, axis=1))
+    return centers, masses, diagonals
+
+
+def _single_precision(coordinates, prisms):
+    """
+    Refer the coordinates of the computation points and prisms to the center
+    of the box containing the prisms and convert them to float32
+
+    Without prisms, the coordinates are converted without changing the
+    origin.
+    """
+    if prisms.shape[0] == 0:
+        return coordinates.astype("float32"), prisms.astype("float32")
+    origin = 0.5 * np.array([
+        prisms[:, 0].min() + prisms[:, 1].max(),
+        prisms[:, 2].min() + prisms[:, 3].max(),
+        prisms[:, 4].min() + prisms[:, 5].max(),
+    ])
+    coordinates = (coordinates - origin[:, np.newaxis]).astype("float32")
+    prisms = (prisms - np.repeat(origin, 2)).astype("float32")
+    return coordinates, prisms
+
+
+def _update_counts(counts, n_exact, n_approximate):
+    """
+    Store the number of exact and approximate evaluations in counts
+    """
+    if counts is None:
+        return
+    counts["exact"] = int(n_exact)
+    counts["approximate"] = int(n_approximate)
+
+
+class _Timer(object):
+    """
+    Timer of the phases of ``gravitational``, which stores them in the
+    dictionary stats (see ``gravitational``). It does nothing if stats is
+    None.
+
+    The time spent by numba compiling functions or loading them from the
+    cache is measured by listening to the events of its compiler lock, and
+    subtracted from the phase in which it happened. The singular
+    evaluations are counted only if the key ``singular`` of stats is True.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.evaluations = None
+        self.singular = False
+        if stats is None:
+            return
+        self.singular = bool(stats.get("singular", False))
+        stats.clear()
+        stats.update(check=0.0, setup=0.0, compile=0.0, kernel=0.0)
+        if self.singular:
+            stats["singular"] = True
+        self.listener = event.TimingListener()
+        event.register("numba:compiler_lock", self.listener)
+        # the listener is removed even if gravitational raises an error
+        self._unregister = weakref.finalize(
+            self, event.unregister, "numba:compiler_lock", self.listener
+        )
+        self.compiled = 0.0
+        self.start = self.last = time.perf_counter()
+
+    def lap(self, phase):
+        """
+        Add the time elapsed since the previous lap to phase
+        """
+        if self.stats is None:
+            return
+        now = time.perf_counter()
+        compiled = self.listener.duration if self.listener.done else 0.0
+        self.stats["compile"] += compiled - self.compiled
+        self.stats[phase] += now - self.last - (compiled - self.compiled)
+        self.compiled = compiled
+        self.last = now
+
+    def finish(self, coordinates, prisms, fields, n_exact, n_approximate,
+               parallel=False, workers=None):
+        """
+        Store the total time, the number of evaluations and, if requested,
+        the number of singular evaluations of the given fields
+        """
+        if self.stats is None:
+            return
+        self._unregister()
+        stats = self.stats
+        stats["total"] = self.last - self.start
+        if self.evaluations is None:
+            self.evaluations = 8 * n_exact
+        stats["evaluations"] = int(self.evaluations)
+        stats["approximate"] = int(n_approximate)
+        if stats["kernel"] > 0:
+            stats["rate"] = stats["evaluations"] / stats["kernel"]
+        else:
+            stats["rate"] = np.inf
+        if not self.singular:
+            return
+        log_terms, atan2_terms = _singular_terms(fields)
+        singular = np.zeros((2, coordinates.shape[1]), dtype="int64")
+        if parallel:
+            _run_parallel(
+                jit_singular_counts_parallel, workers, coordinates, prisms,
+                log_terms, atan2_terms, singular
+            )
+        else:
+            jit_singular_counts(
+                coordinates, prisms, log_terms, atan2_terms, singular
+            )
+        stats["singular_log"] = int(singular[0].sum())
+        stats["singular_atan2"] = int(singular[1].sum())
+
+
+def _singular_terms(fields):
+    """
+    Terms of the kernels of the fields evaluated with ``safe_log`` and
+    ``safe_atan2``
+
+    The terms are given as bit masks in which the bits 0, 1 and 2 are the
+    terms whose singular arguments are ``Y + radius``, ``X + radius`` and
+    ``Z + radius`` (``safe_log``) or ``Y * radius``, ``X * radius`` and
+    ``Z * radius`` (``safe_atan2``).
+    """
+    terms = {
+        "potential": (7, 7), "g_z": (3, 4), "g_x": (5, 2), "g_y": (6, 1),
+        "g_xx": (0, 2), "g_xy": (4, 0), "g_xz": (1, 0), "g_yy": (0, 1),
+        "g_yz": (2, 0), "g_zz": (0, 4),
+    }
+    log_terms, atan2_terms = 0, 0
+    for field in fields:
+        log_terms |= terms[field][0]
+        atan2_terms |= terms[field][1]
+    return log_terms, atan2_terms
+
+
+class _Octree(object):
+    """
+    Octree of prisms stored in flat arrays
+
+    Attributes
+    ----------
+    order : 1d-array
+        Indices of the prisms sorted so that the prisms of each node are
+        ``order[first[node]:first[node] + count[node]]``.
+    lower, upper : 2d-arrays
+        Limits (y, x, z) of the boxes containing the prisms of each node.
+    centers : 2d-array
+        Centers of mass (y, x, z) of each node, computed with the absolute
+        values of the masses.
+    masses : 1d-array
+        Total mass of each node.
+    diagonals : 1d-array
+        Diagonal of the box of each node.
+    children : 2d-array
+        Indices of the (up to 8) children of each node, followed by -1.
+        Leaves have only -1.
+    first, count : 1d-arrays
+        First position in ``order`` and number of prisms of each node.
+    """
+
+    def __init__(self, prisms, density, leaf_size):
+        centers, masses, _ = _point_masses(prisms, density)
+        prisms = prisms.astype("float64")
+        self._prism_lower = prisms[:, [0, 2, 4]]
+        self._prism_upper = prisms[:, [1, 3, 5]]
+        self._prism_centers = centers
+        self._prism_masses = masses
+        self._leaf_size = leaf_size
+        self._order = []
+        self._nodes = []
+        self._add_node(np.arange(prisms.shape[0]))
+        nodes = self._nodes
+        self.order = np.array(self._order, dtype="int64")
+        self.lower = np.array([node[0] for node in nodes])
+        self.upper = np.array([node[1] for node in nodes])
+        self.centers = np.array([node[2] for node in nodes])
+        self.masses = np.array([node[3] for node in nodes])
+        self.diagonals = np.sqrt(np.sum((self.upper - self.lower) ** 2, axis=1))
+        self.children = np.full((len(nodes), 8), -1, dtype="int64")
+        for index, node in enumerate(nodes):
+            self.children[index, :len(node[4])] = node[4]
+        self.first = np.array([node[5] for node in nodes], dtype="int64")
+        self.count = np.array([node[6] for node in nodes], dtype="int64")
+
+    def _add_node(self, indices):
+        """
+        Add the node containing the given prisms and its children. Returns
+        the index of the node.
+        """
+        index = len(self._nodes)
+        masses = self._prism_masses[indices]
+        centers = self._prism_centers[indices]
+        lower = self._prism_lower[indices].min(axis=0)
+        upper = self._prism_upper[indices].max(axis=0)
+        weights = np.abs(masses)
+        if weights.sum() > 0:
+            center = np.sum(centers * weights[:, np.newaxis], axis=0)
+            center /= weights.sum()
+        else:
+            center = 0.5 * (lower + upper)
+        node = [lower, upper, center, masses.sum(), [], len(self._order),
+                indices.size]
+        self._nodes.append(node)
+        # split the node in octants of the box containing the prism centers
+        middle = 0.5 * (centers.min(axis=0) + centers.max(axis=0))
+        octants = np.sum((centers >= middle) * np.array([1, 2, 4]), axis=1)
+        if indices.size <= self._leaf_size or np.all(octants == octants[0]):
+            self._order.extend(indices)
+            return index
+        for octant in range(8):
+            selected = indices[octants == octant]
+            if selected.size > 0:
+                node[4].append(self._add_node(selected))
+        return index
+
+
+def _octree(prisms, density, leaf_size=8):
+    """
+    Octree of the prisms used by the tree engine of ``gravitational``
+    """
+    return _Octree(prisms, density, leaf_size)
+
+
+class _Grid(object):
+    """
+    Uniform grid of cells containing the centers of the prisms
+
+    Attributes
+    ----------
+    centers : 2d-array
+        Centers (y, x, z) of the prisms.
+    masses : 1d-array
+        Mass of each prism.
+    diagonals : 1d-array
+        Diagonal of each prism.
+    lower : 1d-array
+        Lower limits (y, x, z) of the grid.
+    size : float
+        Size of the cubic cells.
+    shape : 1d-array
+        Number of cells along y, x and z.
+    order : 1d-array
+        Indices of the prisms sorted so that the prisms whose centers are in
+        the cell c are ``order[start[c]:start[c + 1]]``. The cells are
+        numbered in C order.
+    start : 1d-array
+        Position in ``order`` of the first prism of each cell.
+    """
+
+    def __init__(self, prisms, density, size, max_cells):
+        self.centers, self.masses, self.diagonals = _point_masses(
+            prisms, density
+        )
+        self.lower = self.centers.min(axis=0)
+        extent = self.centers.max(axis=0) - self.lower
+        # larger cells are used if the number of cells would be too large
+        while True:
+            self.shape = (extent // size).astype("int64") + 1
+            if np.prod(self.shape) <= max_cells:
+                break
+            size *= 2
+        self.size = size
+        indices = ((self.centers - self.lower) // size).astype("int64")
+        cells = np.ravel_multi_index(indices.T, self.shape)
+        self.order = np.argsort(cells, kind="stable")
+        self.start = np.searchsorted(
+            cells[self.order], np.arange(np.prod(self.shape) + 1)
+        )
+
+
+def _grid(prisms, density, size):
+    """
+    Uniform grid of the prisms used by the truncation radius of
+    ``gravitational``
+    """
+    return _Grid(prisms, density, size, max_cells=8 * prisms.shape[0] + 64)
+
+
+def _truncation_bound(grid, field, radius, visited, bound):
+    """
+    Upper bound of the absolute value of the field of the prisms ignored by
+    the truncation radius (see ``gravitational``)
+
+    ``visited`` is the absolute mass of the prisms within the radius of each
+    computation point. The bound is stored in ``bound``.
+    """
+    ignored = np.maximum(np.abs(grid.masses).sum() - visited, 0)
+    distance = np.float64(max(radius - 0.5 * grid.diagonals.max(), 0))
+    if field == "potential":
+        power, factor = 1, 1
+    elif field in ["g_x", "g_y", "g_z"]:
+        power, factor = 2, 1
+    else:
+        power, factor = 3, 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        limit = factor * _scale(field) / distance ** power
+        bound[:] = np.where(ignored > 0, ignored * limit, 0)
+
+
+class _RegularGrids(object):
+    """
+    Computation points and prisms on regular grids, used by the fft engine
+    of ``gravitational``
+
+    The horizontal positions of the computation points are nodes of a
+    regular grid whose spacing is equal to the horizontal sides of the
+    prisms, which are cells of a regular grid in each layer. A
+    ``ValueError`` is raised otherwise.
+
+    Attributes
+    ----------
+    size : 1d-array
+        Horizontal sides (y, x) of the prisms, equal to the spacing of the
+        grid of computation points.
+    origin : 1d-array
+        Position (y, x) of the first node of the grid of computation points.
+    corner : 1d-array
+        West and south boundaries of the first cell of the grid of prisms.
+    nodes : 2d-array
+        Indices (y, x) of the node of each computation point.
+    cells : 2d-array
+        Indices (y, x) of the cell of each prism.
+    heights : 1d-array
+        Distinct z of the computation points.
+    height : 1d-array
+        Index in ``heights`` of each computation point.
+    layers : 2d-array
+        Distinct pairs of top and bottom of the prisms.
+    layer : 1d-array
+        Index in ``layers`` of each prism.
+    n_nodes, n_cells : 1d-arrays
+        Number of nodes of the grid of computation points and of cells of
+        the grid of prisms along y and x.
+    n_offsets : 1d-array
+        Number of relative offsets between the nodes and the cells along y
+        and x, from -(``n_cells`` - 1) to ``n_nodes`` - 1.
+    """
+
+    def __init__(self, coordinates, prisms):
+        sides = np.column_stack(
+            [prisms[:, 1] - prisms[:, 0], prisms[:, 3] - prisms[:, 2]]
+        )
+        self.size = sides[0]
+        tolerance = _grid_tolerance(prisms[:, :4], self.size)
+        if np.any(np.abs(sides - self.size) > tolerance):
+            raise ValueError(
+                "The fft engine requires prisms with equal horizontal sides"
+            )
+        self.origin = coordinates[:2].min(axis=1)
+        self.corner = prisms[:, [0, 2]].min(axis=0)
+        self.nodes = np.empty((2, coordinates.shape[1]), dtype="int64")
+        self.cells = np.empty((2, prisms.shape[0]), dtype="int64")
+        for axis in range(2):
+            self.nodes[axis] = _grid_indices(
+                coordinates[axis], self.origin[axis], self.size[axis]
+            )
+            self.cells[axis] = _grid_indices(
+                prisms[:, 2 * axis], self.corner[axis], self.size[axis]
+            )
+        if self.nodes.min() < 0 or self.cells.min() < 0:
+            raise ValueError(
+                "The fft engine requires computation points on the nodes of "
+                + "a regular grid with spacing equal to the horizontal sides "
+                + "of the prisms, which must be cells of a regular grid"
+            )
+        self.heights, self.height = np.unique(
+            coordinates[2], return_inverse=True
+        )
+        self.layers, self.layer = np.unique(
+            prisms[:, 4:], axis=0, return_inverse=True
+        )
+        self.layer = self.layer.ravel()
+        self.n_nodes = self.nodes.max(axis=1) + 1
+        self.n_cells = self.cells.max(axis=1) + 1
+        self.n_offsets = self.n_nodes + self.n_cells - 1
+
+    def evaluations(self, density):
+        """
+        Number of kernel evaluations of ``convolve``: one for each relative
+        offset, height of the computation points and layer containing prisms
+        with nonzero density
+        """
+        n_layers = np.unique(self.layer[density != 0]).size
+        return self.heights.size * n_layers * int(np.prod(self.n_offsets))
+
+    def convolve(self, density, field, scale, out, parallel=False,
+                 workers=None):
+        """
+        Compute the field with index ``field`` and store it in ``out``
+
+        Returns the number of relative offsets whose field was computed.
+        """
+        n_cells = self.n_cells
+        n_offsets = self.n_offsets
+        shape = tuple(n_offsets + n_cells - 1)
+        y, x = [
+            self.origin[axis]
+            + np.arange(1 - n_cells[axis], self.n_nodes[axis])
+            * self.size[axis]
+            for axis in range(2)
+        ]
+        y, x = [a.ravel() for a in np.meshgrid(y, x, indexing="ij")]
+        # the spectra of the densities of the layers are computed once
+        layers = []
+        for k in range(self.layers.shape[0]):
+            in_layer = self.layer == k
+            grid = np.zeros(tuple(n_cells))
+            np.add.at(
+                grid, tuple(self.cells[:, in_layer]), density[in_layer]
+            )
+            if not np.any(grid):
+                continue
+            cell = np.array(
+                [[
+                    self.corner[0], self.corner[0] + self.size[0],
+                    self.corner[1], self.corner[1] + self.size[1],
+                    self.layers[k, 0], self.layers[k, 1]
+                ]]
+            )
+            layers.append((cell, np.fft.rfft2(grid, shape)))
+        kernel = np.empty((y.size, 1))
+        spectrum = np.empty((shape[0], shape[1] // 2 + 1), dtype="complex128")
+        n_exact = 0
+        for h in range(self.heights.size):
+            offsets = np.vstack([y, x, np.full(y.size, self.heights[h])])
+            spectrum[:] = 0
+            for cell, grid in layers:
+                if parallel:
+                    _run_parallel(
+                        jit_sensitivity_parallel, workers,
+                        offsets, cell, field, scale, kernel
+                    )
+                else:
+                    jit_sensitivity(offsets, cell, field, scale, kernel)
+                spectrum += grid * np.fft.rfft2(
+                    kernel.reshape(tuple(n_offsets)), shape
+                )
+                n_exact += y.size
+            # the node i receives the element i + n_cells - 1 of the
+            # convolution
+            values = np.fft.irfft2(spectrum, shape)
+            at_height = self.height == h
+            out[at_height] = values[
+                self.nodes[0, at_height] + n_cells[0] - 1,
+                self.nodes[1, at_height] + n_cells[1] - 1
+            ]
+        return n_exact
+
+
+def _regular_grids(coordinates, prisms):
+    """
+    Regular grids of the computation points and prisms used by the fft
+    engine of ``gravitational``
+    """
+    return _RegularGrids(coordinates, prisms)
+
+
+def _grid_tolerance(values, size):
+    """
+    Tolerance used to decide if coordinates lie on a regular grid
+
+    It allows the rounding errors of coordinates created by, e.g.,
+    ``numpy.linspace``.
+    """
+    return 1e-9 * size + 16 * np.finfo(np.float64).eps * np.abs(values).max()
+
+
+def _grid_indices(values, lower, size):
+    """
+    Indices of the values in a regular grid starting at lower with the given
+    spacing, or -1 for the values which are not on the grid
+    """
+    indices = np.rint((values - lower) / size).astype("int64")
+    off_grid = np.abs(lower + indices * size - values) > _grid_tolerance(
+        values, size
+    )
+    indices[off_grid] = -1
+    return indices
+
+
+def _mesh_vertices(prisms, density):
+    """
+    Unique vertices of the prisms and their weights
+
+    The weight of a vertex is the sum of the densities of the prisms having
+    it as a corner, each one multiplied by the sign of the corner in the
+    formulas of Nagy et al (2000, 2002). Vertices with null weight are
+    removed.
+
+    Parameters
+    ----------
+    prisms : 2d-array
+        Validated boundaries of the prisms.
+    density : 1d-array
+        Density of each prism.
+
+    Returns
+    -------
+    vertices : 2d-array
+        Array with shape (``n_vertices``, 3) containing the coordinates
+        y, x and z of the unique vertices.
+    weights : 1d-array
+        Weight of each vertex.
+    """
+    n_prisms = prisms.shape[0]
+    # Corners with shape (n_prisms, 2, 2, 2), the last three axes being
+    # the boundaries along y (west, east), x (south, north) and
+    # z (top, bottom)
+    shape = (n_prisms, 2, 2, 2)
+    Y = np.broadcast_to(prisms[:, 0:2, np.newaxis, np.newaxis], shape)
+    X = np.broadcast_to(prisms[:, np.newaxis, 2:4, np.newaxis], shape)
+    Z = np.broadcast_to(prisms[:, np.newaxis, np.newaxis, 4:6], shape)
+    # The signs are negative at west, south and top boundaries
+    signs = np.array([-1.0, 1.0])
+    signs = (
+        signs[:, np.newaxis, np.newaxis]
+        * signs[np.newaxis, :, np.newaxis]
+        * signs[np.newaxis, np.newaxis, :]
+    )
+    corners = np.stack([Y.ravel(), X.ravel(), Z.ravel()], axis=1)
+    corner_weights = (density[:, np.newaxis, np.newaxis, np.newaxis] * signs)
+    vertices, inverse = np.unique(corners, axis=0, return_inverse=True)
+    weights = np.bincount(
+        inverse.ravel(), weights=corner_weights.ravel(),
+        minlength=vertices.shape[0]
+    )
+    nonzero = weights != 0
+    # integer boundaries are converted to float64
+    dtype = np.result_type(prisms.dtype, np.float32)
+    return (
+        np.ascontiguousarray(vertices[nonzero], dtype=dtype),
+        weights[nonzero]
+    )
+
+
+def _station_chunks(stations, chunk_size, delimiter=",", skiprows=0):
+    """
+    Generator of the coordinates of the stations in blocks of at most
+    chunk_size stations
+
+    See ``gravitational_chunks`` for the accepted sources of stations.
+    """
+    if isinstance(stations, (str, os.PathLike)):
+        extension = os.path.splitext(stations)[1].lower()
+        if extension == ".npy":
+            stations = np.load(stations, mmap_mode="r")
+        elif extension in (".csv", ".txt"):
+            with open(stations) as text:
+                for _ in range(skiprows):
+                    next(text, None)
+                while True:
+                    lines = list(itertools.islice(text, chunk_size))
+                    if not lines:
+                        return
+                    yield np.loadtxt(
+                        lines, delimiter=delimiter, ndmin=2
+                    ).T
+        else:
+            stations = np.memmap(stations, dtype="float64", mode="r")
+            stations = stations.reshape(-1, 3).T
+    if isinstance(stations, np.ndarray):
+        stations = [stations]
+    for block in stations:
+        block = np.asarray(block)
+        if block.ndim != 2 or block.shape[0] != 3:
+            raise ValueError(
+                "Invalid block of stations with shape {}. ".format(block.shape)
+                + "It must have 3 lines"
+            )
+        for start in range(0, block.shape[1], chunk_size):
+            yield block[:, start:start + chunk_size]
+
+
+def _check_fields(fields):
+    """
+    Check a list of fields and remove repeated ones
+
+    Parameters
+    ----------
+    fields : str or list of str
+        ``all`` or a list containing elements of ``FIELDS``.
+
+    Returns
+    -------
+    fields : list of str
+        Fields to be computed, without repetitions, in the given order.
+    """
+    if isinstance(fields, str):
+        if fields != "all":
+            raise ValueError(
+                "Gravitational field {} not recognized".format(fields)
+            )
+        return list(FIELDS)
+    checked = []
+    for field in fields:
+        if field not in FIELDS:
+            raise ValueError(
+                "Gravitational field {} not recognized".format(field)
+            )
+        if field not in checked:
+            checked.append(field)
+    if not checked:
+        raise ValueError("No gravitational field was given")
+    return checked
+
+
+def _scale(field):
+    """
+    Factor multiplying the sum of the kernels: the gravitational constant
+    and the conversion of the components of acceleration from m/s^2 to mGal
+    and of the components of the gradient tensor from 1/s^2 to Eotvos
+    """
+    scale = GRAVITATIONAL_CONST
+    # Convert from m/s^2 to mGal
+    if field in ["g_x", "g_y", "g_z"]:
+        scale *= 1e5
+    # Convert from 1/s^2 to Eotvos
+    elif field != "potential":
+        scale *= 1e9
+    return scale
+
+
+def _check_prisms(prisms):
+    """
+    Check if prisms boundaries are well defined
+
+    Parameters
+    ----------
+    prisms : 2d-array
+        Array containing the boundaries of the prisms in the following order:
+        ``w``, ``e``, ``s``, ``n``, ``top``, ``bottom``.
+        The array must have the following shape: (``n_prisms``, 6), where
+        ``n_prisms`` is the total number of prisms.
+        This array of prisms must have valid boundaries.
+        Run ``_check_prisms`` before.
+    """
+    west, east, south, north, top, bottom = tuple(prisms[:, i] for i in range(6))
+    err_msg = "Invalid prism or prisms. "
+    bad_we = west > east
+    bad_sn = south > north
+    bad_bt = top > bottom
+    if bad_we.any():
+        err_msg += "The west boundary can't be greater than the east one.\n"
+        for prism in prisms[bad_we]:
+            err_msg += "\tInvalid prism: {}\n".format(prism)
+        raise ValueError(err_msg)
+    if bad_sn.any():
+        err_msg += "The south boundary can't be greater than the north one.\n"
+        for prism in prisms[bad_sn]:
+            err_msg += "\tInvalid prism: {}\n".format(prism)
+        raise ValueError(err_msg)
+    if bad_bt.any():
+        err_msg += "The top boundary can't be greater than the bottom one.\n"
+        for prism in prisms[bad_bt]:
+            err_msg += "\tInvalid prism: {}\n".format(prism)
+        raise ValueError(err_msg)
+
+
+@jit(nopython=True, cache=True)
+def jit_gravitational(coordinates, prisms, density, kernel, out):
+    """
+    Compute gravitational field at the computations points
+
+    Generic loop receiving the kernel function as an argument. The function
+    ``gravitational`` uses the loops compiled for each field
+    (``jit_gravitational_single``), which inline the kernel.
+    """
+    # Iterate over computation points
+    for l in range(coordinates[0].size):
+        # Iterate over prisms
+        for m in range(prisms.shape[0]):
+            # Iterate over the prism boundaries
+            for i in range(2,0,-1):
+                for j in range(2,0,-1):
+                    for k in range(2,0,-1):
+                        Y = prisms[m, -1 + j] - coordinates[0, l]
+                        X = prisms[m, 1 + i] - coordinates[1, l]
+                        Z = prisms[m, 3 + k] - coordinates[2, l]
+                        out[l] += (
+                            density[m]
+                            * (-1) ** (i + j + k)
+                            * kernel(Y, X, Z)
+                        )
+
+
+def _with_kernels(field, loop, args):
+    """
+    Call the loop with the kernels of the field with index ``field``
+
+    ``loop`` is the name of a loop of this module (a literal string), which
+    is called as ``loop(kernel, point_kernel, args)`` with the kernel of the
+    field, the kernel of the point-mass approximation of the field and the
+    tuple ``args``. Available only in jit functions (see
+    ``_overload_with_kernels``).
+    """
+    raise NotImplementedError("_with_kernels is available only in jit code")
+
+
+@overload(_with_kernels, prefer_literal=True, jit_options={"cache": True})
+def _overload_with_kernels(field, loop, args):
+    """
+    Compile ``_with_kernels`` for the loop whose name is the literal ``loop``
+
+    Each branch calls the loop with the kernels as globals, so that the
+    loop is compiled with the kernels inlined for each field. The loop is
+    chosen when the caller is compiled, since passing the loop as a
+    function object would prevent numba from caching the caller.
+    """
+    if not isinstance(loop, types.StringLiteral):
+        return None
+    function = globals()[loop.literal_value]
+
+    def implementation(field, loop, args):
+        if field == 0:
+            return function(kernel_potential, point_mass_potential, args)
+        elif field == 1:
+            return function(kernel_g_z, point_mass_g_z, args)
+        elif field == 2:
+            return function(kernel_g_x, point_mass_g_x, args)
+        elif field == 3:
+            return function(kernel_g_y, point_mass_g_y, args)
+        elif field == 4:
+            return function(kernel_g_xx, point_mass_g_xx, args)
+        elif field == 5:
+            return function(kernel_g_xy, point_mass_g_xy, args)
+        elif field == 6:
+            return function(kernel_g_xz, point_mass_g_xz, args)
+        elif field == 7:
+            return function(kernel_g_yy, point_mass_g_yy, args)
+        elif field == 8:
+            return function(kernel_g_yz, point_mass_g_yz, args)
+        else:
+            return function(kernel_g_zz, point_mass_g_zz, args)
+
+    return implementation
+
+
+@jit(nopython=True, cache=True)
+def jit_gravitational_single(coordinates, prisms, density, field, scale,
+                             out):
+    """
+    Compute gravitational field at the computations points
+
+    ``field`` is the index of the field in ``FIELDS``. The loop over prisms
+    is compiled for each field with its kernel inlined. The field at each
+    point is multiplied by ``scale`` and stored in ``out``.
+    """
+    # Iterate over computation points
+    for l in range(coordinates[0].size):
+        out[l] = scale * _single_at_point(
+            coordinates, prisms, density, field, l
+        )
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def jit_gravitational_single_parallel(coordinates, prisms, density, field,
+                                      scale, out):
+    """
+    Parallel version of ``jit_gravitational_single``
+
+    The computation points are distributed among threads. Each element of
+    ``out`` is written by a single thread and the sum over prisms and
+    boundaries follows the same order used by ``jit_gravitational_single``.
+    """
+    # Iterate over computation points
+    for l in prange(coordinates[0].size):
+        out[l] = scale * _single_at_point(
+            coordinates, prisms, density, field, l
+        )
+
+
+@jit(nopython=True, cache=True)
+def _single_at_point(coordinates, prisms, density, field, l):
+    """
+    Field with index ``field`` produced by all prisms at the computation
+    point l
+    """
+    return _with_kernels(
+        field, "_single_loop", (coordinates, prisms, density, l)
+    )
+
+
+@jit(nopython=True, cache=True, inline="always")
+def _single_loop(kernel, point_kernel, args):
+    """
+    Field produced by all prisms at the computation point l
+    """
+    coordinates, prisms, density, l = args
+    result = 0.0
+    # Iterate over prisms
+    for m in range(prisms.shape[0]):
+        result = _add_prism(coordinates, prisms, density[m], kernel, m, l,
+                            result)
+    return result
+
+
+@jit(nopython=True, cache=True, inline="always")
+def _add_prism(coordinates, prisms, density, kernel, m, l, result):
+    """
+    Add the field produced by the prism m with the given density at the
+    computation point l to result
+
+    The terms are positive at the corners with an even number of west,
+    south and top boundaries and negative otherwise.
+    """
+    # Iterate over the prism boundaries
+    for i in range(2,0,-1):
+        X = prisms[m, 1 + i] - coordinates[1, l]
+        sign_i = 1.0 if i == 2 else -1.0
+        for j in range(2,0,-1):
+            Y = prisms[m, -1 + j] - coordinates[0, l]
+            sign_j = sign_i if j == 2 else -sign_i
+            for k in range(2,0,-1):
+                Z = prisms[m, 3 + k] - coordinates[2, l]
+                sign = sign_j if k == 2 else -sign_j
+                result += density * sign * kernel(Y, X, Z)
+    return result
+
+
+@jit(nopython=True, cache=True)
+def jit_gravitational_far_field(coordinates, prisms, density, field, centers,
+                                masses, far_distances, scale, out):
+    """
+    Compute gravitational field at the computations points approximating
+    the far prisms by point masses
+
+    The prism m is replaced by a point mass at a computation point whose
+    squared distance to the prism center is greater than
+    ``far_distances[m]``. The field at each point is multiplied by
+    ``scale`` and stored in ``out``. Returns the number of approximated
+    pairs of computation points and prisms.
+    """
+    n_approximate = 0
+    # Iterate over computation points
+    for l in range(coordinates[0].size):
+        out[l] = 0.0
+        n_approximate += _far_field_at_point(
+            coordinates, prisms, density, field, centers, masses,
+            far_distances, l, out
+        )
+        out[l] *= scale
+    return n_approximate
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def jit_gravitational_far_field_parallel(coordinates, prisms, density, field,
+                                         centers, masses, far_distances,
+                                         scale, out):
+    """
+    Parallel version of ``jit_gravitational_far_field``
+    """
+    n_approximate = 0
+    # Iterate over computation points
+    for l in prange(coordinates[0].size):
+        out[l] = 0.0
+        n_approximate += _far_field_at_point(
+            coordinates, prisms, density, field, centers, masses,
+            far_distances, l, out
+        )
+        out[l] *= scale
+    return n_approximate
+
+
+@jit(nopython=True, cache=True)
+def _far_field_at_point(coordinates, prisms, density, field, centers, masses,
+                        far_distances, l, out):
+    """
+    Accumulate the field with index ``field`` at the computation point l and
+    return the number of prisms approximated by point masses
+    """
+    return _with_kernels(
+        field, "_far_field_loop",
+        (coordinates, prisms, density, centers, masses, far_distances, l, out)
+    )
+
+
+@jit(nopython=True, cache=True, inline="always")
+def _far_field_loop(kernel, point_kernel, args):
+    """
+    Accumulate the field produced by all prisms at the computation point l
+    and return the number of prisms approximated by point masses
+    """
+    coordinates, prisms, density, centers, masses, far_distances, l, out = (
+        args
+    )
+    n_approximate = 0
+    # Iterate over prisms
+    for m in range(prisms.shape[0]):
+        Y = centers[m, 0] - coordinates[0, l]
+        X = centers[m, 1] - coordinates[1, l]
+        Z = centers[m, 2] - coordinates[2, l]
+        if Y ** 2 + X ** 2 + Z ** 2 > far_distances[m]:
+            out[l] += masses[m] * point_kernel(Y, X, Z)
+            n_approximate += 1
+        else:
+            out[l] = _add_prism(coordinates, prisms, density[m], kernel, m,
+                                l, out[l])
+    return n_approximate
+
+
+@jit(nopython=True, cache=True)
+def jit_gravitational_tree(coordinates, prisms, density, field, order, lower,
+                           upper, centers, masses, far_distances, children,
+                           first, count, scale, out):
+    """
+    Compute gravitational field at the computations points by traversing an
+    octree of prisms
+
+    A node is replaced by a point mass at a computation point whose squared
+    distance to the box of the node is greater than ``far_distances[node]``.
+    The field at each point is multiplied by ``scale`` and stored in
+    ``out``. Returns the number of pairs of points and prisms computed with
+    the exact formulas and the number of point-mass evaluations.
+    """
+    n_exact = 0
+    n_approximate = 0
+    stack = np.empty(masses.size, dtype=np.int64)
+    # Iterate over computation points
+    for l in range(coordinates[0].size):
+        out[l] = 0.0
+        exact, approximate = _tree_at_point(
+            coordinates, prisms, density, field, order, lower, upper,
+            centers, masses, far_distances, children, first, count, l, out,
+            stack
+        )
+        out[l] *= scale
+        n_exact += exact
+        n_approximate += approximate
+    return n_exact, n_approximate
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def jit_gravitational_tree_parallel(coordinates, prisms, density, field,
+                                    order, lower, upper, centers, masses,
+                                    far_distances, children, first, count,
+                                    scale, out):
+    """
+    Parallel version of ``jit_gravitational_tree``
+    """
+    n_exact = 0
+    n_approximate = 0
+    # Iterate over computation points
+    for l in prange(coordinates[0].size):
+        stack = np.empty(masses.size, dtype=np.int64)
+        out[l] = 0.0
+        exact, approximate = _tree_at_point(
+            coordinates, prisms, density, field, order, lower, upper,
+            centers, masses, far_distances, children, first, count, l, out,
+            stack
+        )
+        out[l] *= scale
+        n_exact += exact
+        n_approximate += approximate
+    return n_exact, n_approximate
+
+
+@jit(nopython=True, cache=True)
+def _tree_at_point(coordinates, prisms, density, field, order, lower, upper,
+                   centers, masses, far_distances, children, first, count, l,
+                   out, stack):
+    """
+    Accumulate the field with index ``field`` produced by all prisms of the
+    octree at the computation point l
+    """
+    return _with_kernels(
+        field, "_tree_loop",
+        (coordinates, prisms, density, order, lower, upper, centers, masses,
+         far_distances, children, first, count, l, out, stack)
+    )
+
+
+@jit(nopython=True, cache=True, inline="always")
+def _tree_loop(kernel, point_kernel, args):
+    """
+    Accumulate the field produced by all prisms of the octree at the
+    computation point l
+    """
+    (coordinates, prisms, density, order, lower, upper, centers, masses,
+     far_distances, children, first, count, l, out, stack) = args
+    n_exact = 0
+    n_approximate = 0
+    # start from the root node
+    stack[0] = 0
+    size = 1
+    while size > 0:
+        size -= 1
+        node = stack[size]
+        # squared distance between the computation point and the node box
+        distance = 0.0
+        for axis in range(3):
+            coordinate = coordinates[axis, l]
+            if coordinate < lower[node, axis]:
+                distance += (lower[node, axis] - coordinate) ** 2
+            elif coordinate > upper[node, axis]:
+                distance += (coordinate - upper[node, axis]) ** 2
+        if distance > far_distances[node]:
+            Y = centers[node, 0] - coordinates[0, l]
+            X = centers[node, 1] - coordinates[1, l]
+            Z = centers[node, 2] - coordinates[2, l]
+            out[l] += masses[node] * point_kernel(Y, X, Z)
+            n_approximate += 1
+        elif children[node, 0] < 0:
+            for p in range(first[node], first[node] + count[node]):
+                m = order[p]
+                out[l] = _add_prism(coordinates, prisms, density[m], kernel,
+                                    m, l, out[l])
+            n_exact += count[node]
+        else:
+            for c in range(8):
+                if children[node, c] < 0:
+                    break
+                stack[size] = children[node, c]
+                size += 1
+    return n_exact, n_approximate
+
+
+@jit(nopython=True, cache=True)
+def jit_gravitational_radius(coordinates, prisms, density, field, centers,
+                             masses, lower, size, shape, order, start,
+                             radius, scale, out, visited):
+    """
+    Compute gravitational field at the computations points considering only
+    the prisms whose centers are within a truncation radius
+
+    The centers of the prisms are indexed by a uniform grid (see ``_Grid``)
+    and only the cells intersecting the sphere with the given radius are
+    visited. The field at each point is multiplied by ``scale`` and stored in
+    ``out``, and the sum of the absolute values of the masses of the visited
+    prisms is stored in ``visited``. Returns the number of pairs of points
+    and prisms computed.
+    """
+    n_exact = 0
+    # Iterate over computation points
+    for l in range(coordinates[0].size):
+        result, mass, count = _radius_at_point(
+            coordinates, prisms, density, field, centers, masses, lower,
+            size, shape, order, start, radius, l
+        )
+        out[l] = scale * result
+        visited[l] = mass
+        n_exact += count
+    return n_exact
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def jit_gravitational_radius_parallel(coordinates, prisms, density, field,
+                                      centers, masses, lower, size, shape,
+                                      order, start, radius, scale, out,
+                                      visited):
+    """
+    Parallel version of ``jit_gravitational_radius``
+    """
+    n_exact = 0
+    # Iterate over computation points
+    for l in prange(coordinates[0].size):
+        result, mass, count = _radius_at_point(
+            coordinates, prisms, density, field, centers, masses, lower,
+            size, shape, order, start, radius, l
+        )
+        out[l] = scale * result
+        visited[l] = mass
+        n_exact += count
+    return n_exact
+
+
+@jit(nopython=True, cache=True)
+def _radius_at_point(coordinates, prisms, density, field, centers, masses,
+                     lower, size, shape, order, start, radius, l):
+    """
+    Field with index ``field`` produced by the prisms within the truncation
+    radius of the computation point l, absolute mass of these prisms and
+    their number
+    """
+    return _with_kernels(
+        field, "_radius_loop",
+        (coordinates, prisms, density, centers, masses, lower, size, shape,
+         order, start, radius, l)
+    )
+
+
+@jit(nopython=True, cache=True, inline="always")
+def _radius_loop(kernel, point_kernel, args):
+    """
+    Field produced by the prisms within the truncation radius of the
+    computation point l, absolute mass of these prisms and their number
+    """
+    (coordinates, prisms, density, centers, masses, lower, size, shape, order,
+     start, radius, l) = args
+    result = 0.0
+    mass = 0.0
+    count = 0
+    # range of cells intersecting the sphere centered at the point
+    first_a, last_a = _cell_range(coordinates[0, l], radius, lower[0], size,
+                                  shape[0])
+    first_b, last_b = _cell_range(coordinates[1, l], radius, lower[1], size,
+                                  shape[1])
+    first_c, last_c = _cell_range(coordinates[2, l], radius, lower[2], size,
+                                  shape[2])
+    # Iterate over the cells
+    for a in range(first_a, last_a + 1):
+        for b in range(first_b, last_b + 1):
+            for c in range(first_c, last_c + 1):
+                cell = (a * shape[1] + b) * shape[2] + c
+                for p in range(start[cell], start[cell + 1]):
+                    m = order[p]
+                    Y = centers[m, 0] - coordinates[0, l]
+                    X = centers[m, 1] - coordinates[1, l]
+                    Z = centers[m, 2] - coordinates[2, l]
+                    if Y ** 2 + X ** 2 + Z ** 2 > radius ** 2:
+                        continue
+                    result = _add_prism(coordinates, prisms, density[m],
+                                        kernel, m, l, result)
+                    mass += np.abs(masses[m])
+                    count += 1
+    return result, mass, count
+
+
+@jit(nopython=True, cache=True, inline="always")
+def _cell_range(coordinate, radius, lower, size, n):
+    """
+    First and last cells, along one axis of a uniform grid, intersecting the
+    interval of the given radius centered at the coordinate
+    """
+    first = int(np.floor((coordinate - radius - lower) / size))
+    last = int(np.floor((coordinate + radius - lower) / size))
+    return max(first, 0), min(last, n - 1)
+
+
+@jit(nopython=True, cache=True)
+def jit_gravitational_fields(coordinates, prisms, density, mask, indices,
+                             scales, out):
+    """
+    Compute several gravitational fields at the computations points
+
+    The kernels are evaluated by ``kernel_fields``, so the terms shared by
+    different fields are computed only once per prism boundary. Bit ``f``
+    of ``mask`` flags the field ``FIELDS[f]`` and line ``q`` of ``out``
+    receives the field ``indices[q]`` multiplied by ``scales[q]``.
+    """
+    values = np.zeros(len(FIELDS))
+    # Iterate over computation points
+    for l in range(coordinates[0].size):
+        _fields_at_point(coordinates, prisms, density, mask, indices,
+                         scales, values, l, out)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def jit_gravitational_fields_parallel(coordinates, prisms, density, mask,
+                                      indices, scales, out):
+    """
+    Compute several gravitational fields at the computations points in
+    parallel
+
+    The computation points are distributed among threads, as in
+    ``jit_gravitational_single_parallel``.
+    """
+    # Iterate over computation points
+    for l in prange(coordinates[0].size):
+        values = np.zeros(len(FIELDS))
+        _fields_at_point(coordinates, prisms, density, mask, indices,
+                         scales, values, l, out)
+
+
+@jit(nopython=True, cache=True)
+def _fields_at_point(coordinates, prisms, density, mask, indices, scales,
+                     values, l, out):
+    """
+    Compute the fields produced by all prisms at the computation point l
+    """
+    for q in range(indices.size):
+        out[q, l] = 0.0
+    # Iterate over prisms
+    for m in range(prisms.shape[0]):
+        # Iterate over the prism boundaries
+        for i in range(2,0,-1):
+            X = prisms[m, 1 + i] - coordinates[1, l]
+            sign_i = 1.0 if i == 2 else -1.0
+            for j in range(2,0,-1):
+                Y = prisms[m, -1 + j] - coordinates[0, l]
+                sign_j = sign_i if j == 2 else -sign_i
+                for k in range(2,0,-1):
+                    Z = prisms[m, 3 + k] - coordinates[2, l]
+                    sign = sign_j if k == 2 else -sign_j
+                    kernel_fields(Y, X, Z, mask, values)
+                    for q in range(indices.size):
+                        out[q, l] += density[m] * sign * values[indices[q]]
+    for q in range(indices.size):
+        out[q, l] *= scales[q]
+
+
+@jit(nopython=True, cache=True)
+def jit_sensitivity(coordinates, prisms, field, scale, out):
+    """
+    Compute the sensitivity matrix of a gravitational field
+
+    The contribution of each prism is accumulated in double precision,
+    multiplied by ``scale`` and then stored in ``out``.
+    """
+    # Iterate over computation points
+    for l in range(coordinates[0].size):
+        _sensitivity_line(coordinates, prisms, field, scale, l, out)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def jit_sensitivity_parallel(coordinates, prisms, field, scale, out):
+    """
+    Parallel version of ``jit_sensitivity``
+    """
+    # Iterate over computation points
+    for l in prange(coordinates[0].size):
+        _sensitivity_line(coordinates, prisms, field, scale, l, out)
+
+
+@jit(nopython=True, cache=True)
+def _sensitivity_line(coordinates, prisms, field, scale, l, out):
+    """
+    Compute the line l of the sensitivity matrix of the field with index
+    ``field``
+    """
+    _with_kernels(
+        field, "_sensitivity_loop", (coordinates, prisms, scale, l, out)
+    )
+
+
+@jit(nopython=True, cache=True, inline="always")
+def _sensitivity_loop(kernel, point_kernel, args):
+    """
+    Compute the line l of the sensitivity matrix
+    """
+    coordinates, prisms, scale, l, out = args
+    # Iterate over prisms
+    for m in range(prisms.shape[0]):
+        out[l, m] = _add_prism(coordinates, prisms, 1.0, kernel, m, l,
+                               0.0) * scale
+
+
+@jit(nopython=True, cache=True)
+def jit_gravitational_vertices(coordinates, vertices, weights, field, scale,
+                               out):
+    """
+    Compute gravitational field at the computations points by evaluating the
+    kernel at the unique vertices of a mesh of prisms
+
+    The field at each point is multiplied by ``scale`` and stored in
+    ``out``.
+    """
+    # Iterate over computation points
+    for l in range(coordinates[0].size):
+        out[l] = scale * _vertices_at_point(
+            coordinates, vertices, weights, field, l
+        )
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def jit_gravitational_vertices_parallel(coordinates, vertices, weights,
+                                        field, scale, out):
+    """
+    Parallel version of ``jit_gravitational_vertices``
+    """
+    # Iterate over computation points
+    for l in prange(coordinates[0].size):
+        out[l] = scale * _vertices_at_point(
+            coordinates, vertices, weights, field, l
+        )
+
+
+@jit(nopython=True, cache=True)
+def _vertices_at_point(coordinates, vertices, weights, field, l):
+    """
+    Field with index ``field`` produced by all vertices at the computation
+    point l
+    """
+    return _with_kernels(
+        field, "_vertices_loop", (coordinates, vertices, weights, l)
+    )
+
+
+@jit(nopython=True, cache=True, inline="always")
+def _vertices_loop(kernel, point_kernel, args):
+    """
+    Field produced by all vertices at the computation point l
+    """
+    coordinates, vertices, weights, l = args
+    result = 0.0
+    # Iterate over vertices
+    for v in range(weights.size):
+        Y = vertices[v, 0] - coordinates[0, l]
+        X = vertices[v, 1] - coordinates[1, l]
+        Z = vertices[v, 2] - coordinates[2, l]
+        result += weights[v] * kernel(Y, X, Z)
+    return result
+
+
+@jit(nopython=True, cache=True)
+def jit_gravitational_vertices_fields(coordinates, vertices, weights, mask,
+                                      indices, scales, out):
+    """
+    Compute several gravitational fields at the computations points by
+    evaluating ``kernel_fields`` at the unique vertices of a mesh of prisms
+
+    Line ``q`` of ``out`` receives the field ``indices[q]`` multiplied by
+    ``scales[q]``.
+    """
+    values = np.zeros(len(FIELDS))
+    # Iterate over computation points
+    for l in range(coordinates[0].size):
+        _vertices_fields_at_point(coordinates, vertices, weights, mask,
+                                  indices, scales, values, l, out)
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def jit_gravitational_vertices_fields_parallel(coordinates, vertices,
+                                               weights, mask, indices, scales,
+                                               out):
+    """
+    Parallel version of ``jit_gravitational_vertices_fields``
+    """
+    # Iterate over computation points
+    for l in prange(coordinates[0].size):
+        values = np.zeros(len(FIELDS))
+        _vertices_fields_at_point(coordinates, vertices, weights, mask,
+                                  indices, scales, values, l, out)
+
+
+@jit(nopython=True, cache=True)
+def _vertices_fields_at_point(coordinates, vertices, weights, mask, indices,
+                              scales, values, l, out):
+    """
+    Compute the fields produced by all vertices at the computation point l
+    """
+    for q in range(indices.size):
+        out[q, l] = 0.0
+    # Iterate over vertices
+    for v in range(weights.size):
+        Y = vertices[v, 0] - coordinates[0, l]
+        X = vertices[v, 1] - coordinates[1, l]
+        Z = vertices[v, 2] - coordinates[2, l]
+        kernel_fields(Y, X, Z, mask, values)
+        for q in range(indices.size):
+            out[q, l] += weights[v] * values[indices[q]]
+    for q in range(indices.size):
+        out[q, l] *= scales[q]
+
+
+@jit(nopython=True, cache=True)
+def jit_singular_counts(coordinates, prisms, log_terms, atan2_terms, out):
+    """
+    Count the evaluations of the kernels in which ``safe_log`` and
+    ``safe_atan2`` handle singular arguments at each computation point
+
+    The terms of the kernels are given by the bit masks ``log_terms`` and
+    ``atan2_terms`` (see ``_singular_terms``). The counts of ``safe_log``
+    and ``safe_atan2`` are stored in the first and second lines of out.
+    """
+    for l in range(coordinates[0].size):
+        _singular_at_point(
+            coordinates, prisms, log_terms, atan2_terms, l, out
+        )
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def jit_singular_counts_parallel(coordinates, prisms, log_terms, atan2_terms,
+                                 out):
+    """
+    Count the singular evaluations at each computation point in parallel
+    (see ``jit_singular_counts``)
+    """
+    for l in prange(coordinates[0].size):
+        _singular_at_point(
+            coordinates, prisms, log_terms, atan2_terms, l, out
+        )
+
+
+@jit(nopython=True, cache=True, inline="always")
+def _singular_at_point(coordinates, prisms, log_terms, atan2_terms, l, out):
+    """
+    Count the singular evaluations at the computation point l, visiting the
+    corners of the prisms as in ``_add_prism``
+    """
+    singular_log = 0
+    singular_atan2 = 0
+    for m in range(prisms.shape[0]):
+        for i in range(2,0,-1):
+            X = prisms[m, 1 + i] - coordinates[1, l]
+            for j in range(2,0,-1):
+                Y = prisms[m, -1 + j] - coordinates[0, l]
+                for k in range(2,0,-1):
+                    Z = prisms[m, 3 + k] - coordinates[2, l]
+                    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+                    log = (
+                        (log_terms & 1 != 0 and abs(
+                            log_radius_argument(Y, X, Z, radius)) < 1e-10)
+                        or (log_terms & 2 != 0 and abs(
+                            log_radius_argument(X, Y, Z, radius)) < 1e-10)
+                        or (log_terms & 4 != 0 and abs(
+                            log_radius_argument(Z, Y, X, radius)) < 1e-10)
+                    )
+                    atan2 = (
+                        (atan2_terms & 1 != 0 and Y * radius == 0)
+                        or (atan2_terms & 2 != 0 and X * radius == 0)
+                        or (atan2_terms & 4 != 0 and Z * radius == 0)
+                    )
+                    singular_log += 1 if log else 0
+                    singular_atan2 += 1 if atan2 else 0
+    out[0, l] = singular_log
+    out[1, l] = singular_atan2
+
+
+def _run_parallel(function, workers, *args):
+    """
+    Call a parallel jit function using the given number of threads
+
+    The number of threads used by numba is restored after the call.
+    """
+    if workers is None:
+        return function(*args)
+    if workers < 1 or workers > numba.config.NUMBA_NUM_THREADS:
+        raise ValueError(
+            "Invalid number of workers ({}). ".format(workers)
+            + "It must be between 1 and {}".format(
+                numba.config.NUMBA_NUM_THREADS
+            )
+        )
+    previous = numba.get_num_threads()
+    numba.set_num_threads(workers)
+    try:
+        return function(*args)
+    finally:
+        numba.set_num_threads(previous)
+
+
+@jit(nopython=True, cache=True)
+def kernel_potential(Y, X, Z):
+    """
+    Kernel function for potential gravitational field generated by a prism
+    """
+    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+    kernel = (
+        Y * X * log_radius(Z, Y, X, radius)
+        + X * Z * log_radius(Y, X, Z, radius)
+        + Y * Z * log_radius(X, Y, Z, radius)
+        - HALF * Y ** 2 * safe_atan2(Z * X, Y * radius)
+        - HALF * X ** 2 * safe_atan2(Z * Y, X * radius)
+        - HALF * Z ** 2 * safe_atan2(Y * X, Z * radius)
+    )
+    return kernel
+
+
+@jit(nopython=True, cache=True)
+def kernel_g_z(Y, X, Z):
+    """
+    Kernel for downward component of gravitational acceleration of a prism
+    """
+    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+    kernel = -(
+        Y * log_radius(X, Y, Z, radius)
+        + X * log_radius(Y, X, Z, radius)
+        - Z * safe_atan2(Y * X, Z * radius)
+    )
+    return kernel
+
+
+@jit(nopython=True, cache=True)
+def kernel_g_x(Y, X, Z):
+    """
+    Kernel for x component of gravitational acceleration of a prism
+    """
+    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+    kernel = -(
+        Y * log_radius(Z, Y, X, radius)
+        + Z * log_radius(Y, X, Z, radius)
+        - X * safe_atan2(Y * Z, X * radius)
+    )
+    return kernel
+
+
+@jit(nopython=True, cache=True)
+def kernel_g_y(Y, X, Z):
+    """
+    Kernel for y component of gravitational acceleration of a prism
+    """
+    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+    kernel = -(
+        X * log_radius(Z, Y, X, radius)
+        + Z * log_radius(X, Y, Z, radius)
+        - Y * safe_atan2(Z * X, Y * radius)
+    )
+    return kernel
+
+
+@jit(nopython=True, cache=True)
+def kernel_g_xx(Y, X, Z):
+    """
+    Kernel for xx component of the gravity gradient tensor of a prism
+    """
+    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+    return -safe_atan2(Z * Y, X * radius)
+
+
+@jit(nopython=True, cache=True)
+def kernel_g_xy(Y, X, Z):
+    """
+    Kernel for xy component of the gravity gradient tensor of a prism
+    """
+    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+    return log_radius(Z, Y, X, radius)
+
+
+@jit(nopython=True, cache=True)
+def kernel_g_xz(Y, X, Z):
+    """
+    Kernel for xz component of the gravity gradient tensor of a prism
+    """
+    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+    return log_radius(Y, X, Z, radius)
+
+
+@jit(nopython=True, cache=True)
+def kernel_g_yy(Y, X, Z):
+    """
+    Kernel for yy component of the gravity gradient tensor of a prism
+    """
+    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+    return -safe_atan2(Z * X, Y * radius)
+
+
+@jit(nopython=True, cache=True)
+def kernel_g_yz(Y, X, Z):
+    """
+    Kernel for yz component of the gravity gradient tensor of a prism
+    """
+    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+    return log_radius(X, Y, Z, radius)
+
+
+@jit(nopython=True, cache=True)
+def kernel_g_zz(Y, X, Z):
+    """
+    Kernel for zz component of the gravity gradient tensor of a prism
+    """
+    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+    return -safe_atan2(Y * X, Z * radius)
+
+
+@jit(nopython=True, cache=True)
+def kernel_fields(Y, X, Z, mask, values):
+    """
+    Fused kernel for several gravitational fields generated by a prism
+
+    The radius and the logarithm and arctangent terms are computed once and
+    shared by all fields flagged in the bits of the integer ``mask`` (bit
+    ``f`` corresponds to ``FIELDS[f]``). The kernel of each flagged field is
+    stored in the corresponding element of ``values`` and is equal to the
+    one computed by its own kernel function.
+    """
+    potential, g_z = mask & 1 != 0, mask & 2 != 0
+    g_x, g_y = mask & 4 != 0, mask & 8 != 0
+    g_xx, g_xy, g_xz = mask & 16 != 0, mask & 32 != 0, mask & 64 != 0
+    g_yy, g_yz, g_zz = mask & 128 != 0, mask & 256 != 0, mask & 512 != 0
+    radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+    # logarithm terms
+    if potential or g_z or g_y or g_yz:
+        log_x = log_radius(X, Y, Z, radius)
+    if potential or g_z or g_x or g_xz:
+        log_y = log_radius(Y, X, Z, radius)
+    if potential or g_x or g_y or g_xy:
+        log_z = log_radius(Z, Y, X, radius)
+    # arctangent terms
+    if potential or g_x or g_xx:
+        atan_x = safe_atan2(Z * Y, X * radius)
+    if potential or g_y or g_yy:
+        atan_y = safe_atan2(Z * X, Y * radius)
+    if potential or g_z or g_zz:
+        atan_z = safe_atan2(Y * X, Z * radius)
+    if potential:
+        values[0] = (
+            Y * X * log_z
+            + X * Z * log_y
+            + Y * Z * log_x
+            - HALF * Y ** 2 * atan_y
+            - HALF * X ** 2 * atan_x
+            - HALF * Z ** 2 * atan_z
+        )
+    if g_z:
+        values[1] = -(
+            Y * log_x
+            + X * log_y
+            - Z * atan_z
+        )
+    if g_x:
+        values[2] = -(
+            Y * log_z
+            + Z * log_y
+            - X * atan_x
+        )
+    if g_y:
+        values[3] = -(
+            X * log_z
+            + Z * log_x
+            - Y * atan_y
+        )
+    if g_xx:
+        values[4] = -atan_x
+    if g_xy:
+        values[5] = log_z
+    if g_xz:
+        values[6] = log_y
+    if g_yy:
+        values[7] = -atan_y
+    if g_yz:
+        values[8] = log_x
+    if g_zz:
+        values[9] = -atan_z
+
+
+@jit(nopython=True, cache=True)
+def point_mass_potential(Y, X, Z):
+    """
+    Kernel for potential gravitational field generated by a point mass
+    """
+    return 1 / np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+
+
+@jit(nopython=True, cache=True)
+def point_mass_g_z(Y, X, Z):
+    """
+    Kernel for downward component of gravitational acceleration of a point
+    mass
+    """
+    return Z / np.sqrt(Y ** 2 + X ** 2 + Z ** 2) ** 3
+
+
+@jit(nopython=True, cache=True)
+def point_mass_g_x(Y, X, Z):
+    """
+    Kernel for x component of gravitational acceleration of a point mass
+    """
+    return X / np.sqrt(Y ** 2 + X ** 2 + Z ** 2) ** 3
+
+
+@jit(nopython=True, cache=True)
+def point_mass_g_y(Y, X, Z):
+    """
+    Kernel for y component of gravitational acceleration of a point mass
+    """
+    return Y / np.sqrt(Y ** 2 + X ** 2 + Z ** 2) ** 3
+
+
+@jit(nopython=True, cache=True)
+def point_mass_g_xx(Y, X, Z):
+    """
+    Kernel for xx component of the gravity gradient tensor of a point mass
+    """
+    radius2 = Y ** 2 + X ** 2 + Z ** 2
+    return (3 * X ** 2 - radius2) / np.sqrt(radius2) ** 5
+
+
+@jit(nopython=True, cache=True)
+def point_mass_g_xy(Y, X, Z):
+    """
+    Kernel for xy component of the gravity gradient tensor of a point mass
+    """
+    return 3 * X * Y / np.sqrt(Y ** 2 + X ** 2 + Z ** 2) ** 5
+
+
+@jit(nopython=True, cache=True)
+def point_mass_g_xz(Y, X, Z):
+    """
+    Kernel for xz component of the gravity gradient tensor of a point mass
+    """
+    return 3 * X * Z / np.sqrt(Y ** 2 + X ** 2 + Z ** 2) ** 5
+
+
+@jit(nopython=True, cache=True)
+def point_mass_g_yy(Y, X, Z):
+    """
+    Kernel for yy component of the gravity gradient tensor of a point mass
+    """
+    radius2 = Y ** 2 + X ** 2 + Z ** 2
+    return (3 * Y ** 2 - radius2) / np.sqrt(radius2) ** 5
+
+
+@jit(nopython=True, cache=True)
+def point_mass_g_yz(Y, X, Z):
+    """
+    Kernel for yz component of the gravity gradient tensor of a point mass
+    """
+    return 3 * Y * Z / np.sqrt(Y ** 2 + X ** 2 + Z ** 2) ** 5
+
+
+@jit(nopython=True, cache=True)
+def point_mass_g_zz(Y, X, Z):
+    """
+    Kernel for zz component of the gravity gradient tensor of a point mass
+    """
+    radius2 = Y ** 2 + X ** 2 + Z ** 2
+    return (3 * Z ** 2 - radius2) / np.sqrt(radius2) ** 5
+
+
+@jit(nopython=True, cache=True)
+def safe_atan2(y, x):
+    """
+    Principal value of the arctangent expressed as a two variable function
+
+    This modification has to be made to the arctangent function so the
+    gravitational field of the prism satisfies the Poisson's equation.
+    Therefore, it guarantees that the fields satisfies the symmetry properties
+    of the prism. This modified function has been defined according to
+    Fukushima (2020, eq. 72).
+    """
+    if x != 0:
+        result = np.arctan(y / x)
+    else:
+        # pi/2 if y > 0, -pi/2 if y < 0 and 0 if y = 0, with the type of y
+        result = np.arctan2(y, np.abs(x))
+    return result
+
+
+@jit(nopython=True, cache=True)
+def safe_log(x):
+    """
+    Modified log to return 0 for log(0).
+    The limits in the formula terms tend to 0.
+    """
+    if np.abs(x) < 1e-10:
+        # zero with the type of x
+        result = x - x
     else:
         result = np.log(x)
     return result
+
+
+@jit(nopython=True, cache=True, error_model="numpy")
+def safe_atan2_array(y, x):
+    """
+    Branch-free version of ``safe_atan2`` for arrays
+
+    Gives the same results as ``safe_atan2`` for arrays (or scalars) y and x
+    with the same shape. Since it has no branches, the loops over the
+    elements can be vectorized by the compiler. For x = 0, the result is
+    pi/2 if y > 0, -pi/2 if y < 0 and 0 if y = 0. The kernels call the
+    scalar ``safe_atan2``, which is faster for a single argument.
+    """
+    # replace x = -0 by 0 (the sign of y / 0 is the sign of y) and x = 0 by 1
+    # if y = 0 (0 / 1 = 0)
+    x = x + (x - x) + (np.abs(x) + np.abs(y) == 0)
+    return np.arctan(y / x)
+
+
+@jit(nopython=True, cache=True)
+def safe_log_array(x):
+    """
+    Branch-free version of ``safe_log`` for arrays
+
+    Gives the same results as ``safe_log`` for an array (or scalar) x. The
+    values with absolute value smaller than 1e-10 are replaced by 1 before
+    computing the logarithm, so there are no branches.
+    """
+    small = np.abs(x) < 1e-10
+    large = np.abs(x) >= 1e-10
+    return np.log(x * large + small)
+
+
+@jit(nopython=True, cache=True)
+def log_radius(v, a, b, radius):
+    """
+    Modified log of v + radius, in which radius is sqrt(v**2 + a**2 + b**2)
+
+    For negative v, the sum nearly cancels when a and b are small compared
+    with v, which happens at computation points near the lines containing
+    the edges of a prism. It is then computed as
+    (a**2 + b**2) / (radius - v), which is equal to v + radius but has no
+    cancellation. This keeps the kernels accurate in single precision.
+    """
+    return safe_log(log_radius_argument(v, a, b, radius))
+
+
+@jit(nopython=True, cache=True, error_model="numpy")
+def log_radius_argument(v, a, b, radius):
+    """
+    Argument v + radius of the logarithm computed by ``log_radius``
+    Both forms are computed and one of them is selected, which avoids a
+    branch that is hard to predict inside the kernels.
+    """
+    stable = (a * a + b * b) / (radius - v)
+    return stable if v < 0 else v + radius
@@ -0,0 +1,338 @@
+'''
+Reduction of gravity observations to gravity disturbances and Bouguer
+disturbances.
+
+The class ``ReductionPipeline`` chains the stages of the reduction: removal
+of the normal gravity computed by the closed-form formula of ``gamma``,
+removal of the Bouguer plate and removal of the gravitational effect of the
+topography, modeled by prisms and computed by ``prism.gravitational``. The
+stations are processed in chunks and the output of each expensive stage is
+cached with a key computed from its inputs, so that running the pipeline
+again after changing some inputs (e.g., the observed gravity or the density
+of the topography) recomputes only the stages depending on them.
+
+References
+
+* Hofmann-Wellenhof, B. and Moritz, H. (2006). Physical Geodesy. Springer,
+    2nd edition. http://doi.org/10.1007/978-3-211-33545-1
+'''
+
+
+import collections
+import hashlib
+import os
+import re
+import tempfile
+
+import numpy as np
+
+import gamma
+import prism
+
+
+#: Coordinates and observations of the stations used by the pipeline. The
+#: coordinates y and x are needed only to compute the effect of the
+#: topography.
+STATION_KEYS = ("latitude", "height", "gravity", "y", "x")
+
+#: Stages of the pipeline whose outputs are cached
+STAGES = ("normal", "topography")
+
+#: Names of the files storing the cached outputs of the stages
+_STAGE_FILE = re.compile(
+    r"^reduction-({})-[0-9a-f]{{64}}\.npy$".format("|".join(STAGES))
+)
+
+
+class ReductionPipeline(object):
+    """
+    Pipeline reducing gravity observations to gravity disturbances and
+    Bouguer disturbances.
+
+    The stages computed at each station are:
+
+    - ``normal``: normal gravity at the geodetic latitude and height of the
+      station, computed by the fused closed-form formula of
+      ``gamma.Ellipsoid``.
+    - ``topography``: vertical component of the attraction of the
+      topography modeled by ``prisms`` (computed only if they are given).
+
+    and the results derived from them are the attraction of a Bouguer
+    plate with density ``bouguer_density`` and thickness equal to the height
+    of the station (``plate``, ``2 * pi * G * density * height``), the
+    gravity disturbance (``disturbance``, observed minus normal gravity),
+    the simple Bouguer disturbance (``simple_bouguer``, disturbance minus
+    plate), the terrain correction (``terrain_correction``, plate minus
+    topography) and the complete Bouguer disturbance
+    (``complete_bouguer``, disturbance minus topography). All of them are
+    given in mGal.
+
+    The outputs of the stages are cached for each chunk of stations with a
+    key computed from the inputs of the stage (the relevant coordinates of
+    the stations and the parameters of the stage), so that a new run
+    recomputes only the stages whose inputs changed. The derived results
+    are cheap and always computed. The number of chunks computed by each
+    stage is stored in the dictionary ``computed``. When the total size of
+    the outputs cached in memory exceeds ``max_bytes``, the least recently
+    used ones are removed.
+
+    Parameters
+    ----------
+    ellipsoid : gamma.Ellipsoid or None
+        Reference ellipsoid of the normal gravity. If None, WGS84 is used.
+    prisms : 2d-array or None
+        Prisms modeling the topography, in the Cartesian system of the
+        stations (see ``prism.gravitational``, the z axis points down). If
+        None, the stages depending on the topography are not computed.
+    density : float or 1d-array
+        Density of the prisms in kg/m^3. Default is 2670.
+    bouguer_density : float
+        Density of the Bouguer plate in kg/m^3. Default is 2670.
+    chunk_size : int
+        Maximum number of stations processed at once. Default is 100000.
+    directory : str or None
+        Directory storing the cached outputs as ``.npy`` files, which are
+        reused by other pipelines (and processes) using the same directory.
+        It is created if needed. The files are named
+        ``reduction-<stage>-<hash>.npy`` and other files in the directory
+        are never removed by the pipeline. Each file is written to a
+        temporary file with a unique name and renamed when complete, so that
+        several processes can share the directory. If None, the outputs are
+        cached in memory. Default is None.
+    max_bytes : int or None
+        Maximum total size (in bytes) of the outputs cached in memory (it
+        does not apply to ``directory``). The output of the last chunk is
+        never removed, even if it is larger than ``max_bytes``. If None, the
+        size is not bounded. Default is 2**28 (256 MiB).
+    parallel : bool
+        If True, the normal gravity and the topography are computed in
+        parallel. Default is False.
+    **kwargs
+        Other parameters of ``prism.gravitational`` used by the stage
+        ``topography`` (e.g., ``engine``, ``far_field`` or ``radius``).
+    """
+
+    def __init__(self, ellipsoid=None, prisms=None, density=2670.0,
+                 bouguer_density=2670.0, chunk_size=100000, directory=None,
+                 max_bytes=2**28, parallel=False, **kwargs):
+        if chunk_size < 1:
+            raise ValueError(
+                "Invalid chunk_size ({}). It must be positive".format(
+                    chunk_size
+                )
+            )
+        if ellipsoid is None:
+            ellipsoid = gamma.Ellipsoid.wgs84()
+        self.ellipsoid = ellipsoid
+        self.prisms = None
+        self.density = None
+        if prisms is not None:
+            self.prisms = np.ascontiguousarray(prisms, dtype="float64")
+            self.density = np.ascontiguousarray(
+                np.broadcast_to(density, (self.prisms.shape[0],)),
+                dtype="float64"
+            )
+            prism._check_input(np.zeros((3, 0)), self.prisms, self.density)
+            prism._check_prisms(self.prisms)
+        self.bouguer_density = bouguer_density
+        self.chunk_size = chunk_size
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.parallel = parallel
+        self.kwargs = kwargs
+        self.computed = dict.fromkeys(STAGES, 0)
+        # outputs cached in memory, from the least to the most recently used
+        self._memory = collections.OrderedDict()
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def run(self, stations):
+        """
+        Reduce the observations of all stations
+
+        Parameters
+        ----------
+        stations : dict or iterable of dicts
+            See ``run_chunks``.
+
+        Returns
+        -------
+        result : dict
+            Dictionary whose keys are the stages and derived results and
+            whose values are arrays with the values at all stations.
+        """
+        chunks = list(self.run_chunks(stations))
+        if not chunks:
+            return {}
+        return {
+            key: np.concatenate([chunk[key] for chunk in chunks])
+            for key in chunks[0]
+        }
+
+    def run_chunks(self, stations):
+        """
+        Reduce the observations of the stations in chunks
+
+        This generator yields the results of each chunk, in the order of the
+        stations.
+
+        Parameters
+        ----------
+        stations : dict or iterable of dicts
+            Dictionary (or iterable of dictionaries, each one containing
+            some of the stations) with 1d-arrays of the same size giving
+            the geodetic latitude in degrees (key ``latitude``), the height
+            in meters (``height``), the observed gravity in mGal
+            (``gravity``) and the Cartesian coordinates y and x in meters
+            (``y`` and ``x``) of the stations, which are used only by the
+            stage ``topography`` (they are not needed without ``prisms``).
+            A single dictionary is split in chunks of ``chunk_size``
+            stations.
+
+        Yields
+        ------
+        result : dict
+            Dictionary whose keys are the stages and derived results and
+            whose values are arrays with the values at the stations of the
+            chunk.
+        """
+        keys = STATION_KEYS if self.prisms is not None else STATION_KEYS[:3]
+        for chunk in _station_chunks(stations, self.chunk_size, keys):
+            yield self._reduce(chunk)
+
+    def clear(self):
+        """
+        Remove all cached outputs
+        """
+        self._memory.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if _STAGE_FILE.match(name):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _reduce(self, chunk):
+        """
+        Results of the stages for a chunk of stations
+        """
+        ellipsoid = self.ellipsoid
+        result = {}
+        result["normal"] = self._stage(
+            "normal", [chunk["latitude"], chunk["height"]],
+            [ellipsoid.a, ellipsoid.f, ellipsoid.GM, ellipsoid.omega],
+            lambda: ellipsoid.closedform(
+                chunk["latitude"], chunk["height"], fused=True,
+                parallel=self.parallel
+            )
+        )
+        # the 1e5 converts from m/s**2 to mGal
+        result["plate"] = (
+            2 * np.pi * prism.GRAVITATIONAL_CONST * 1e5
+            * self.bouguer_density * chunk["height"]
+        )
+        result["disturbance"] = chunk["gravity"] - result["normal"]
+        result["simple_bouguer"] = result["disturbance"] - result["plate"]
+        if self.prisms is not None:
+            coordinates = np.vstack(
+                [chunk["y"], chunk["x"], -chunk["height"]]
+            )
+            result["topography"] = self._stage(
+                "topography", [coordinates, self.prisms, self.density],
+                sorted(self.kwargs.items()),
+                lambda: prism.gravitational(
+                    coordinates, self.prisms, self.density, "g_z",
+                    parallel=self.parallel, check_prisms=False,
+                    **self.kwargs
+                )
+            )
+            result["terrain_correction"] = (
+                result["plate"] - result["topography"]
+            )
+            result["complete_bouguer"] = (
+                result["disturbance"] - result["topography"]
+            )
+        return result
+
+    def _stage(self, stage, arrays, parameters, compute):
+        """
+        Output of a stage, taken from the cache or computed by compute
+        """
+        digest = hashlib.sha256(stage.encode())
+        for array in arrays:
+            digest.update(str(array.shape).encode())
+            digest.update(array.tobytes())
+        digest.update(repr(parameters).encode())
+        key = digest.hexdigest()
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key].copy()
+        path = None
+        if self.directory is not None:
+            path = os.path.join(
+                self.directory, "reduction-{}-{}.npy".format(stage, key)
+            )
+            if os.path.isfile(path):
+                return np.load(path)
+        output = compute()
+        self.computed[stage] += 1
+        if path is None:
+            self._memory[key] = output.copy()
+            self._evict()
+        else:
+            # the output is written to a temporary file with a unique name
+            # which is renamed when complete, so that no partial output is
+            # ever read and concurrent writers do not collide
+            fd, tmp_path = tempfile.mkstemp(
+                suffix=".tmp", prefix="reduction-", dir=self.directory
+            )
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, output)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        return output
+
+    def _evict(self):
+        """
+        Remove the least recently used outputs cached in memory until their
+        total size is not greater than ``max_bytes``, keeping the last one
+        """
+        if self.max_bytes is None:
+            return
+        total = sum(output.nbytes for output in self._memory.values())
+        while total > self.max_bytes and len(self._memory) > 1:
+            _, output = self._memory.popitem(last=False)
+            total -= output.nbytes
+
+
+def _station_chunks(stations, chunk_size, keys=STATION_KEYS):
+    """
+    Chunks of at most chunk_size stations as dictionaries of contiguous
+    float64 1d-arrays with the given keys
+    """
+    if isinstance(stations, dict):
+        size = np.size(stations["latitude"])
+        chunks = (
+            {key: stations[key][start:start + chunk_size]
+             for key in stations}
+            for start in range(0, size, chunk_size)
+        )
+    else:
+        chunks = iter(stations)
+    for chunk in chunks:
+        missing = [key for key in keys if key not in chunk]
+        if missing:
+            raise ValueError(
+                "Missing station data: {}".format(", ".join(missing))
+            )
+        chunk = {
+            key: np.ascontiguousarray(chunk[key], dtype="float64")
+            for key in keys
+        }
+        shapes = set(chunk[key].shape for key in keys)
+        if len(shapes) != 1 or len(shapes.pop()) != 1:
+            raise ValueError(
+                "The station data must be 1d-arrays with the same size"
+            )
+        yield chunk
@@ -0,0 +1,157 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+import gamma
+
+
+def test_normal_gravity_equator_pole():
+    "Check the normal gravity at the equator and poles of WGS84 and GRS80"
+    expected = {
+        "wgs84": [978032.53359, 983218.49378],
+        "grs80": [978032.67715, 983218.63685],
+    }
+    for name, values in expected.items():
+        ellipsoid = getattr(gamma.Ellipsoid, name)()
+        phi = np.array([0.0, 90.0, -90.0])
+        npt.assert_allclose(ellipsoid.somigliana(phi),
+                            [values[0], values[1], values[1]], rtol=1e-10)
+        npt.assert_allclose(ellipsoid.closedform(phi, np.zeros(3)),
+                            ellipsoid.somigliana(phi), rtol=1e-12)
+
+
+def test_ellipsoid_equal_functions():
+    "Check if the methods of Ellipsoid are equal to the functions"
+    a, f, GM, omega = gamma.WGS84()
+    ellipsoid = gamma.Ellipsoid(a, f, GM, omega)
+    phi = np.linspace(-89, 89, 37)
+    h = np.linspace(-500, 9000, 37)
+    npt.assert_array_equal(ellipsoid.somigliana(phi),
+                           gamma.somigliana(a, f, GM, omega, phi))
+    npt.assert_array_equal(ellipsoid.closedform(phi, h),
+                           gamma.closedform(a, f, GM, omega, phi, h))
+    assert ellipsoid.b == a*(1.0 - f)
+
+
+def test_ellipsoid_out():
+    "Check if the methods of Ellipsoid store the result in out"
+    ellipsoid = gamma.Ellipsoid.wgs84()
+    phi = np.linspace(-89, 89, 37)
+    h = np.linspace(-500, 9000, 37)
+    out = np.empty(37)
+    assert ellipsoid.somigliana(phi, out=out) is out
+    npt.assert_array_equal(out, ellipsoid.somigliana(phi))
+    assert ellipsoid.closedform(phi, h, out=out) is out
+    npt.assert_array_equal(out, ellipsoid.closedform(phi, h))
+    # scalar height broadcast to all latitudes
+    npt.assert_array_equal(ellipsoid.closedform(phi, 100.0),
+                           ellipsoid.closedform(phi, np.full(37, 100.0)))
+
+
+def test_fused_closedform():
+    "Check if the fused closed-form formula is equal to the numpy one"
+    ellipsoid = gamma.Ellipsoid.wgs84()
+    rng = np.random.default_rng(0)
+    phi = rng.uniform(-90, 90, 1000)
+    h = rng.uniform(-500, 9000, 1000)
+    expected = ellipsoid.closedform(phi, h)
+    fused = ellipsoid.closedform(phi, h, fused=True)
+    npt.assert_allclose(fused, expected, rtol=1e-12)
+    npt.assert_array_equal(
+        ellipsoid.closedform(phi, h, fused=True, parallel=True), fused
+    )
+    npt.assert_allclose(ellipsoid.closedform(phi, 100.0, fused=True),
+                        ellipsoid.closedform(phi, 100.0), rtol=1e-12)
+    out = np.empty((10, 100))
+    assert ellipsoid.closedform(phi.reshape(10, 100), h.reshape(10, 100),
+                                out=out, fused=True) is out
+    npt.assert_array_equal(out.ravel(), fused)
+    # the result has the shape of the one computed with numpy
+    for phi, h in [(45.0, 100.0), ([45.0], 100.0),
+                   (np.full((1, 1), 45.0), [0.0, 10.0, 20.0])]:
+        expected = ellipsoid.closedform(phi, h)
+        result = ellipsoid.closedform(phi, h, fused=True)
+        assert np.shape(result) == np.shape(expected)
+        assert np.isscalar(result) == np.isscalar(expected)
+        npt.assert_allclose(result, expected, rtol=1e-12)
+
+
+def test_closedform_chunks():
+    "Check if the chunks of the fused closed-form formula are in order"
+    ellipsoid = gamma.Ellipsoid.wgs84()
+    rng = np.random.default_rng(0)
+    phi = rng.uniform(-90, 90, 1000)
+    h = rng.uniform(-500, 9000, 1000)
+    expected = ellipsoid.closedform(phi, h, fused=True)
+    chunks = list(ellipsoid.closedform_chunks(phi, h, chunk_size=300))
+    assert [chunk.size for chunk in chunks] == [300, 300, 300, 100]
+    npt.assert_array_equal(np.concatenate(chunks), expected)
+    out = np.empty(1000)
+    for chunk in ellipsoid.closedform_chunks(phi, 0.0, chunk_size=300,
+                                             out=out):
+        assert chunk.base is out
+    npt.assert_array_equal(out, ellipsoid.closedform(phi, 0.0, fused=True))
+
+
+def test_invalid_fused_closedform():
+    "Check if invalid inputs of the fused closed-form formula raise errors"
+    ellipsoid = gamma.Ellipsoid.wgs84()
+    phi = np.zeros(10)
+    invalid = [
+        dict(h=np.zeros(9)),
+        dict(h=np.zeros(10), out=np.empty(9)),
+        dict(h=np.zeros(10), out=np.empty(10, dtype="float32")),
+        dict(h=np.zeros(10), out=np.empty(20)[::2]),
+    ]
+    for kwargs in invalid:
+        with pytest.raises(ValueError):
+            ellipsoid.closedform(phi, fused=True, **kwargs)
+    for kwargs in [dict(chunk_size=0), dict(h=np.zeros(9)),
+                   dict(out=np.empty(9))]:
+        kwargs.setdefault("h", np.zeros(10))
+        with pytest.raises(ValueError):
+            list(ellipsoid.closedform_chunks(phi, **kwargs))
+
+
+def test_normal_gravity_table():
+    "Check if the interpolated normal gravity is within the maximum error"
+    ellipsoid = gamma.Ellipsoid.wgs84()
+    rng = np.random.default_rng(0)
+    for max_error in [1e-2, 1e-4]:
+        table = gamma.NormalGravityTable(ellipsoid, (-25, -15), (0, 3000),
+                                         max_error)
+        assert table.error <= max_error
+        phi = rng.uniform(-25, -15, 10000)
+        h = rng.uniform(0, 3000, 10000)
+        result = table.closedform(phi, h)
+        npt.assert_allclose(result, ellipsoid.closedform(phi, h),
+                            rtol=0, atol=max_error)
+        npt.assert_array_equal(table.closedform(phi, h, parallel=True),
+                               result)
+    # the nodes are equal to the closed-form formula
+    phi, h = np.meshgrid(table.latitudes, table.heights, indexing="ij")
+    npt.assert_allclose(table.closedform(phi, h), table.table, rtol=1e-15)
+    # points outside the table are computed with the closed-form formula
+    phi = np.array([-30, -20, -10, 0])
+    h = np.array([100, 4000, 100, -10])
+    npt.assert_array_equal(table.closedform(phi, h),
+                           ellipsoid.closedform(phi, h, fused=True))
+    # a float for scalar latitude and height
+    result = table.closedform(-20.0, 100.0)
+    assert np.isscalar(result)
+    npt.assert_allclose(result, ellipsoid.closedform(-20.0, 100.0),
+                        rtol=0, atol=1e-4)
+
+
+def test_invalid_normal_gravity_table():
+    "Check if invalid parameters of NormalGravityTable raise errors"
+    ellipsoid = gamma.Ellipsoid.wgs84()
+    invalid = [
+        dict(latitude=(10, 0), height=(0, 100)),
+        dict(latitude=(0, 10), height=(100, 100)),
+        dict(latitude=(-91, 10), height=(0, 100)),
+        dict(latitude=(0, 10), height=(0, 100), max_error=1e-8),
+        dict(latitude=(-90, 90), height=(0, 1e5), max_error=1e-6),
+    ]
+    for kwargs in invalid:
+        with pytest.raises(ValueError):
+            gamma.NormalGravityTable(ellipsoid, **kwargs)
@@ -106,6 +106,74 @@ def test_safe_log():
         npt.assert_allclose(prism.safe_log(x_i), np.log(x_i))
 
 
+def test_safe_functions_at_singular_points():
+    "Check safe_atan2 and safe_log at the edges, faces and vertices of a prism"
+    model = np.array([-100, 100, -150, 150, 0, 200], dtype=float)
+    # computation points on the vertices, edges and faces of the prism, and
+    # on the lines and planes containing them
+    values = [
+        [-300, -100, 0, 30, 100], [-400, -150, 0, 40, 150], [-50, 0, 90, 200]
+    ]
+    y, x, z = [v.ravel() for v in np.meshgrid(*values, indexing="ij")]
+    arguments_atan2, arguments_log = [], []
+    for j in range(2):
+        for i in range(2):
+            for k in range(2):
+                Y = model[j] - y
+                X = model[2 + i] - x
+                Z = model[4 + k] - z
+                radius = np.sqrt(Y ** 2 + X ** 2 + Z ** 2)
+                arguments_atan2 += [
+                    (Z * Y, X * radius), (Z * X, Y * radius),
+                    (Y * X, Z * radius)
+                ]
+                arguments_log += [X + radius, Y + radius, Z + radius]
+    numerator, denominator = np.hstack(arguments_atan2)
+    assert (denominator == 0).any() and (numerator[denominator == 0] == 0).any()
+    # branching implementation of Fukushima (2020, eq. 72)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = np.where(
+            denominator != 0,
+            np.arctan(numerator / denominator),
+            np.arctan2(numerator, np.abs(denominator)),
+        )
+    # numpy and numba may differ by one unit in the last place, except at
+    # the singular points
+    singular = denominator == 0
+    result = np.array(
+        [prism.safe_atan2(n, d) for n, d in zip(numerator, denominator)]
+    )
+    npt.assert_array_equal(result[singular], expected[singular])
+    npt.assert_allclose(result, expected, rtol=1e-15)
+    # the branch-free version gives the same results for arrays
+    npt.assert_array_equal(prism.safe_atan2_array(numerator, denominator),
+                           result)
+    npt.assert_array_equal(prism.safe_atan2_array(numerator, -denominator),
+                           [prism.safe_atan2(n, -d)
+                            for n, d in zip(numerator, denominator)])
+    argument = np.hstack(arguments_log)
+    singular = argument == 0
+    assert singular.any()
+    with np.errstate(divide="ignore"):
+        expected = np.where(np.abs(argument) < 1e-10, 0, np.log(argument))
+    result = np.array([prism.safe_log(a) for a in argument])
+    npt.assert_array_equal(result[singular], expected[singular])
+    npt.assert_allclose(result, expected, rtol=1e-15)
+    npt.assert_array_equal(prism.safe_log_array(argument), result)
+    # and keeps single precision
+    for function, args in [(prism.safe_atan2_array, (numerator, denominator)),
+                           (prism.safe_log_array, (argument,))]:
+        single = function(*[a.astype("float32") for a in args])
+        assert single.dtype == np.float32
+        npt.assert_allclose(single, function(*args), rtol=1e-6, atol=1e-6)
+    # the fields are finite at all these points
+    result = prism.gravitational(
+        np.array([y, x, z]), model[np.newaxis], np.array([1000.0]), "all"
+    )
+    for field in prism.FIELDS:
+        assert np.isfinite(result[field]).all()
+
+
 def test_field_decreases_with_distance():
     "Check if field decreases with distance"
     model = np.array([[-100, 100, -100, 100, 100, 200]])
@@ -125,3 +193,942 @@ def test_field_decreases_with_distance():
                       np.abs(gz_far) < np.abs(gz_close),
                       np.abs(gx_far) < np.abs(gx_close)])
     npt.assert_allclose(diffs, np.ones((3,1), dtype=bool))
+
+
+def test_parallel_equals_serial():
+    "Check if the parallel computation gives the same result as the serial one"
+    model = np.array([[-100, 100, -100, 100, 100, 200],
+                      [-50, 150, 20, 80, 50, 300],
+                      [-300, -200, -100, 0, 10, 20]])
+    density = np.array([1000, -300, 2670])
+    y, x = np.meshgrid(np.linspace(-400, 400, 9), np.linspace(-300, 300, 7))
+    coordinates = np.array([y.ravel(), x.ravel(), np.zeros(y.size)])
+    for field in prism.FIELDS:
+        serial = prism.gravitational(coordinates, model, density, field)
+        parallel = prism.gravitational(
+            coordinates, model, density, field, parallel=True
+        )
+        npt.assert_array_equal(parallel, serial)
+        parallel = prism.gravitational(
+            coordinates, model, density, field, parallel=True, workers=1
+        )
+        npt.assert_array_equal(parallel, serial)
+
+
+def test_specialized_loops_equal_generic_loop():
+    "Check if the loops compiled for each field equal the generic loop"
+    model = np.array([[-100, 100, -100, 100, 100, 200],
+                      [-50, 150, 20, 80, 50, 300]], dtype=float)
+    density = np.array([1000.0, -300.0])
+    y, x = np.meshgrid(np.linspace(-400, 400, 5), np.linspace(-300, 300, 4))
+    coordinates = np.array([y.ravel(), x.ravel(), np.full(y.size, -10.0)])
+    kernels = prism._kernels()
+    for code, field in enumerate(prism.FIELDS):
+        generic = np.zeros(y.size)
+        prism.jit_gravitational(coordinates, model, density, kernels[field],
+                                generic)
+        specialized = np.zeros(y.size)
+        prism.jit_gravitational_single(coordinates, model, density, code,
+                                       1.0, specialized)
+        npt.assert_array_equal(specialized, generic)
+
+
+def test_invalid_workers():
+    "Check if passing an invalid number of workers raises an error"
+    model = np.array([[-100, 100, -100, 100, 100, 200]])
+    density = np.array([1000])
+    coordinates = np.array([[0], [0], [0]])
+    with pytest.raises(ValueError):
+        prism.gravitational(
+            coordinates, model, density, "g_z", parallel=True, workers=0
+        )
+
+
+def test_multiple_fields_equal_single_fields():
+    "Check if computing several fields at once gives the single field results"
+    model = np.array([[-100, 100, -100, 100, 100, 200],
+                      [-50, 150, 20, 80, 50, 300]])
+    density = np.array([1000, -300])
+    coordinates = np.array([[0, 10, 100, 100], [20, -5, 0, 100], [0, 0, -10, 100]])
+    for parallel in [False, True]:
+        result = prism.gravitational(
+            coordinates, model, density, "all", parallel=parallel
+        )
+        assert list(result.keys()) == list(prism.FIELDS)
+        for field in prism.FIELDS:
+            single = prism.gravitational(coordinates, model, density, field)
+            npt.assert_array_equal(result[field], single)
+    result = prism.gravitational(
+        coordinates, model, density, ["g_x", "potential", "g_x"]
+    )
+    assert list(result.keys()) == ["g_x", "potential"]
+
+
+def test_invalid_multiple_fields():
+    "Check if passing an invalid list of fields raises an error"
+    model = np.array([[-100, 100, -100, 100, 100, 200]])
+    density = np.array([1000])
+    coordinates = np.array([[0], [0], [0]])
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, ["g_z", "g_w"])
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, [])
+
+
+def test_derivatives_finite_differences():
+    "Check acceleration and tensor components against finite differences"
+    model = np.array([[-100, 100, -100, 120, 100, 200],
+                      [-50, 150, 20, 80, 50, 300]])
+    density = np.array([1000, -300])
+    point = np.array([[30.], [-70.], [-50.]])
+    result = prism.gravitational(point, model, density, "all")
+    # lines of coordinates containing each axis
+    axes = {"y": 0, "x": 1, "z": 2}
+    delta = 1e-2
+
+    def derivative(field, axis):
+        shift = np.zeros((3, 1))
+        shift[axes[axis]] = delta
+        forward = prism.gravitational(point + shift, model, density, field)
+        backward = prism.gravitational(point - shift, model, density, field)
+        return (forward - backward) / (2 * delta)
+
+    # potential in m^2/s^2 and acceleration in mGal
+    for axis in "xyz":
+        npt.assert_allclose(
+            derivative("potential", axis) * 1e5, result["g_" + axis],
+            rtol=1e-6
+        )
+    # acceleration in mGal and tensor in Eotvos
+    for component in ["xx", "xy", "xz", "yy", "yz", "zz"]:
+        npt.assert_allclose(
+            derivative("g_" + component[0], component[1]) * 1e4,
+            result["g_" + component], rtol=1e-6
+        )
+
+
+def test_laplace_equation():
+    "Check if the trace of the gradient tensor is null outside the prisms"
+    model = np.array([[-100, 100, -100, 120, 100, 200],
+                      [-50, 150, 20, 80, 50, 300]])
+    density = np.array([1000, -300])
+    y, x = np.meshgrid(np.linspace(-400, 400, 9), np.linspace(-300, 300, 7))
+    coordinates = np.array([y.ravel(), x.ravel(), np.zeros(y.size)])
+    result = prism.gravitational(coordinates, model, density,
+                                 ["g_xx", "g_yy", "g_zz"])
+    trace = result["g_xx"] + result["g_yy"] + result["g_zz"]
+    npt.assert_allclose(trace, 0, atol=1e-10)
+
+
+def _regular_mesh(shape, density):
+    "Regular mesh of prisms with the given densities"
+    west_east = np.linspace(-300, 300, shape[0] + 1)
+    south_north = np.linspace(-200, 250, shape[1] + 1)
+    top_bottom = np.linspace(50, 400, shape[2] + 1)
+    model = []
+    for i in range(shape[0]):
+        for j in range(shape[1]):
+            for k in range(shape[2]):
+                model.append([west_east[i], west_east[i + 1],
+                              south_north[j], south_north[j + 1],
+                              top_bottom[k], top_bottom[k + 1]])
+    return np.array(model), np.ravel(density)
+
+
+def test_mesh_equals_direct():
+    "Check if evaluating the kernels at unique vertices gives the same result"
+    shape = (4, 3, 2)
+    density = np.full(shape, 2000.)
+    density[1:3, 1, :] = 2500.
+    density[0, 0, 0] = -100.
+    model, density = _regular_mesh(shape, density)
+    y, x = np.meshgrid(np.linspace(-400, 400, 9), np.linspace(-300, 300, 7))
+    coordinates = np.array([y.ravel(), x.ravel(), np.full(y.size, -10.)])
+    # the same point on a vertex of the mesh
+    coordinates[:, 0] = [-300, -200, 50]
+    for field in prism.FIELDS:
+        direct = prism.gravitational(coordinates, model, density, field)
+        mesh = prism.gravitational(coordinates, model, density, field,
+                                   mesh=True)
+        npt.assert_allclose(mesh, direct, rtol=1e-8,
+                            atol=1e-10 * np.abs(direct).max())
+        mesh = prism.gravitational(coordinates, model, density, field,
+                                   mesh=True, parallel=True)
+        npt.assert_allclose(mesh, direct, rtol=1e-8,
+                            atol=1e-10 * np.abs(direct).max())
+    direct = prism.gravitational(coordinates, model, density, "all")
+    for parallel in [False, True]:
+        mesh = prism.gravitational(coordinates, model, density, "all",
+                                   mesh=True, parallel=parallel)
+        for field in prism.FIELDS:
+            npt.assert_allclose(mesh[field], direct[field], rtol=1e-8,
+                                atol=1e-10 * np.abs(direct[field]).max())
+
+
+def test_mesh_vertices():
+    "Check if shared vertices are merged and null weights are removed"
+    shape = (4, 3, 2)
+    model, density = _regular_mesh(shape, np.full(shape, 1000.))
+    vertices, weights = prism._mesh_vertices(model, density)
+    # constant density keeps only the 8 corners of the whole mesh
+    assert vertices.shape == (8, 3)
+    npt.assert_allclose(np.abs(weights), 1000.)
+    model, density = _regular_mesh(shape, np.arange(24.) + 1)
+    vertices, weights = prism._mesh_vertices(model, density)
+    assert vertices.shape[0] <= 5 * 4 * 3
+    # prisms which do not share vertices
+    model = np.array([[-100, 100, -100, 100, 100, 200],
+                      [-50, 150, 20, 80, 50, 300]])
+    vertices, weights = prism._mesh_vertices(model, np.array([1., 2.]))
+    assert vertices.shape == (16, 3)
+
+
+def test_gravitational_chunks(tmp_path):
+    "Check if the chunked computation equals the computation of all points"
+    model = np.array([[-100, 100, -100, 100, 100, 200],
+                      [-50, 150, 20, 80, 50, 300]], dtype=float)
+    density = np.array([1000.0, -300.0])
+    y, x = np.meshgrid(np.linspace(-400, 400, 9), np.linspace(-300, 300, 7))
+    coordinates = np.array([y.ravel(), x.ravel(), np.full(y.size, -10.0)])
+    expected = prism.gravitational(coordinates, model, density, "g_z")
+    np.save(tmp_path / "stations.npy", coordinates)
+    np.savetxt(tmp_path / "stations.csv", coordinates.T, delimiter=",",
+               header="y,x,z")
+    coordinates.T.tofile(tmp_path / "stations.bin")
+    sources = [
+        coordinates,
+        [coordinates[:, :10], coordinates[:, 10:]],
+        str(tmp_path / "stations.npy"),
+        str(tmp_path / "stations.csv"),
+        tmp_path / "stations.bin",
+    ]
+    for stations in sources:
+        chunks = list(
+            prism.gravitational_chunks(stations, model, density, "g_z",
+                                       chunk_size=8, skiprows=1)
+        )
+        assert max(chunk.size for chunk in chunks) <= 8
+        npt.assert_allclose(np.hstack(chunks), expected, rtol=1e-15)
+    # results written to a memory-mapped file
+    out = np.lib.format.open_memmap(
+        tmp_path / "result.npy", mode="w+", shape=(2, y.size)
+    )
+    counts = {}
+    for chunk in prism.gravitational_chunks(coordinates, model, density,
+                                            ["g_z", "g_x"], chunk_size=10,
+                                            out=out, counts=counts):
+        assert np.shares_memory(chunk["g_z"], out)
+    del out
+    result = np.load(tmp_path / "result.npy")
+    npt.assert_array_equal(result[0], expected)
+    npt.assert_array_equal(
+        result[1], prism.gravitational(coordinates, model, density, "g_x")
+    )
+    assert counts == {"exact": 2 * y.size, "approximate": 0}
+
+
+def test_invalid_gravitational_chunks():
+    "Check if invalid parameters of gravitational_chunks raise errors"
+    model = np.array([[-100, 100, -100, 100, 100, 200]])
+    density = np.array([1000])
+    coordinates = np.zeros((3, 5))
+    with pytest.raises(ValueError):
+        list(prism.gravitational_chunks(coordinates, model, density, "g_z",
+                                        chunk_size=0))
+    with pytest.raises(ValueError):
+        list(prism.gravitational_chunks(np.zeros((2, 5)), model, density,
+                                        "g_z"))
+    for size in [4, 6]:
+        with pytest.raises(ValueError):
+            list(prism.gravitational_chunks(coordinates, model, density,
+                                            "g_z", out=np.zeros(size)))
+    model = np.array([[100, -100, -100, 100, 100, 200]])
+    with pytest.raises(ValueError):
+        list(prism.gravitational_chunks(coordinates, model, density, "g_z"))
+
+
+def test_forward_model_updates():
+    "Check if the updated field is equal to the field of the changed model"
+    shape = (4, 3, 2)
+    density = np.random.default_rng(0).normal(size=shape) * 100 + 2000
+    model, density = _regular_mesh(shape, density)
+    original = model.copy()
+    y, x = np.meshgrid(np.linspace(-400, 400, 9), np.linspace(-300, 300, 7))
+    coordinates = np.array([y.ravel(), x.ravel(), np.full(y.size, -10.)])
+    for field in ["g_z", ["potential", "g_xy"]]:
+        forward = prism.ForwardModel(coordinates, model, density, field)
+        result = forward.result
+        forward.update([3, 7], density=[-500, 100])
+        forward.update(5, prisms=model[5] + [10, 30, -20, 0, 5, 5])
+        forward.update(0, density=10, prisms=model[0] + 50)
+        forward.update([], density=[])
+        forward.update([-1, 1], density=[2100, 1900])
+        # a boolean mask of the changed prisms
+        mask = np.zeros(model.shape[0], dtype=bool)
+        mask[[2, 4]] = True
+        forward.update(mask, density=[1500, 1800])
+        assert forward.result is result
+        expected = prism.gravitational(coordinates, forward.prisms,
+                                       forward.density, field)
+        if isinstance(field, str):
+            result, expected = {field: result}, {field: expected}
+        for name in expected:
+            npt.assert_allclose(result[name], expected[name], rtol=1e-10,
+                                atol=1e-12 * np.abs(expected[name]).max())
+        npt.assert_allclose(forward.density[[0, 1, 2, 3, 4, 7, -1]],
+                            [10, 1900, 1500, -500, 1800, 100, 2100])
+        npt.assert_allclose(forward.prisms[0], model[0] + 50)
+        # the given model is not changed
+        npt.assert_array_equal(model, original)
+        forward.refresh()
+        for name in expected:
+            npt.assert_array_equal(result[name], expected[name])
+
+
+def test_invalid_forward_model_updates():
+    "Check if invalid updates of ForwardModel raise errors"
+    model = np.array([[-100, 100, -100, 100, 100, 200],
+                      [-50, 150, 20, 80, 50, 300]])
+    coordinates = np.array([[0], [0], [0]])
+    forward = prism.ForwardModel(coordinates, model, [1000, 500], "g_z")
+    with pytest.raises(ValueError):
+        forward.update([0, 0], density=[1, 2])
+    # negative and positive indices of the same prism
+    with pytest.raises(ValueError):
+        forward.update([1, -1], density=[0, 0])
+    with pytest.raises(ValueError):
+        forward.update(2, density=1)
+    with pytest.raises(ValueError):
+        forward.update(-3, density=1)
+    with pytest.raises(ValueError):
+        forward.update(0, prisms=[100, -100, -100, 100, 100, 200])
+    # indices which are not integers and masks with a wrong size
+    for indices in [0.5, [1.0], [True], [True, False, True]]:
+        with pytest.raises(ValueError):
+            forward.update(indices, density=0)
+    npt.assert_array_equal(forward.prisms, model)
+    npt.assert_array_equal(forward.density, [1000, 500])
+
+
+def test_sensitivity_times_density():
+    "Check if the sensitivity matrix times the densities gives the field"
+    model = np.array([[-100, 100, -100, 100, 100, 200],
+                      [-50, 150, 20, 80, 50, 300],
+                      [-300, -200, -100, 0, 10, 20]])
+    density = np.array([1000, -300, 2670])
+    y, x = np.meshgrid(np.linspace(-400, 400, 9), np.linspace(-300, 300, 7))
+    coordinates = np.array([y.ravel(), x.ravel(), np.zeros(y.size)])
+    for field in prism.FIELDS:
+        field_true = prism.gravitational(coordinates, model, density, field)
+        G = prism.sensitivity(coordinates, model, field)
+        assert G.shape == (coordinates.shape[1], model.shape[0])
+        assert G.dtype == np.float64
+        npt.assert_allclose(G @ density, field_true, rtol=1e-10,
+                            atol=1e-12 * np.abs(field_true).max())
+        G_parallel = prism.sensitivity(coordinates, model, field,
+                                       chunk_rows=10, parallel=True)
+        npt.assert_array_equal(G_parallel, G)
+        G32 = prism.sensitivity(coordinates, model, field, dtype="float32",
+                                chunk_rows=7)
+        assert G32.dtype == np.float32
+        npt.assert_allclose(G32, G, rtol=1e-6, atol=1e-6 * np.abs(G).max())
+
+
+def test_sensitivity_memmap(tmp_path):
+    "Check if the sensitivity matrix can be written to a memory-mapped file"
+    model = np.array([[-100, 100, -100, 100, 100, 200],
+                      [-50, 150, 20, 80, 50, 300]])
+    coordinates = np.array([np.linspace(-200, 200, 11),
+                            np.zeros(11), np.full(11, -10.)])
+    out = np.lib.format.open_memmap(
+        str(tmp_path / "G.npy"), mode="w+", dtype="float32", shape=(11, 2)
+    )
+    prism.sensitivity(coordinates, model, "g_z", chunk_rows=3, out=out)
+    out.flush()
+    del out
+    G = np.load(str(tmp_path / "G.npy"))
+    npt.assert_allclose(
+        G, prism.sensitivity(coordinates, model, "g_z"), rtol=1e-6
+    )
+
+
+def test_invalid_sensitivity():
+    "Check if invalid parameters of sensitivity raise errors"
+    model = np.array([[-100, 100, -100, 100, 100, 200]])
+    coordinates = np.array([[0], [0], [0]])
+    with pytest.raises(ValueError):
+        prism.sensitivity(coordinates, model, "invalid field")
+    with pytest.raises(ValueError):
+        prism.sensitivity(coordinates, model, "g_z", dtype="int64")
+    with pytest.raises(ValueError):
+        prism.sensitivity(coordinates, model, "g_z", chunk_rows=0)
+    with pytest.raises(ValueError):
+        prism.sensitivity(coordinates, model, "g_z", out=np.empty((2, 1)))
+
+
+def test_sensitivity_cache(tmp_path):
+    "Check if the cached sensitivity gives the field and is reused"
+    model = np.array([[-100, 100, -100, 100, 100, 200],
+                      [-50, 150, 20, 80, 50, 300]])
+    coordinates = np.array([np.linspace(-200, 200, 11),
+                            np.zeros(11), np.full(11, -10.)])
+    cache = prism.SensitivityCache(str(tmp_path), chunk_rows=4)
+    # a temporary file of another writer is neither used nor removed
+    key = cache.key(coordinates, model, "g_z")
+    busy = tmp_path / ("sensitivity-" + key + ".npy.tmp")
+    busy.write_bytes(b"incomplete")
+    for density in [np.array([1000, -300]), np.array([10, 20])]:
+        npt.assert_allclose(
+            cache.gravitational(coordinates, model, density, "g_z"),
+            prism.gravitational(coordinates, model, density, "g_z"),
+            rtol=1e-10
+        )
+    assert len(cache.entries()) == 1
+    cache.gravitational(coordinates, model, [1, 1], "potential")
+    assert len(cache.entries()) == 2
+    assert busy.read_bytes() == b"incomplete"
+    assert len(list(tmp_path.iterdir())) == 3
+    busy.unlink()
+    # files not created by the cache are ignored
+    other = tmp_path / "data.npy"
+    np.save(str(other), np.zeros(1000))
+    hashed = tmp_path / (cache.key(coordinates, model, "g_y") + ".npy")
+    np.save(str(hashed), np.zeros(1000))
+    assert len(cache.entries()) == 2
+    cache.clear()
+    assert len(cache.entries()) == 0
+    assert other.exists() and hashed.exists()
+
+
+def test_sensitivity_cache_eviction(tmp_path):
+    "Check if the least recently used matrices are removed"
+    model = np.array([[-100, 100, -100, 100, 100, 200],
+                      [-50, 150, 20, 80, 50, 300]])
+    coordinates = np.array([np.linspace(-200, 200, 11),
+                            np.zeros(11), np.full(11, -10.)])
+    # a file not created by the cache, larger than max_bytes
+    other = tmp_path / "data.npy"
+    np.save(str(other), np.zeros(1000))
+    cache = prism.SensitivityCache(str(tmp_path), max_bytes=400)
+    # each matrix has 11 x 2 x 8 = 176 bytes plus the npy header
+    first = cache.key(coordinates, model, "g_z")
+    cache.matrix(coordinates, model, "g_z")
+    cache.matrix(coordinates, model, "g_x")
+    cache.matrix(coordinates, model, "potential")
+    paths = [entry[0] for entry in cache.entries()]
+    assert len(paths) == 1
+    assert cache.path(first) not in paths
+    assert sum(entry[1] for entry in cache.entries()) <= 400
+    assert other.exists()
+
+
+def test_compressed_sensitivity():
+    "Check if the compressed sensitivity approximates the dense one"
+    shape = (12, 12, 2)
+    west_east = np.linspace(-3000, 3000, shape[0] + 1)
+    south_north = np.linspace(-3000, 3000, shape[1] + 1)
+    model = np.array([
+        [west_east[i], west_east[i + 1], south_north[j], south_north[j + 1],
+         100 + 400 * k, 500 + 400 * k]
+        for i in range(shape[0]) for j in range(shape[1])
+        for k in range(shape[2])
+    ])
+    y, x = np.meshgrid(np.linspace(-3500, 3500, 30),
+                       np.linspace(-3500, 3500, 30))
+    coordinates = np.array([y.ravel(), x.ravel(), np.full(y.size, -50.)])
+    density = np.random.default_rng(0).normal(size=model.shape[0]) * 100
+    residual = np.random.default_rng(1).normal(size=y.size)
+    for field in ["potential", "g_z", "g_xy"]:
+        G = prism.sensitivity(coordinates, model, field)
+        C = prism.CompressedSensitivity(coordinates, model, field, tol=1e-6,
+                                        leaf_size=16, eta=2)
+        assert C.shape == G.shape
+        assert C.size < G.size
+        npt.assert_allclose(C.matvec(density), G @ density,
+                            atol=1e-5 * np.abs(G @ density).max())
+        npt.assert_allclose(C.rmatvec(residual), G.T @ residual,
+                            atol=1e-5 * np.abs(G.T @ residual).max())
+    # matrices without lines or columns
+    for points, prisms in [(coordinates[:, :0], model),
+                           (coordinates, model[:0]),
+                           (coordinates[:, :0], model[:0])]:
+        C = prism.CompressedSensitivity(points, prisms, "g_z")
+        assert C.shape == (points.shape[1], prisms.shape[0])
+        assert C.size == 0
+        npt.assert_array_equal(C.matvec(np.ones(C.shape[1])),
+                               np.zeros(C.shape[0]))
+        npt.assert_array_equal(C.rmatvec(np.ones(C.shape[0])),
+                               np.zeros(C.shape[1]))
+
+
+def test_invalid_compressed_sensitivity():
+    "Check if invalid parameters of CompressedSensitivity raise errors"
+    model = np.array([[-100, 100, -100, 100, 100, 200]])
+    coordinates = np.array([[0], [0], [0]])
+    with pytest.raises(ValueError):
+        prism.CompressedSensitivity(coordinates, model, "invalid field")
+    with pytest.raises(ValueError):
+        prism.CompressedSensitivity(coordinates, model, "g_z", tol=0)
+    C = prism.CompressedSensitivity(coordinates, model, "g_z")
+    with pytest.raises(ValueError):
+        C.matvec(np.ones(2))
+    with pytest.raises(ValueError):
+        C.rmatvec(np.ones(2))
+
+
+def test_far_field_approximation():
+    "Check if the point mass approximation is close to the exact field"
+    model = np.array([[0, 100, 0, 100, 0, 100],
+                      [0, 200, 300, 400, 100, 150]])
+    density = np.array([1000, 500])
+    directions = np.random.default_rng(0).normal(size=(3, 50))
+    directions /= np.linalg.norm(directions, axis=0)
+    close = np.array([[50], [50], [-60]])
+    far = np.array([[100], [200], [75]]) + 4000 * directions
+    coordinates = np.hstack([close, far])
+    for parallel in [False, True]:
+        for field in prism.FIELDS:
+            counts = {}
+            exact = prism.gravitational(coordinates, model, density, field)
+            approximate = prism.gravitational(
+                coordinates, model, density, field, far_field=10,
+                counts=counts, parallel=parallel
+            )
+            # the close point is computed with the exact formulas
+            npt.assert_array_equal(approximate[0], exact[0])
+            npt.assert_allclose(approximate, exact,
+                                atol=5e-3 * np.abs(exact[1:]).max())
+            assert counts == {"exact": 2, "approximate": 100}
+
+
+def test_far_field_bounds():
+    "Check if the far field errors are below the documented bounds"
+    # worst relative errors of each field for sides ratios up to 8
+    bounds = {
+        5: dict(potential=4e-3, g_x=1e-2, g_y=1e-2, g_z=1e-2, g_xx=2e-2,
+                g_yy=2e-2, g_zz=2e-2, g_xy=2e-2, g_xz=2e-2, g_yz=2e-2),
+        10: dict(potential=1e-3, g_x=3e-3, g_y=3e-3, g_z=3e-3, g_xx=5e-3,
+                 g_yy=5e-3, g_zz=5e-3, g_xy=5e-3, g_xz=5e-3, g_yz=5e-3),
+    }
+    directions = np.random.default_rng(0).normal(size=(3, 5000))
+    directions /= np.linalg.norm(directions, axis=0)
+    for sides in [(800, 100, 100), (100, 800, 100), (100, 100, 800),
+                  (800, 400, 100)]:
+        model = np.array([[0, sides[0], 0, sides[1], 100, 100 + sides[2]]])
+        center = model[0].reshape(3, 2).mean(axis=1)
+        # points just beyond the distance of the approximation
+        distance = (1 + 1e-9) * np.linalg.norm(sides)
+        for far_field, bound in bounds.items():
+            coordinates = (center[:, np.newaxis]
+                           + far_field * distance * directions)
+            exact = prism.gravitational(coordinates, model, [1000.], "all")
+            for field in prism.FIELDS:
+                approximate = prism.gravitational(
+                    coordinates, model, [1000.], field, far_field=far_field
+                )
+                error = np.abs(approximate - exact[field]).max()
+                assert error < bound[field] * np.abs(exact[field]).max()
+
+
+def test_counts_without_far_field():
+    "Check if all evaluations are exact without the far field approximation"
+    model = np.array([[-100, 100, -100, 100, 100, 200]])
+    coordinates = np.zeros((3, 5))
+    counts = {}
+    prism.gravitational(coordinates, model, [1000], "g_z", counts=counts)
+    assert counts == {"exact": 5, "approximate": 0}
+
+
+def test_invalid_far_field():
+    "Check if invalid use of the far field approximation raises errors"
+    model = np.array([[-100, 100, -100, 100, 100, 200]])
+    density = np.array([1000])
+    coordinates = np.array([[0], [0], [0]])
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, "g_z", far_field=0)
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, "all", far_field=5)
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, "g_z", far_field=5,
+                            mesh=True)
+
+
+def test_tree_engine():
+    "Check if the tree engine is close to the direct computation"
+    shape = (12, 12, 3)
+    density = 2000 + np.random.default_rng(0).normal(size=shape) * 100
+    model, density = _regular_mesh(shape, density)
+    y, x = np.meshgrid(np.linspace(-600, 600, 13), np.linspace(-500, 500, 11))
+    coordinates = np.array([y.ravel(), x.ravel(), np.full(y.size, -10.)])
+    for field in ["potential", "g_z", "g_x", "g_zz"]:
+        direct = prism.gravitational(coordinates, model, density, field)
+        counts = {}
+        tree = prism.gravitational(coordinates, model, density, field,
+                                   engine="tree", far_field=5, counts=counts)
+        npt.assert_allclose(tree, direct, atol=1e-3 * np.abs(direct).max())
+        assert counts["approximate"] > 0
+        assert counts["exact"] < coordinates.shape[1] * model.shape[0]
+        tree_parallel = prism.gravitational(
+            coordinates, model, density, field, engine="tree", far_field=5,
+            parallel=True
+        )
+        npt.assert_array_equal(tree_parallel, tree)
+        # without approximations all prisms are computed exactly
+        counts = {}
+        tree = prism.gravitational(coordinates, model, density, field,
+                                   engine="tree", far_field=1e6,
+                                   counts=counts)
+        npt.assert_allclose(tree, direct, rtol=1e-10,
+                            atol=1e-12 * np.abs(direct).max())
+        assert counts == {"exact": coordinates.shape[1] * model.shape[0],
+                          "approximate": 0}
+    # a model without prisms
+    counts = {}
+    empty = prism.gravitational(coordinates, np.empty((0, 6)), np.empty(0),
+                                "g_z", engine="tree", far_field=5,
+                                counts=counts)
+    npt.assert_array_equal(empty, np.zeros(coordinates.shape[1]))
+    assert counts == {"exact": 0, "approximate": 0}
+
+
+def test_invalid_engine():
+    "Check if invalid engines raise errors"
+    model = np.array([[-100, 100, -100, 100, 100, 200]])
+    density = np.array([1000])
+    coordinates = np.array([[0], [0], [0]])
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, "g_z",
+                            engine="invalid")
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, "g_z",
+                            engine="tree")
+
+
+def test_truncation_radius():
+    "Check if the truncation radius ignores only the far prisms"
+    west = np.arange(-1000, 1000, 200.0)
+    west, south = [v.ravel() for v in np.meshgrid(west, west)]
+    model = np.column_stack([west, west + 200, south, south + 200,
+                             np.zeros(west.size), np.full(west.size, 100.0)])
+    density = np.random.default_rng(0).uniform(-500, 500, west.size)
+    y, x = np.meshgrid(np.linspace(-900, 900, 7), np.linspace(-900, 900, 5))
+    coordinates = np.array([y.ravel(), x.ravel(), np.full(y.size, -20.0)])
+    centers = np.column_stack([west + 100, south + 100, np.full(west.size, 50)])
+    radius = 500
+    for field in ["potential", "g_z", "g_xy"]:
+        counts = {}
+        bound = np.empty(y.size)
+        result = prism.gravitational(coordinates, model, density, field,
+                                     radius=radius, bound=bound,
+                                     counts=counts)
+        parallel = prism.gravitational(coordinates, model, density, field,
+                                       radius=radius, parallel=True)
+        npt.assert_array_equal(parallel, result)
+        n_exact = 0
+        for l in range(y.size):
+            distances = np.linalg.norm(centers - coordinates[:, l], axis=1)
+            near = distances <= radius
+            n_exact += near.sum()
+            expected = prism.gravitational(coordinates[:, l:l + 1],
+                                           model[near], density[near], field)
+            npt.assert_allclose(result[l], expected[0], rtol=1e-10)
+        assert counts == {"exact": n_exact, "approximate": 0}
+        full = prism.gravitational(coordinates, model, density, field)
+        assert (np.abs(full - result) <= bound).all()
+    # a model without prisms
+    counts = {}
+    bound = np.empty(y.size)
+    empty = prism.gravitational(coordinates, np.empty((0, 6)), np.empty(0),
+                                "g_z", radius=radius, bound=bound,
+                                counts=counts)
+    npt.assert_array_equal(empty, np.zeros(y.size))
+    npt.assert_array_equal(bound, np.zeros(y.size))
+    assert counts == {"exact": 0, "approximate": 0}
+
+
+def test_invalid_truncation_radius():
+    "Check if invalid truncation radius and bound raise errors"
+    model = np.array([[-100, 100, -100, 100, 100, 200]])
+    density = np.array([1000])
+    coordinates = np.array([[0], [0], [0]])
+    invalid = [
+        dict(radius=0),
+        dict(radius=100, far_field=5),
+        dict(radius=100, mesh=True),
+        dict(bound=np.zeros(1)),
+        dict(radius=100, bound=np.zeros(2)),
+        dict(radius=100, bound=[0.0]),
+    ]
+    for kwargs in invalid:
+        with pytest.raises(ValueError):
+            prism.gravitational(coordinates, model, density, "g_z", **kwargs)
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, ["g_z", "g_x"],
+                            radius=100)
+
+
+def test_fft_engine():
+    "Check if the fft engine is equal to the direct one on regular grids"
+    west = np.arange(-1000, 1000, 200.0)
+    west, south = [v.ravel() for v in np.meshgrid(west, west + 50)]
+    # two layers, the second one with missing cells
+    model = np.vstack([
+        np.column_stack([west, west + 200, south, south + 200,
+                         np.zeros(west.size), np.full(west.size, 100.0)]),
+        np.column_stack([west, west + 200, south, south + 200,
+                         np.full(west.size, 100.0),
+                         np.full(west.size, 300.0)])[::3],
+    ])
+    density = np.random.default_rng(0).uniform(-500, 500, model.shape[0])
+    # points at two heights, with missing nodes and out of the model
+    y, x = np.meshgrid(np.arange(-1230, 1400, 200.0),
+                       np.arange(-1110, 1200, 400.0))
+    z = np.where(np.arange(y.size) % 2 == 0, -20.0, -150.0)
+    coordinates = np.array([y.ravel(), x.ravel(), z])
+    for field in prism.FIELDS:
+        counts = {}
+        result = prism.gravitational(coordinates, model, density, field,
+                                     engine="fft", counts=counts)
+        parallel = prism.gravitational(coordinates, model, density, field,
+                                       engine="fft", parallel=True)
+        expected = prism.gravitational(coordinates, model, density, field)
+        npt.assert_allclose(result, expected, rtol=1e-10,
+                            atol=1e-11 * np.abs(expected).max())
+        npt.assert_array_equal(parallel, result)
+        # 2 layers, 2 heights and (14 + 10 - 1) * (11 + 10 - 1) offsets
+        assert counts == {"exact": 2 * 2 * 23 * 20, "approximate": 0}
+    # a model without prisms
+    empty = prism.gravitational(coordinates, np.empty((0, 6)), np.empty(0),
+                                "g_z", engine="fft")
+    npt.assert_array_equal(empty, np.zeros(y.size))
+    # no computation points
+    empty = prism.gravitational(np.empty((3, 0)), model, density, "g_z",
+                                engine="fft")
+    assert empty.shape == (0,)
+    # points at distinct heights, computed by the direct engine since the
+    # convolutions would need 2 * 84 * 23 * 20 evaluations
+    coordinates[2] = np.linspace(-200, -10, y.size)
+    counts = {}
+    result = prism.gravitational(coordinates, model, density, "g_z",
+                                 engine="fft", counts=counts)
+    assert counts == {"exact": y.size * model.shape[0], "approximate": 0}
+    npt.assert_array_equal(
+        result, prism.gravitational(coordinates, model, density, "g_z")
+    )
+
+
+def test_invalid_fft_engine():
+    "Check if the fft engine raises errors for grids which are not regular"
+    model = np.array([[0, 100, 0, 100, 100, 200],
+                      [100, 200, 0, 100, 100, 200]], dtype=float)
+    density = np.array([1000, 500])
+    coordinates = np.array([[0, 100], [0, 0], [0, 0]])
+    invalid = [
+        (coordinates, model + [[0] * 6, [0, 50, 0, 0, 0, 0]]),
+        (coordinates, model + [[0] * 6, [30, 30, 0, 0, 0, 0]]),
+        (coordinates + [[0, 20], [0, 0], [0, 0]], model),
+    ]
+    for points, prisms in invalid:
+        with pytest.raises(ValueError):
+            prism.gravitational(points, prisms, density, "g_z", engine="fft")
+    for kwargs in [dict(mesh=True), dict(radius=100), dict(dtype="float32"),
+                   dict(far_field=5)]:
+        with pytest.raises(ValueError):
+            prism.gravitational(coordinates, model, density, "g_z",
+                                engine="fft", **kwargs)
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, ["g_z", "g_x"],
+                            engine="fft")
+
+
+def test_stats():
+    "Check if the stats receive the phases and the number of evaluations"
+    model = np.array([[0, 100, 0, 100, 0, 100],
+                      [-300, -200, 0, 50, 10, 20]])
+    density = np.array([1000, 500])
+    # the first point is a corner of the first prism
+    coordinates = np.array([[0, 50, 300], [0, 20, 300], [0, -10, -200]])
+    stats = {"previous": 1}
+    result = prism.gravitational(coordinates, model, density, "g_z",
+                                 stats=stats)
+    npt.assert_array_equal(
+        result, prism.gravitational(coordinates, model, density, "g_z")
+    )
+    phases = ["check", "setup", "compile", "kernel"]
+    assert set(stats) == set(phases + [
+        "total", "evaluations", "approximate", "rate"
+    ])
+    assert all(stats[phase] >= 0 for phase in phases)
+    npt.assert_allclose(sum(stats[phase] for phase in phases),
+                        stats["total"])
+    assert stats["evaluations"] == 8 * 3 * 2
+    assert stats["approximate"] == 0
+    prism.gravitational(coordinates, model, density, ["g_z", "g_xx"],
+                        mesh=True, stats=stats)
+    # 3 points and 16 vertices
+    assert stats["evaluations"] == 3 * 16
+    prism.gravitational(coordinates, model, density, "potential",
+                        far_field=1, stats=stats)
+    assert stats["approximate"] > 0
+    assert stats["evaluations"] == 8 * (6 - stats["approximate"])
+
+
+def test_stats_singular():
+    "Check if the singular evaluations are counted only if requested"
+    model = np.array([[0, 100, 0, 100, 0, 100],
+                      [-300, -200, 0, 50, 10, 20]])
+    density = np.array([1000, 500])
+    # the first point is a corner of the first prism
+    coordinates = np.array([[0, 50, 300], [0, 20, 300], [0, -10, -200]])
+    for parallel in [False, True]:
+        stats = {"singular": True}
+        prism.gravitational(coordinates, model, density, "g_z",
+                            parallel=parallel, stats=stats)
+        assert stats["singular"] is True
+        # log(Y + radius) is singular at the corner and
+        # atan2(Y * X, Z * radius) at the four corners of the top of the
+        # first prism
+        assert stats["singular_log"] == 1
+        assert stats["singular_atan2"] == 4
+        prism.gravitational(coordinates, model, density, ["g_z", "g_xx"],
+                            parallel=parallel, stats=stats)
+        # atan2(Z * Y, X * radius) is also singular at the corners with
+        # X = 0: two more corners of the first prism and the four south
+        # corners of the second one
+        assert stats["singular_atan2"] == 4 + 2 + 4
+    invalid = [
+        dict(mesh=True), dict(far_field=1), dict(radius=1000),
+        dict(engine="tree", far_field=1),
+    ]
+    for kwargs in invalid:
+        with pytest.raises(ValueError):
+            prism.gravitational(coordinates, model, density, "g_z",
+                                stats={"singular": True}, **kwargs)
+
+
+def test_single_precision():
+    "Check if the single precision results are close to the double ones"
+    shape = (4, 3, 2)
+    density = np.random.default_rng(0).normal(size=shape) * 100 + 2000
+    model, density = _regular_mesh(shape, density)
+    # shift the model and points far from the origin
+    model = model + np.array([5e5, 5e5, 7e6, 7e6, 0, 0])
+    y, x = np.meshgrid(np.linspace(-400, 400, 9), np.linspace(-300, 300, 7))
+    coordinates = np.array([y.ravel() + 5e5, x.ravel() + 7e6,
+                            np.full(y.size, -10.)])
+    double = prism.gravitational(coordinates, model, density, "all")
+    for mesh in [False, True]:
+        single = prism.gravitational(coordinates, model, density, "all",
+                                     dtype="float32", mesh=mesh)
+        for field in prism.FIELDS:
+            assert single[field].dtype == np.float64
+            npt.assert_allclose(single[field], double[field],
+                                atol=1e-4 * np.abs(double[field]).max())
+    for field in ["potential", "g_z", "g_xy"]:
+        single = prism.gravitational(coordinates, model, density, field,
+                                     dtype="float32", parallel=True)
+        npt.assert_allclose(single, double[field],
+                            atol=1e-4 * np.abs(double[field]).max())
+    # a model without prisms
+    for mesh in [False, True]:
+        empty = prism.gravitational(coordinates, np.empty((0, 6)),
+                                    np.empty(0), "g_z", dtype="float32",
+                                    mesh=mesh)
+        npt.assert_array_equal(empty, np.zeros(y.size))
+
+
+def test_single_precision_bounds():
+    "Check if the single precision errors are below the documented bounds"
+    # worst relative errors of each field at 3 and 10 times the cube size
+    bounds = {
+        3: dict(potential=2e-4, g_x=2e-4, g_y=2e-4, g_z=2e-4, g_xx=1e-5,
+                g_yy=1e-5, g_zz=1e-5, g_xy=1e-4, g_xz=1e-4, g_yz=1e-4),
+        10: dict(potential=7e-3, g_x=7e-3, g_y=7e-3, g_z=7e-3, g_xx=3e-4,
+                 g_yy=3e-4, g_zz=3e-4, g_xy=3e-3, g_xz=3e-3, g_yz=3e-3),
+    }
+    rng = np.random.default_rng(3)
+    for side in [50, 300, 1000]:
+        offset = rng.uniform(-1e6, 1e6, 2)
+        model = np.array([[offset[0], offset[0] + side, offset[1],
+                           offset[1] + side, 100, 100 + side]])
+        center = model[0].reshape(3, 2).mean(axis=1)
+        for factor, bound in bounds.items():
+            directions = rng.normal(size=(3, 2000))
+            directions /= np.linalg.norm(directions, axis=0)
+            coordinates = center[:, np.newaxis] + factor * side * directions
+            double = prism.gravitational(coordinates, model, [2670.], "all")
+            single = prism.gravitational(coordinates, model, [2670.], "all",
+                                         dtype="float32")
+            for field in prism.FIELDS:
+                error = np.abs(single[field] - double[field]).max()
+                assert error < bound[field] * np.abs(double[field]).max()
+
+
+def test_invalid_precision():
+    "Check if invalid dtypes raise errors"
+    model = np.array([[-100, 100, -100, 100, 100, 200]])
+    density = np.array([1000])
+    coordinates = np.array([[0], [0], [0]])
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, "g_z",
+                            dtype="int32")
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, "g_z",
+                            dtype="float32", far_field=5)
+
+
+def test_output_buffer():
+    "Check if the result is stored in out and the inputs are not copied"
+    model = np.array([[-100, 100, -100, 100, 100, 200],
+                      [-50, 150, 20, 80, 50, 300]], dtype=float)
+    density = np.array([1000.0, -300.0])
+    coordinates = np.array([[0, 10, 100], [20, -5, 0], [0, 0, -10]],
+                           dtype=float)
+    checked = prism._check_input(coordinates, model, density)
+    for array, original in zip(checked, [coordinates, model, density]):
+        assert array is original
+    for field in ["g_z", "g_zz"]:
+        expected = prism.gravitational(coordinates, model, density, field)
+        out = np.full(3, np.nan)
+        for parallel in [False, True]:
+            result = prism.gravitational(coordinates, model, density, field,
+                                         out=out, parallel=parallel)
+            assert result is out
+            npt.assert_array_equal(out, expected)
+        result = prism.gravitational(coordinates, model, density, field,
+                                     out=out, check_prisms=False)
+        npt.assert_array_equal(out, expected)
+    fields = ["g_x", "potential"]
+    expected = prism.gravitational(coordinates, model, density, fields)
+    out = np.full((2, 3), np.nan)
+    result = prism.gravitational(coordinates, model, density, fields,
+                                 out=out)
+    npt.assert_array_equal(out, [expected["g_x"], expected["potential"]])
+    assert np.shares_memory(result["potential"], out)
+
+
+def test_invalid_output_buffer():
+    "Check if passing an invalid out raises an error"
+    model = np.array([[-100, 100, -100, 100, 100, 200]])
+    density = np.array([1000])
+    coordinates = np.array([[0, 1], [0, 1], [0, 1]])
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, "g_z",
+                            out=np.zeros(3))
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, "g_z",
+                            out=np.zeros(2, dtype="float32"))
+    with pytest.raises(ValueError):
+        prism.gravitational(coordinates, model, density, ["g_z", "g_x"],
+                            out=np.zeros(2))
+
+
+def test_warmup():
+    "Check if warmup compiles the loops for the given fields"
+    prism.warmup("g_z")
+    assert len(prism.jit_gravitational_single.signatures) > 0
+    prism.warmup(["g_x", "g_y"], parallel=True)
+    assert len(prism.jit_gravitational_single_parallel.signatures) > 0
+    assert len(prism.jit_gravitational_fields_parallel.signatures) > 0
+    with pytest.raises(ValueError):
+        prism.warmup("invalid field")
@@ -0,0 +1,153 @@
+import os
+import numpy as np
+import numpy.testing as npt
+import pytest
+import gamma
+import prism
+import reduction
+
+
+def _survey(n_stations=50):
+    "Stations over a topography modeled by prisms"
+    rng = np.random.default_rng(0)
+    west, south = [
+        v.ravel() for v in np.meshgrid(np.arange(-1000, 1000, 200.0),
+                                       np.arange(-1000, 1000, 200.0))
+    ]
+    elevation = rng.uniform(0, 300, west.size)
+    prisms = np.column_stack([west, west + 200, south, south + 200,
+                              -elevation, np.zeros(west.size)])
+    stations = {
+        "latitude": rng.uniform(-22.9, -22.8, n_stations),
+        "height": rng.uniform(300, 400, n_stations),
+        "gravity": rng.uniform(978700, 978800, n_stations),
+        "y": rng.uniform(-900, 900, n_stations),
+        "x": rng.uniform(-900, 900, n_stations),
+    }
+    return stations, prisms
+
+
+def test_reduction_pipeline():
+    "Check if the pipeline gives the reduced gravity computed step by step"
+    stations, prisms = _survey()
+    pipeline = reduction.ReductionPipeline(prisms=prisms, density=2600.0,
+                                           bouguer_density=2670.0,
+                                           chunk_size=15)
+    result = pipeline.run(stations)
+    normal = gamma.closedform(*gamma.WGS84(), stations["latitude"],
+                              stations["height"])
+    coordinates = np.array([stations["y"], stations["x"],
+                            -stations["height"]])
+    topography = prism.gravitational(coordinates, prisms,
+                                     np.full(prisms.shape[0], 2600.0), "g_z")
+    plate = (2 * np.pi * prism.GRAVITATIONAL_CONST * 2670 * 1e5
+             * stations["height"])
+    disturbance = stations["gravity"] - normal
+    npt.assert_allclose(result["normal"], normal, rtol=1e-12)
+    npt.assert_array_equal(result["topography"], topography)
+    npt.assert_allclose(result["plate"], plate)
+    npt.assert_allclose(result["disturbance"], disturbance, atol=1e-6)
+    npt.assert_allclose(result["simple_bouguer"], disturbance - plate,
+                        atol=1e-6)
+    npt.assert_allclose(result["terrain_correction"], plate - topography)
+    npt.assert_allclose(result["complete_bouguer"], disturbance - topography,
+                        atol=1e-6)
+    chunks = list(pipeline.run_chunks(stations))
+    assert [chunk["normal"].size for chunk in chunks] == [15, 15, 15, 5]
+
+
+def test_reduction_pipeline_cache(tmp_path):
+    "Check if only the stages whose inputs changed are computed again"
+    stations, prisms = _survey()
+    pipeline = reduction.ReductionPipeline(prisms=prisms, chunk_size=20,
+                                           directory=str(tmp_path))
+    first = pipeline.run(stations)
+    assert pipeline.computed == {"normal": 3, "topography": 3}
+    # new observations change only the derived results
+    stations["gravity"] = stations["gravity"] + 1
+    second = pipeline.run(stations)
+    assert pipeline.computed == {"normal": 3, "topography": 3}
+    npt.assert_allclose(second["disturbance"], first["disturbance"] + 1)
+    # a new position of the last stations changes their topography only
+    stations["x"][45:] += 10
+    pipeline.run(stations)
+    assert pipeline.computed == {"normal": 3, "topography": 4}
+    # the cached outputs are shared by pipelines using the same directory
+    other = reduction.ReductionPipeline(prisms=prisms, chunk_size=20,
+                                        directory=str(tmp_path))
+    other.run(stations)
+    assert other.computed == {"normal": 0, "topography": 0}
+    # a new density of the topography
+    other = reduction.ReductionPipeline(prisms=prisms, density=2000,
+                                        chunk_size=20,
+                                        directory=str(tmp_path))
+    other.run(stations)
+    assert other.computed == {"normal": 0, "topography": 3}
+    # files not created by the pipeline are not removed
+    data = tmp_path / "data.npy"
+    np.save(str(data), np.zeros(10))
+    cache = prism.SensitivityCache(str(tmp_path))
+    cache.matrix(np.zeros((3, 2)), prisms[:2], "g_z")
+    other.clear()
+    assert data.exists()
+    assert len(cache.entries()) == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        ["data.npy", os.path.basename(cache.entries()[0][0])]
+    )
+    other.run(stations)
+    assert other.computed == {"normal": 3, "topography": 6}
+
+
+def test_reduction_pipeline_without_topography():
+    "Check if the pipeline runs without the topography and x, y"
+    stations, _ = _survey()
+    stations = [
+        {key: stations[key][:25] for key in ["latitude", "height", "gravity"]},
+        {key: stations[key][25:] for key in ["latitude", "height", "gravity"]},
+    ]
+    pipeline = reduction.ReductionPipeline()
+    result = pipeline.run(stations)
+    assert set(result) == {"normal", "plate", "disturbance",
+                           "simple_bouguer"}
+    assert result["normal"].size == 50
+    pipeline.run(stations)
+    assert pipeline.computed == {"normal": 2, "topography": 0}
+
+
+def test_reduction_pipeline_memory():
+    "Check if the outputs cached in memory are bounded by max_bytes"
+    stations, _ = _survey()
+    stations = {key: stations[key] for key in ["latitude", "height",
+                                                "gravity"]}
+    # outputs of 20, 20 and 10 stations with 160, 160 and 80 bytes
+    pipeline = reduction.ReductionPipeline(chunk_size=20, max_bytes=320)
+    first = pipeline.run(stations)
+    # the first chunk was removed to store the last one
+    pipeline.run({key: stations[key][20:] for key in stations})
+    assert pipeline.computed == {"normal": 3, "topography": 0}
+    second = pipeline.run({key: stations[key][:20] for key in stations})
+    assert pipeline.computed == {"normal": 4, "topography": 0}
+    npt.assert_array_equal(second["normal"], first["normal"][:20])
+    # the last output is kept even if it is larger than max_bytes
+    pipeline = reduction.ReductionPipeline(chunk_size=20, max_bytes=0)
+    pipeline.run(stations)
+    pipeline.run(stations)
+    assert pipeline.computed == {"normal": 6, "topography": 0}
+    pipeline.run({key: stations[key][40:] for key in stations})
+    assert pipeline.computed == {"normal": 6, "topography": 0}
+
+
+def test_invalid_reduction_pipeline():
+    "Check if invalid parameters of ReductionPipeline raise errors"
+    stations, prisms = _survey()
+    with pytest.raises(ValueError):
+        reduction.ReductionPipeline(chunk_size=0)
+    with pytest.raises(ValueError):
+        reduction.ReductionPipeline(prisms=prisms[:, ::-1])
+    pipeline = reduction.ReductionPipeline(prisms=prisms)
+    with pytest.raises(ValueError):
+        pipeline.run({key: stations[key] for key in ["latitude", "height",
+                                                    "gravity"]})
+    stations["y"] = stations["y"][:10]
+    with pytest.raises(ValueError):
+        pipeline.run(stations)